@@ -1,21 +1,27 @@
 import os
 from flask import Flask
-from flask_mail import Mail
 from flask_login import LoginManager
 #from flask_assets import Environment
 from flask_wtf import CsrfProtect
 #from flask_compress import Compress
-from flask_s3 import FlaskS3
 
 from config import config
+from clients import ClientPool
+from cache import CacheRegistry
+from lazy import LazyExtension, static_url_for
+from metrics import CallMetrics
 #from assets import app_css, app_js, vendor_css, vendor_js
 
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-s3 = FlaskS3()
-mail = Mail()
+# Flask-S3 and Flask-Mail are imported the first time they are used
+s3 = LazyExtension('flask_s3:FlaskS3')
+mail = LazyExtension('flask_mail:Mail')
 csrf = CsrfProtect()
+clients = ClientPool()
+caches = CacheRegistry()
+call_metrics = CallMetrics()
 #compress = Compress()
 # Set up Flask-Login
 login_manager = LoginManager()
@@ -36,9 +42,22 @@ def create_app(config_name):
     csrf.init_app(app)
     #compress.init_app(app)
     s3.init_app(app)
+    app.jinja_env.globals['url_for'] = static_url_for(s3)
+    call_metrics.init_app(app)
+    clients.init_app(app)
+    caches.init_app(app)
+
+    from dynamodb import configure_models
+    configure_models(app)
+
+    from sessions import init_sessions
+    init_sessions(app)
+
+    from .email import email_batcher
+    email_batcher.init_app(app)
 
     # Register Jinja template functions
-    from utils import register_template_utils
+    from utils import configure_template_cache, register_template_utils
     register_template_utils(app)
 
     '''
@@ -71,4 +90,7 @@ def create_app(config_name):
         from administrator import admin as admin_blueprint
         app.register_blueprint(admin_blueprint, url_prefix='/administrator')
 
+    # Needs the blueprints' template folders, so runs after registering them
+    configure_template_cache(app)
+
     return app
@@ -4,7 +4,8 @@ from flask.ext.login import (current_user, login_required, login_user,
 
 from . import account
 from ..email import send_email
-from app.cognito_handler import get_user
+from ..sessions import regenerate_session
+from app.cognito_handler import clear_session_tokens, get_user
 from .forms import (ChangePasswordForm, CreatePasswordForm,
                     LoginForm, RegistrationForm, RequestResetPasswordForm,
                     ResetPasswordForm)
@@ -17,6 +18,7 @@ def login():
     if form.validate_on_submit():
         user = get_user(form.email.data)
         if user is not None:
+            regenerate_session()
             login_user(user, form.remember_me.data)
             flash('You are now logged in. Welcome back!', 'success')
             return redirect(request.args.get('next') or url_for('main.index'))
@@ -42,7 +44,7 @@ def register():
             recipient=user.email,
             subject='Confirm Your Account',
             template='account/email/confirm',
-            user=user,
+            user=user.email_context(),
             confirm_link=confirm_link)
         flash('A confirmation link has been sent to {}.'.format(user.email),
               'warning')
@@ -54,6 +56,9 @@ def register():
 @login_required
 def logout():
     logout_user()
+    clear_session_tokens()
+    # Drops the stored session; the flash below starts a new one
+    regenerate_session()
     flash('You have been logged out.', 'info')
     return redirect(url_for('main.index'))
 
@@ -82,7 +87,7 @@ def reset_password_request():
                 recipient=user.email,
                 subject='Reset Your Password',
                 template='account/email/reset_password',
-                user=user,
+                user=user.email_context(),
                 reset_link=reset_link,
                 next=request.args.get('next'))
         flash('A password reset link has been sent to {}.'
@@ -119,15 +124,18 @@ def change_password():
     """Change an existing user's password."""
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if current_user.verify_password(form.old_password.data):
-            current_user.password = form.new_password.data
-            #db.session.add(current_user)
-            #db.session.commit()
-            current_user.save()
+        try:
+            # change_password also drops the user from the user_loader cache
+            current_user.change_password(
+                previous_password=form.old_password.data,
+                new_password=form.new_password.data,
+                access_token=session['access_token'])
+        except Exception:
+            # Cognito raises NotAuthorizedException, declared in a json within botocore.
+            flash('Original password is invalid.', 'form-error')
+        else:
             flash('Your password has been updated.', 'form-success')
             return redirect(url_for('main.index'))
-        else:
-            flash('Original password is invalid.', 'form-error')
     return render_template('account/manage.html', form=form)
 
 
@@ -141,8 +149,7 @@ def confirm_request():
         recipient=current_user.email,
         subject='Confirm Your Account',
         template='account/email/confirm',
-        # current_user is a LocalProxy, we want the underlying user object
-        user=current_user._get_current_object(),
+        user=current_user.email_context(),
         confirm_link=confirm_link)
     flash('A new confirmation link has been sent to {}.'.format(
         current_user.email), 'warning')
@@ -163,7 +170,7 @@ def confirm(token):
 
 
 @account.route(
-    '/join-from-invite/<int:user_id>/<token>', methods=['GET', 'POST'])
+    '/join-from-invite/<user_id>/<token>', methods=['GET', 'POST'])
 def join_from_invite(user_id, token):
     """
     Confirm new user's account with provided token and prompt them to set
@@ -206,7 +213,7 @@ def join_from_invite(user_id, token):
             recipient=new_user.email,
             subject='You Are Invited To Join',
             template='account/email/invite',
-            user=new_user,
+            user=new_user.email_context(),
             invite_link=invite_link)
     return redirect(url_for('main.index'))
 
@@ -1,13 +1,18 @@
 from flask.ext.wtf import Form
+from flask.ext.wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import ValidationError
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
-from wtforms.fields import PasswordField, StringField, SubmitField
+from wtforms.fields import BooleanField, PasswordField, StringField, SubmitField
 from wtforms.fields.html5 import EmailField
 from wtforms.validators import Email, EqualTo, InputRequired, Length
 
 #from .. import db
 from ..models import User
-from app.cognito_handler import list_groups, user_exists
+from app.cognito_handler import group_catalogue, user_exists
+
+
+def group_name(group):
+    return group.name
 
 
 class ChangeUserEmailForm(Form):
@@ -24,9 +29,11 @@ class ChangeAccountTypeForm(Form):
     group = QuerySelectField(
         'New account type',
         validators=[InputRequired()],
-        get_label='name',
+        get_pk=group_name,
+        get_label=group_name,
         #query_factory=lambda: db.session.query(Role).order_by('permissions'))
-        query_factory=list_groups())
+        # Called when the form is built, not when this module is imported
+        query_factory=group_catalogue)
     submit = SubmitField('Update role')
 
 
@@ -34,8 +41,9 @@ class InviteUserForm(Form):
     role = QuerySelectField(
         'Account type',
         validators=[InputRequired()],
-        get_label='name',
-        query_factory=list_groups())
+        get_pk=group_name,
+        get_label=group_name,
+        query_factory=group_catalogue)
     first_name = StringField(
         'First name', validators=[InputRequired(), Length(1, 64)])
     last_name = StringField(
@@ -58,3 +66,17 @@ class NewUserForm(InviteUserForm):
     password2 = PasswordField('Confirm password', validators=[InputRequired()])
 
     submit = SubmitField('Create')
+
+
+class ImportUsersForm(Form):
+    file = FileField(
+        'CSV file',
+        validators=[FileRequired(), FileAllowed(['csv'], 'Upload a .csv file.')])
+    role = QuerySelectField(
+        'Account type for rows without a group',
+        validators=[InputRequired()],
+        get_pk=group_name,
+        get_label=group_name,
+        query_factory=group_catalogue)
+    invite = BooleanField('Email each new user an invitation', default=True)
+    submit = SubmitField('Import')
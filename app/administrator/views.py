@@ -1,13 +1,23 @@
-from flask import abort, flash, redirect, render_template, url_for, request
+from flask import (Response, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, session, stream_with_context, url_for)
 from flask.ext.login import current_user, login_required
 
-from forms import (ChangeAccountTypeForm, InviteUserForm,
+from forms import (ChangeAccountTypeForm, ImportUsersForm, InviteUserForm,
                    NewUserForm)
 from . import admin
+from .. import caches, call_metrics
 from ..decorators import admin_required
-from ..email import send_email
-from ..models import User, EditableHTML
-from app.cognito_handler import get_user
+from ..email import email_batcher
+from ..models import User, EditableHTML, UserDirectoryEntry
+from ..user_export import (EXPORT_ATTRIBUTES, csv_lines, export_columns,
+                           iter_export_rows, ndjson_lines)
+from ..user_import import import_users, read_rows, send_invite
+from app.cognito_handler import (create_user, get_user, group_catalogue,
+                                 list_users_page, users_filter)
+
+# Values of Cognito's cognito:user_status attribute
+USER_STATUSES = ['CONFIRMED', 'UNCONFIRMED', 'FORCE_CHANGE_PASSWORD',
+                 'RESET_REQUIRED', 'ARCHIVED', 'COMPROMISED']
 
 
 @admin.route('/')
@@ -25,13 +35,14 @@ def new_user():
     """Create a new user."""
     form = NewUserForm()
     if form.validate_on_submit():
-        user = User(
-            group=form.role.data,
-            first_name=form.first_name.data,
-            last_name=form.last_name.data,
+        user = create_user(
             email=form.email.data,
-            password=form.password.data)
-        user.save()
+            given_name=form.first_name.data,
+            family_name=form.last_name.data,
+            group=form.role.data.name,
+            password=form.password.data,
+            permanent=True)
+        UserDirectoryEntry.sync_user(user)
         flash('User {} successfully created'.format(user.full_name()),
               'form-success')
     return render_template('administrator/new_user.html', form=form)
@@ -44,43 +55,150 @@ def invite_user():
     """Invites a new user to create an account and set their own password."""
     form = InviteUserForm()
     if form.validate_on_submit():
-        user = User(
-            group=form.role.data,
-            first_name=form.first_name.data,
-            last_name=form.last_name.data,
-            email=form.email.data)
-        #db.session.add(user)
-        #db.session.commit()
-        user.save()
-        token = user.generate_confirmation_token()
-        invite_link = url_for(
-            'account.join_from_invite',
-            user_id=user.id,
-            token=token,
-            _external=True)
-        send_email(
-            recipient=user.email,
-            subject='You Are Invited To Join',
-            template='account/email/invite',
-            user=user,
-            invite_link=invite_link, )
+        user = create_user(
+            email=form.email.data,
+            given_name=form.first_name.data,
+            family_name=form.last_name.data,
+            group=form.role.data.name)
+        UserDirectoryEntry.sync_user(user)
+        send_invite(user)
         flash('User {} successfully invited'.format(user.full_name()),
               'form-success')
     return render_template('administrator/new_user.html', form=form)
 
 
+@admin.route('/import-users', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_users_from_csv():
+    """Creates and invites users from an uploaded CSV file, reporting errors per row.
+
+    The file needs email, first_name and last_name columns and may have a
+    group column. At most IMPORT_USERS_MAX_ROWS rows are imported per
+    upload; use `manage.py import_users` for larger files.
+    """
+    form = ImportUsersForm()
+    report = None
+    if form.validate_on_submit():
+        try:
+            rows = read_rows(form.file.data.stream)
+        except ValueError as e:
+            flash(str(e), 'form-error')
+        else:
+            report = import_users(
+                rows, form.role.data.name,
+                invite=form.invite.data,
+                workers=current_app.config['IMPORT_USERS_WORKERS'],
+                rate=current_app.config['IMPORT_USERS_RATE'],
+                max_rows=current_app.config['IMPORT_USERS_MAX_ROWS'])
+            flash('Created {0} of {1} users.'.format(len(report.created), report.rows),
+                  'form-success' if not report.errors else 'form-info')
+    return render_template('administrator/import_users.html', form=form, report=report)
+
+
+@admin.route('/users/export')
+@login_required
+@admin_required
+def export_users():
+    """Streams every user as CSV (format=csv, the default) or NDJSON (format=ndjson).
+
+    attributes is a comma separated subset of EXPORT_ATTRIBUTES to include
+    (email always is), groups=0 leaves out group memberships, and search
+    and status narrow the export as on the registered users page. Users are
+    written as each Cognito page arrives, so the export never holds more
+    than a page in memory.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        abort(400)
+    requested = request.args.get('attributes')
+    attributes = [a for a in requested.split(',') if a in EXPORT_ATTRIBUTES] \
+        if requested else list(EXPORT_ATTRIBUTES)
+    attributes = ['email'] + [a for a in attributes if a != 'email']
+    include_groups = request.args.get('groups', '1') != '0'
+    rows = iter_export_rows(
+        attributes=attributes, include_groups=include_groups,
+        filter_expression=users_filter(email_prefix=request.args.get('search', '').strip(),
+                                       status=request.args.get('status', '')),
+        workers=current_app.config['EXPORT_USERS_WORKERS'])
+
+    if export_format == 'csv':
+        lines = csv_lines(rows, export_columns(attributes, include_groups))
+        mimetype = 'text/csv'
+    else:
+        lines = ndjson_lines(rows)
+        mimetype = 'application/x-ndjson'
+    return Response(
+        stream_with_context(lines), mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename=users.{0}'.format(export_format)})
+
+
 @admin.route('/users')
 @login_required
 @admin_required
 def registered_users():
-    """View all registered users."""
-    users = User.list_users()
+    """View registered users one page at a time.
+
+    With USER_DIRECTORY_ENABLED the page is read from the DynamoDB user
+    directory, which can sort by name and filter by group and last name.
+    Otherwise it comes straight from Cognito, filtered by email prefix or
+    status. Either way pages are addressed by forward-only cursors, so the
+    cursors of the last ADMIN_USERS_CURSOR_HISTORY pages visited are kept in
+    the session to support previous links. Going back past them starts
+    again from the first page.
+    """
+    page = request.args.get('page', 0, type=int)
+    page_size = current_app.config['ADMIN_USERS_PAGE_SIZE']
+    directory = UserDirectoryEntry.enabled_for_app()
+    search = request.args.get('search', '').strip()
+    selected = request.args.get('group' if directory else 'status', '')
+    if directory:
+        filter_key = [selected, search]
+
+        def fetch(cursor):
+            return UserDirectoryEntry.page(
+                group=selected, name_prefix=search, after=cursor, limit=page_size)
+    else:
+        filter_key = users_filter(email_prefix=search, status=selected)
+
+        def fetch(cursor):
+            return list_users_page(
+                pagination_token=cursor, limit=page_size,
+                filter_expression=filter_key)
+
+    # tokens[i] is the cursor of page first + i
+    cursors = session.get('registered_users_cursors')
+    if not cursors or cursors.get('filter') != filter_key \
+            or not 0 <= page - cursors.get('first', 0) < len(cursors['tokens']):
+        page = 0
+        cursors = {'filter': filter_key, 'first': 0, 'tokens': [None]}
+    index = page - cursors.get('first', 0)
+
+    users, next_cursor = fetch(cursors['tokens'][index])
+
+    del cursors['tokens'][index + 1:]
+    if next_cursor:
+        cursors['tokens'].append(next_cursor)
+    overflow = len(cursors['tokens']) - current_app.config['ADMIN_USERS_CURSOR_HISTORY']
+    if overflow > 0:
+        del cursors['tokens'][:overflow]
+        cursors['first'] = cursors.get('first', 0) + overflow
+    session['registered_users_cursors'] = cursors
+
+    if directory:
+        choices = [g.name for g in group_catalogue()]
+        filter_args = {'group': selected}
+    else:
+        choices = USER_STATUSES
+        filter_args = {'status': selected}
     return render_template(
-        'administrator/registered_users.html', users=users)
+        'administrator/registered_users.html', users=users,
+        directory=directory, search=search, selected=selected, choices=choices,
+        filter_args=filter_args, page=page, has_next=next_cursor is not None)
 
 
-@admin.route('/user/<int:user_id>')
-@admin.route('/user/<int:user_id>/info')
+@admin.route('/user/<email>')
+@admin.route('/user/<email>/info')
 @login_required
 @admin_required
 def user_info(email):
@@ -92,7 +210,7 @@ def user_info(email):
 
 
 @admin.route(
-    '/user/<int:email>/change-account-type', methods=['GET', 'POST'])
+    '/user/<email>/change-account-type', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def change_account_type(email):
@@ -102,42 +220,44 @@ def change_account_type(email):
               'another administrator to do this.', 'error')
         return redirect(url_for('.user_info', email=email))
 
-    user = User.get_user(email)
+    user = get_user(email)
     if user is None:
         abort(404)
     form = ChangeAccountTypeForm()
     if form.validate_on_submit():
-        user.group = form.role.data
-        user.save()
+        # change_group also drops the user from the user_loader cache
+        user.change_group(form.group.data.name)
+        UserDirectoryEntry.sync_user(user)
         flash('Role for user {} successfully changed to {}.'
               .format(user.full_name(), user.group['GroupName']), 'form-success')
     return render_template('administrator/manage_user.html', user=user, form=form)
 
 
-@admin.route('/user/<int:user_id>/delete')
+@admin.route('/user/<email>/delete')
 @login_required
 @admin_required
-def delete_user_request(user_id):
+def delete_user_request(email):
     """Request deletion of a user's account."""
-    user = User.get(user_id)
+    user = get_user(email)
     if user is None:
         abort(404)
     return render_template('administrator/manage_user.html', user=user)
 
 
-@admin.route('/user/<int:user_id>/_delete')
+@admin.route('/user/<email>/_delete')
 @login_required
 @admin_required
-def delete_user(user_id):
+def delete_user(email):
     """Delete a user's account."""
-    if current_user.id == user_id:
+    if current_user.email == email:
         flash('You cannot delete your own account. Please ask another '
               'administrator to do this.', 'error')
     else:
-        user = User.get(user_id)
-        #db.session.delete(user)
-        #db.session.commit()
-        user.save()
+        user = get_user(email)
+        if user is None:
+            abort(404)
+        user.delete()
+        UserDirectoryEntry.remove_user(email)
         flash('Successfully deleted user %s.' % user.full_name(), 'success')
     return redirect(url_for('.registered_users'))
 
@@ -151,13 +271,41 @@ def update_editor_contents():
     edit_data = request.form.get('edit_data')
     editor_name = request.form.get('editor_name')
 
-    editor_contents = EditableHTML.get(editor_name)
-    if editor_contents is None:
-        editor_contents = EditableHTML(editor_name=editor_name)
-    editor_contents.value = edit_data
-
-    #db.session.add(editor_contents)
-    #db.session.commit()
-    editor_contents.save()
+    # Bumps the version and refreshes this process's cached copy
+    EditableHTML.update_contents(editor_name, edit_data)
 
     return 'OK', 200
+
+
+@admin.route('/groups/refresh', methods=['POST'])
+@login_required
+@admin_required
+def refresh_groups():
+    """Reload the cached list of account types after groups change in Cognito."""
+    groups = group_catalogue(refresh=True)
+    flash('Reloaded {0} account types.'.format(len(groups)), 'success')
+    return redirect(request.referrer or url_for('administrator.index'))
+
+
+@admin.route('/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Hit/miss counters for the in-process caches, for monitoring."""
+    return jsonify(caches.stats())
+
+
+@admin.route('/email-stats')
+@login_required
+@admin_required
+def email_stats():
+    """Email queue depth and background dispatch counters, for monitoring."""
+    return jsonify(email_batcher.stats())
+
+
+@admin.route('/call-metrics')
+@login_required
+@admin_required
+def call_metrics_stats():
+    """Latency histograms of Cognito and DynamoDB calls per operation, for monitoring."""
+    return jsonify(call_metrics.stats())
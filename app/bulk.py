@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+# AWS error codes that mean "slow down or try again", not "this request is wrong"
+RETRYABLE_ERROR_CODES = frozenset([
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'LimitExceededException',
+    'ProvisionedThroughputExceededException',
+    'InternalErrorException',
+    'ServiceUnavailable',
+])
+
+
+class RateLimiter(object):
+    """Spaces calls out to at most rate per second, across all threads.
+
+    Each acquire() reserves the next free slot and sleeps until it comes
+    round. A rate of None or 0 disables limiting.
+    """
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = self.clock()
+            wait = self._next - now
+            self._next = max(now, self._next) + 1.0 / self.rate
+        if wait > 0:
+            self.sleep(wait)
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    return isinstance(error, EndpointConnectionError)
+
+
+def call_with_backoff(func, retries=5, base_delay=0.1, max_delay=5.0,
+                      sleep=time.sleep, on_retry=None):
+    """Calls func(), retrying throttling and transient AWS errors.
+
+    Waits a random time of up to base_delay * 2 ** attempt (capped at
+    max_delay) between attempts, so that many threads backing off at once
+    don't retry in lockstep. Other errors, and the last retryable one, are
+    raised.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            attempt += 1
+
+
+class BulkResult(object):
+    """Outcome of run_bulk: results, per-item failures and throughput."""
+
+    def __init__(self):
+        self.results = []
+        # (item, exception) pairs
+        self.failures = []
+        self.retries = 0
+        self.elapsed = 0.0
+
+    @property
+    def succeeded(self):
+        return len(self.results)
+
+    @property
+    def throughput(self):
+        """Successful items per second"""
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+
+def run_bulk(app, func, items, workers=8, rate=None, retries=5, progress=None):
+    """Calls func(item, call) for every item on a thread pool, inside app's context.
+
+    func should make each AWS request through call(f), which waits for the
+    rate limit (rate requests per second across all workers) and retries f
+    with backoff if it is throttled (see call_with_backoff). Limiting and
+    retrying single requests, rather than whole items, means a throttled
+    second step never repeats a first one that already succeeded.
+
+    An item whose func still raises is recorded in the result's failures
+    rather than stopping the run. progress, if given, is called with the
+    result after each item.
+    """
+    limiter = RateLimiter(rate)
+    result = BulkResult()
+    lock = threading.Lock()
+
+    def count_retry(_):
+        with lock:
+            result.retries += 1
+
+    def call(f):
+        def limited():
+            limiter.acquire()
+            return f()
+        return call_with_backoff(limited, retries=retries, on_retry=count_retry)
+
+    def run(item):
+        with app.app_context():
+            try:
+                return item, func(item, call), None
+            except Exception as e:
+                return item, None, e
+
+    start = time.time()
+    pool = ThreadPool(workers)
+    try:
+        for item, value, error in pool.imap_unordered(run, items):
+            with lock:
+                if error is None:
+                    result.results.append(value)
+                else:
+                    result.failures.append((item, error))
+                result.elapsed = time.time() - start
+            if progress is not None:
+                progress(result)
+    finally:
+        pool.close()
+        pool.join()
+    result.elapsed = time.time() - start
+    return result
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class TTLCache(object):
+    """A thread-safe, in-process LRU cache whose entries expire after ttl seconds.
+
+    Hits, misses and evictions are counted so they can be exposed for
+    monitoring through stats().
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self.clock():
+                self.misses += 1
+                return default
+            # Re-insert to mark the key as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Returns the cached value for key, calling factory() on a miss.
+
+        None results are not cached, so a missing record is looked up again
+        on the next call.
+        """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            if value is not None:
+                self.set(key, value, ttl=ttl)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class CacheRegistry(object):
+    """Named TTLCaches attached to the app.
+
+    A cache called 'user' is sized from the USER_CACHE_TTL and
+    USER_CACHE_MAX_ENTRIES config values, falling back to CACHE_DEFAULT_TTL
+    and CACHE_DEFAULT_MAX_ENTRIES.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_DEFAULT_TTL', 60)
+        app.config.setdefault('CACHE_DEFAULT_MAX_ENTRIES', 1024)
+        app.extensions['caches'] = {}
+
+    def get(self, name, app=None):
+        app = app or current_app._get_current_object()
+        caches = app.extensions['caches']
+        cache = caches.get(name)
+        if cache is None:
+            with self._lock:
+                cache = caches.get(name)
+                if cache is None:
+                    prefix = name.upper()
+                    cache = TTLCache(
+                        ttl=app.config.get(prefix + '_CACHE_TTL',
+                                           app.config['CACHE_DEFAULT_TTL']),
+                        max_entries=app.config.get(
+                            prefix + '_CACHE_MAX_ENTRIES',
+                            app.config['CACHE_DEFAULT_MAX_ENTRIES']))
+                    caches[name] = cache
+        return cache
+
+    def stats(self, app=None):
+        """Returns hit/miss counters for every cache created so far."""
+        app = app or current_app._get_current_object()
+        return dict((name, cache.stats())
+                    for name, cache in app.extensions['caches'].items())
@@ -0,0 +1,84 @@
+import threading
+
+from flask import current_app
+
+from .metrics import CallMetrics, InstrumentedClient
+
+
+class ClientPool(object):
+    """Process-wide registry of boto3 clients, shared by every request.
+
+    Building a boto3 client loads the botocore service model from disk, which
+    costs tens of milliseconds, so each service client is created once per app
+    and reused. boto3 clients are thread-safe; the session used to build them
+    is not, so creation is guarded by a lock.
+
+    Relevant config values:
+
+    - ``AWS_REGION``: region passed to every client (defaults to the
+      environment's boto3 configuration).
+    - ``AWS_MAX_POOL_CONNECTIONS``: size of each client's urllib3 pool.
+    - ``AWS_ENDPOINT_URLS``: mapping of service name to endpoint URL, used to
+      point a service at a local stand-in.
+    - ``IDENTITY_BACKEND``: 'cognito', or 'memory' to answer cognito-idp
+      calls from an in-process pool (see app.identity).
+
+    When call metrics are enabled clients come wrapped in an
+    InstrumentedClient, which times each call.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AWS_REGION', None)
+        app.config.setdefault('AWS_MAX_POOL_CONNECTIONS', 10)
+        app.config.setdefault('AWS_ENDPOINT_URLS', {})
+        app.config.setdefault('IDENTITY_BACKEND', 'cognito')
+        app.extensions['client_pool'] = {}
+
+    def get(self, service_name, app=None):
+        """Returns the shared client for service_name, creating it on first use."""
+        app = app or current_app._get_current_object()
+        clients = app.extensions['client_pool']
+        client = clients.get(service_name)
+        if client is None:
+            with self._lock:
+                client = clients.get(service_name)
+                if client is None:
+                    client = self._create_client(app, service_name)
+                    if CallMetrics.enabled(app):
+                        client = InstrumentedClient(client, service_name)
+                    clients[service_name] = client
+        return client
+
+    def clear(self, app=None):
+        """Drops every cached client, e.g. after changing credentials."""
+        app = app or current_app._get_current_object()
+        with self._lock:
+            app.extensions['client_pool'].clear()
+
+    @staticmethod
+    def _create_client(app, service_name):
+        if service_name == 'cognito-idp':
+            backend = app.config['IDENTITY_BACKEND']
+            if backend == 'memory':
+                from .identity import InMemoryCognito
+                from .tokens import cognito_issuer
+                pool_id = app.config['COGNITO_POOL_ID']
+                return InMemoryCognito(pool_id, app.config['COGNITO_APP_CLIENT_ID'],
+                                       issuer=cognito_issuer(pool_id))
+            if backend != 'cognito':
+                raise ValueError('Unknown IDENTITY_BACKEND {0!r}'.format(backend))
+
+        import boto3
+        from botocore.config import Config as BotoConfig
+
+        session = boto3.session.Session(region_name=app.config['AWS_REGION'])
+        return session.client(
+            service_name,
+            endpoint_url=app.config['AWS_ENDPOINT_URLS'].get(service_name),
+            config=BotoConfig(
+                max_pool_connections=app.config['AWS_MAX_POOL_CONNECTIONS']))
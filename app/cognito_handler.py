@@ -1,15 +1,104 @@
-import boto3
+from collections import namedtuple
+
 from flask import current_app, session
 
-from app.models import User, AnonymousUser
-from . import login_manager
+from app.models import User, AnonymousUser, UserDirectoryEntry
+from . import caches, clients, login_manager
+from .sessions import regenerate_session
 
 login_manager.anonymous_user = AnonymousUser
 
+# The largest page Cognito's list_users will return
+MAX_USERS_PAGE_SIZE = 60
+# The largest page Cognito's list_groups will return
+MAX_GROUPS_PAGE_SIZE = 60
+
+# Session keys set by store_session_tokens
+SESSION_TOKEN_KEYS = ('id_token', 'access_token', 'refresh_token', 'expires_in', 'token_type')
+
+# A Cognito group as offered in admin forms
+Group = namedtuple('Group', ['name', 'description', 'precedence'])
+
 
 @login_manager.user_loader
 def user_loader(email):
-    return get_user(email)
+    if current_app.config['COGNITO_TOKEN_LOADER'] and session.get('id_token'):
+        user = user_from_session_tokens(email)
+        if user is not None:
+            return user
+        if not session.get('id_token'):
+            # The tokens expired and could not be refreshed, so the login is
+            # over; looking the user up in Cognito would extend it
+            return
+    return caches.get('user').get_or_set(email, lambda: get_user(email))
+
+
+def user_from_session_tokens(email):
+    """Builds the user from the ID token stored in the session, without calling Cognito.
+
+    Cognito is only contacted when the ID token has expired and has to be
+    refreshed. Returns None if the tokens are missing, invalid, cannot be
+    refreshed or belong to someone other than email; tokens that cannot be
+    refreshed are dropped from the session.
+    """
+    # python-jose is only needed once someone is logged in
+    from jose.exceptions import ExpiredSignatureError, JWTError
+    from .tokens import verify_id_token
+
+    try:
+        claims = verify_id_token(session['id_token'])
+    except ExpiredSignatureError:
+        if not refresh_session_tokens():
+            return
+        try:
+            claims = verify_id_token(session['id_token'])
+        except JWTError:
+            return
+    except JWTError:
+        return
+
+    if claims.get('email') != email:
+        return
+    return User.from_claims(claims)
+
+
+def refresh_session_tokens(boto3_session=None):
+    """Exchanges the session's refresh token for new ID and access tokens.
+
+    Returns True on success. On failure the stale tokens are dropped from the
+    session.
+    """
+    client = cognito_client(boto3_session)
+    try:
+        response = client.admin_initiate_auth(
+            UserPoolId=current_app.config['COGNITO_POOL_ID'],
+            ClientId=current_app.config['COGNITO_APP_CLIENT_ID'],
+            AuthFlow='REFRESH_TOKEN_AUTH',
+            AuthParameters={'REFRESH_TOKEN': session.get('refresh_token', '')})
+    except Exception:
+        # NotAuthorizedException is declared in a json within botocore.
+        clear_session_tokens()
+        return False
+
+    store_session_tokens(response['AuthenticationResult'])
+    return True
+
+
+def store_session_tokens(result):
+    """Stores the tokens from a Cognito AuthenticationResult in the session."""
+    session['expires_in'] = result['ExpiresIn']
+    session['id_token'] = result['IdToken']
+    session['access_token'] = result['AccessToken']
+    session['token_type'] = result['TokenType']
+    # Refreshing does not issue a new refresh token
+    if 'RefreshToken' in result:
+        session['refresh_token'] = result['RefreshToken']
+
+
+def clear_session_tokens():
+    """Drops the Cognito tokens from the session."""
+    for key in SESSION_TOKEN_KEYS:
+        session.pop(key, None)
 
 
 @login_manager.request_loader
@@ -20,33 +109,202 @@ def request_loader(request):
         return authenticate_user(username=email, password=password)
 
 
+def cognito_client(boto3_session=None):
+    """Returns the shared Cognito client, or a client from boto3_session if one is given."""
+    if boto3_session:
+        return boto3_session.client('cognito-idp')
+    return clients.get('cognito-idp')
+
+
 def list_groups(boto3_session=None):
-    if not boto3_session:
-        boto3_session = boto3.Session()
+    """Returns every group in the pool as raw Cognito records, following NextToken."""
+    client = cognito_client(boto3_session)
+    params = {'UserPoolId': current_app.config['COGNITO_POOL_ID'],
+              'Limit': MAX_GROUPS_PAGE_SIZE}
+    groups = []
+    while True:
+        response = client.list_groups(**params)
+        groups.extend(response.get('Groups', []))
+        if not response.get('NextToken'):
+            return groups
+        params['NextToken'] = response['NextToken']
 
-    client = boto3_session.client('cognito-idp')
-    response = client.list_groups(
-        UserPoolId=current_app.config['COGNITO_POOL_ID']
-    )
-    return response.get('Groups', [])
 
+def group_catalogue(refresh=False, boto3_session=None):
+    """Returns the pool's groups as Group tuples, ordered by precedence.
 
-def list_users(boto3_session=None):
-    if not boto3_session:
-        boto3_session = boto3.Session()
+    Groups rarely change, so the list is kept in the 'group' cache for
+    GROUP_CACHE_TTL seconds. Pass refresh=True to reload it from Cognito
+    straight away.
+    """
+    cache = caches.get('group')
+    if refresh:
+        cache.invalidate('all')
+    return cache.get_or_set('all', lambda: load_group_catalogue(boto3_session))
+
+
+def load_group_catalogue(boto3_session=None):
+    groups = [Group(name=g['GroupName'],
+                    description=g.get('Description', ''),
+                    precedence=g.get('Precedence', 0))
+              for g in list_groups(boto3_session)]
+    return tuple(sorted(groups, key=lambda g: (g.precedence, g.name)))
 
-    client = boto3_session.client('cognito-idp')
+
+def list_users(boto3_session=None):
+    client = cognito_client(boto3_session)
     response = client.list_users(
         UserPoolId=current_app.config['COGNITO_POOL_ID']
     )
     return response.get('Users', [])
 
 
-def get_user(email, boto3_session=None):
-    if not boto3_session:
-        boto3_session = boto3.Session()
+def users_filter(email_prefix=None, status=None):
+    """Builds a Cognito list_users Filter expression.
+
+    Cognito accepts a single expression, so an email prefix takes priority
+    over a status filter.
+    """
+    if email_prefix:
+        return 'email ^= "{0!s}"'.format(email_prefix.replace('"', ''))
+    if status:
+        return 'cognito:user_status = "{0!s}"'.format(status.replace('"', ''))
 
-    client = boto3_session.client('cognito-idp')
+
+def list_users_page(pagination_token=None, limit=None, filter_expression=None,
+                    attributes=None, boto3_session=None):
+    """Fetches one page of users.
+
+    Returns a (users, next_token) tuple; next_token is None on the last page.
+    Cognito caps limit at 60.
+    """
+    client = cognito_client(boto3_session)
+    params = {
+        'UserPoolId': current_app.config['COGNITO_POOL_ID'],
+        'Limit': min(limit or MAX_USERS_PAGE_SIZE, MAX_USERS_PAGE_SIZE),
+    }
+    if pagination_token:
+        params['PaginationToken'] = pagination_token
+    if filter_expression:
+        params['Filter'] = filter_expression
+    if attributes:
+        params['AttributesToGet'] = attributes
+    response = client.list_users(**params)
+    users = [user_from_record(record) for record in response.get('Users', [])]
+    return users, response.get('PaginationToken')
+
+
+def iter_users(filter_expression=None, page_size=None, attributes=None,
+               boto3_session=None):
+    """Yields every user in the pool, one page at a time.
+
+    Only a single page is held in memory, so this is safe to use on pools
+    of any size.
+    """
+    pagination_token = None
+    while True:
+        users, pagination_token = list_users_page(
+            pagination_token=pagination_token,
+            limit=page_size,
+            filter_expression=filter_expression,
+            attributes=attributes,
+            boto3_session=boto3_session)
+        for user in users:
+            yield user
+        if not pagination_token:
+            return
+
+
+def iter_users_in_group(group_name, boto3_session=None):
+    """Yields every member of a group, following NextToken across pages."""
+    client = cognito_client(boto3_session)
+    params = {
+        'UserPoolId': current_app.config['COGNITO_POOL_ID'],
+        'GroupName': group_name,
+    }
+    while True:
+        response = client.list_users_in_group(**params)
+        for record in response.get('Users', []):
+            yield user_from_record(record)
+        if not response.get('NextToken'):
+            return
+        params['NextToken'] = response['NextToken']
+
+
+def create_user(email, given_name, family_name, group=None, password=None,
+                permanent=False, boto3_session=None):
+    """Creates a user in the pool and optionally adds them to a group.
+
+    Cognito's own invitation message is suppressed; the app sends its own
+    emails. Without a password Cognito generates a temporary one. A given
+    password is temporary too, so the user must change it on first login,
+    unless permanent is set.
+    """
+    client = cognito_client(boto3_session)
+    params = {
+        'UserPoolId': current_app.config['COGNITO_POOL_ID'],
+        'Username': email,
+        'UserAttributes': [
+            {'Name': 'email', 'Value': email},
+            {'Name': 'given_name', 'Value': given_name},
+            {'Name': 'family_name', 'Value': family_name},
+        ],
+        'MessageAction': 'SUPPRESS',
+    }
+    if password:
+        params['TemporaryPassword'] = password
+    response = client.admin_create_user(**params)
+
+    user = user_from_record(response['User'])
+    if password and permanent:
+        set_permanent_password(email, password, boto3_session=boto3_session)
+        user.status = 'CONFIRMED'
+    user.set_groups([])
+    if group:
+        user.add_to_group(group)
+    return user
+
+
+def set_permanent_password(email, password, boto3_session=None):
+    """Makes password, set as a temporary one by create_user, permanent.
+
+    A user created with a temporary password is in FORCE_CHANGE_PASSWORD
+    and cannot log in until they choose a new one. This logs in as them
+    and answers the NEW_PASSWORD_REQUIRED challenge with the same password.
+    """
+    client = cognito_client(boto3_session)
+    response = client.admin_initiate_auth(
+        UserPoolId=current_app.config['COGNITO_POOL_ID'],
+        ClientId=current_app.config['COGNITO_APP_CLIENT_ID'],
+        AuthFlow='ADMIN_NO_SRP_AUTH',
+        AuthParameters={'USERNAME': email, 'PASSWORD': password})
+    if response.get('ChallengeName') != 'NEW_PASSWORD_REQUIRED':
+        return
+    client.admin_respond_to_auth_challenge(
+        UserPoolId=current_app.config['COGNITO_POOL_ID'],
+        ClientId=current_app.config['COGNITO_APP_CLIENT_ID'],
+        ChallengeName='NEW_PASSWORD_REQUIRED',
+        ChallengeResponses={'USERNAME': email, 'NEW_PASSWORD': password},
+        Session=response['Session'])
+
+
+def user_from_record(record, attributes_key='Attributes'):
+    """Builds a User from a Cognito user record.
+
+    list_users records keep attributes under 'Attributes', admin_get_user
+    responses under 'UserAttributes'.
+    """
+    user = User()
+    user.enabled = record.get('Enabled', False)
+    user.status = record.get('UserStatus')
+    user.created = record.get('UserCreateDate')
+    for attribute in record.get(attributes_key, []):
+        setattr(user, attribute[u'Name'], attribute[u'Value'])
+    return user
+
+
+def get_user(email, boto3_session=None):
+    client = cognito_client(boto3_session)
     try:
         response = client.admin_get_user(
             UserPoolId=current_app.config['COGNITO_POOL_ID'],
@@ -56,21 +314,11 @@ def get_user(email, boto3_session=None):
         # Ideally the exception UserNotFoundException would be specified, but it is declared in a json within botocore.
         return
 
-    user = User()
-    user.enabled = response.get('Enabled', False)
-    for attribute in response.get('UserAttributes'):
-        setattr(user, attribute[u'Name'], attribute[u'Value'])
-
-    user.group = user.get_group()
-
-    return user
+    return user_from_record(response, attributes_key='UserAttributes')
 
 
 def authenticate_user(username, password, boto3_session=None):
-    if not boto3_session:
-        boto3_session = boto3.Session()
-
-    client = boto3_session.client('cognito-idp')
+    client = cognito_client(boto3_session)
     try:
         response = client.admin_initiate_auth(
             UserPoolId=current_app.config['COGNITO_POOL_ID'],
@@ -83,21 +331,23 @@ def authenticate_user(username, password, boto3_session=None):
         # Ideally the exception UserNotFoundException would be specified, but it is declared in a json within botocore.
         return
 
-    session['expires_in'] = response['AuthenticationResult']['ExpiresIn']
-    session['id_token'] = response['AuthenticationResult']['IdToken']
-    session['refresh_token'] = response['AuthenticationResult']['RefreshToken']
-    session['access_token'] = response['AuthenticationResult']['AccessToken']
-    session['token_type'] = response['AuthenticationResult']['TokenType']
+    if 'AuthenticationResult' not in response:
+        # A challenge, e.g. NEW_PASSWORD_REQUIRED for a temporary password,
+        # which this app has no way to answer at login
+        return
+
+    regenerate_session()
+    store_session_tokens(response['AuthenticationResult'])
 
     return get_user(email=username)
 
 
 def user_exists(email, boto3_session=None):
     """Returns True if the user exists"""
-    if not boto3_session:
-        boto3_session = boto3.Session()
+    if UserDirectoryEntry.enabled_for_app():
+        return UserDirectoryEntry.has_user(email)
 
-    client = boto3_session.client('cognito-idp')
+    client = cognito_client(boto3_session)
     response = client.list_users(
         UserPoolId=current_app.config['COGNITO_POOL_ID'],
         AttributesToGet=['email'],
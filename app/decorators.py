@@ -1,11 +1,23 @@
+import time
 from functools import wraps
+from hashlib import sha1
 
-from flask import abort
+from flask import abort, current_app, g, make_response, request, session
 from flask.ext.login import current_user
+from flask_wtf.csrf import generate_csrf
 
+from . import caches
 
-def group_required(permission):
-    """Restrict a view to users with the given permission."""
+# Stands in for the visitor's CSRF token in cached page bodies
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+
+
+def group_required(group_name):
+    """Restrict a view to members of the given Cognito group.
+
+    Membership is read from current_user.groups, which is loaded once per
+    user object.
+    """
 
     def decorator(f):
         @wraps(f)
@@ -21,3 +33,92 @@ def group_required(permission):
 
 def admin_required(f):
     return group_required('administrator')(f)
+
+
+def cached_page(key=None, last_modified=None):
+    """Serve a view's rendered response from the 'page' cache to anonymous visitors.
+
+    Responses are keyed by key, or by the request path and query string,
+    plus the request headers named in PAGE_CACHE_VARY_HEADERS. They carry a
+    strong ETag of the body and, when last_modified is given, a
+    Last-Modified header from calling it; a cached copy is re-rendered once
+    that value changes. Conditional GETs that match are answered with 304.
+
+    CSRF tokens belong to a session, so while a page is rendered for the
+    cache csrf_token() writes a placeholder, which is replaced with the
+    visitor's own token each time the page is served. Such pages get an
+    ETag per session that changes every half WTF_CSRF_TIME_LIMIT, so a
+    page revalidated with a 304 never holds a token about to expire.
+
+    Authenticated users, requests with pending flashed messages and
+    non-GET requests bypass the cache.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.config['PAGE_CACHE_ENABLED'] \
+                    or request.method not in ('GET', 'HEAD') \
+                    or current_user.is_authenticated() \
+                    or session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            cache_key = key or request.full_path
+            for header in current_app.config['PAGE_CACHE_VARY_HEADERS']:
+                cache_key += '|' + request.headers.get(header, '')
+            modified = last_modified() if last_modified else None
+
+            cache = caches.get('page')
+            entry = cache.get(cache_key)
+            if entry is None or entry['last_modified'] != modified:
+                g.page_cache_rendering = True
+                try:
+                    response = make_response(f(*args, **kwargs))
+                finally:
+                    g.page_cache_rendering = False
+                if response.direct_passthrough or response.status_code >= 500:
+                    return response
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'status': response.status_code,
+                    'content_type': response.headers.get('Content-Type'),
+                    'etag': sha1(body).hexdigest(),
+                    'last_modified': modified,
+                    'csrf': CSRF_PLACEHOLDER in body,
+                }
+                cache.set(cache_key, entry)
+
+            body, etag = entry['body'], entry['etag']
+            if entry['csrf']:
+                body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+                etag = sha1(etag + csrf_etag_suffix()).hexdigest()
+            response = current_app.response_class(
+                body, status=entry['status'],
+                content_type=entry['content_type'])
+            response.set_etag(etag)
+            if modified:
+                response.last_modified = modified
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            if response.status_code == 200:
+                response.make_conditional(request)
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def page_csrf_token():
+    """The csrf_token() templates call; a placeholder while cached_page renders."""
+    if g.get('page_cache_rendering'):
+        return CSRF_PLACEHOLDER
+    return generate_csrf()
+
+
+def csrf_etag_suffix():
+    """Distinguishes the ETags of one cached page served with different CSRF tokens."""
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time.time() // (time_limit / 2.0)) if time_limit else 0
+    return '{0}|{1}'.format(session['csrf_token'], window)
@@ -0,0 +1,139 @@
+import socket
+import threading
+
+from botocore.session import get_session
+from botocore.vendored.requests import Session as RequestsSession
+from botocore.vendored.requests.adapters import HTTPAdapter
+from botocore.vendored.requests.packages.urllib3.connection import HTTPConnection
+from pynamodb.connection import TableConnection
+from pynamodb.indexes import Index
+
+from .metrics import CallMetrics, instrument_connection
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """Pools connections to DynamoDB and sends TCP keep-alives on idle ones.
+
+    Without keep-alive probes an idle pooled connection can be dropped by
+    NAT or the load balancer in front of DynamoDB, and the next request
+    pays for a failed send and a new TLS handshake.
+    """
+
+    def __init__(self, keepalive_idle=None, **kwargs):
+        self.socket_options = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        # Linux only: start probing after keepalive_idle seconds instead of two hours
+        if keepalive_idle and hasattr(socket, 'TCP_KEEPIDLE'):
+            self.socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_idle))
+        super(KeepAliveAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super(KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class LockedBotocoreSession(object):
+    """A botocore session whose create_client can be called from many threads.
+
+    botocore sessions are not thread-safe, and PynamoDB connections build
+    their client lazily on first use, possibly on several threads at once.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+
+    def create_client(self, *args, **kwargs):
+        with self._lock:
+            return self.session.create_client(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+# Binding key and shared sessions of the config each model was last bound to
+_bindings = {}
+
+
+def table_models():
+    """Every PynamoDB model backed by a table of its own."""
+    from .models import EditableHTML, Session, UserDirectoryEntry
+    return [EditableHTML, Session, UserDirectoryEntry]
+
+
+def configure_models(app, models=None):
+    """Binds the DynamoDB models to the app's config (called from __init__.py).
+
+    Sets each model's endpoint (DYNAMO_URL, None for AWS), region, table
+    name prefix and, when DYNAMO_READ_CAPACITY_UNITS or
+    DYNAMO_WRITE_CAPACITY_UNITS are set, the provisioned capacity of the
+    table and its global indexes. All models share one botocore session and
+    one pooled, keep-alive HTTP session, so requests reuse open sockets to
+    DynamoDB instead of each model keeping its own.
+
+    The models are classes shared by every app in the process, so models
+    already bound to the same settings keep their connections, and creating
+    another app for the same config costs nothing.
+    """
+    config = app.config
+    config.setdefault('DYNAMO_URL', None)
+    config.setdefault('DYNAMO_REGION', config.get('AWS_REGION', 'us-east-1'))
+    config.setdefault('DYNAMO_TABLE_PREFIX', '')
+    config.setdefault('DYNAMO_READ_CAPACITY_UNITS', None)
+    config.setdefault('DYNAMO_WRITE_CAPACITY_UNITS', None)
+    config.setdefault('DYNAMO_MAX_POOL_CONNECTIONS', 10)
+    config.setdefault('DYNAMO_KEEPALIVE_IDLE', 60)
+
+    key = tuple(config[name] for name in (
+        'DYNAMO_URL', 'DYNAMO_REGION', 'DYNAMO_TABLE_PREFIX', 'DYNAMO_READ_CAPACITY_UNITS',
+        'DYNAMO_WRITE_CAPACITY_UNITS', 'DYNAMO_MAX_POOL_CONNECTIONS',
+        'DYNAMO_KEEPALIVE_IDLE')) + (CallMetrics.enabled(app),)
+    models = models or table_models()
+    bound = [_bindings.get(model) for model in models]
+    if all(binding is not None and binding[0] == key for binding in bound):
+        app.extensions['dynamodb'] = bound[0][1]
+        return
+
+    requests_session = RequestsSession()
+    adapter = KeepAliveAdapter(
+        keepalive_idle=config['DYNAMO_KEEPALIVE_IDLE'],
+        pool_maxsize=config['DYNAMO_MAX_POOL_CONNECTIONS'])
+    requests_session.mount('http://', adapter)
+    requests_session.mount('https://', adapter)
+    botocore_session = LockedBotocoreSession(get_session())
+    app.extensions['dynamodb'] = {'requests_session': requests_session,
+                                  'botocore_session': botocore_session}
+
+    for model in models:
+        _bindings[model] = (key, app.extensions['dynamodb'])
+        meta = model.Meta
+        if not hasattr(meta, 'base_table_name'):
+            meta.base_table_name = meta.table_name
+        meta.table_name = config['DYNAMO_TABLE_PREFIX'] + meta.base_table_name
+        meta.host = config['DYNAMO_URL']
+        meta.region = config['DYNAMO_REGION']
+        # PynamoDB calls session_cls() for each connection's HTTP session
+        meta.session_cls = staticmethod(lambda: requests_session)
+
+        indexes = [getattr(model, name) for name in dir(model)
+                   if isinstance(getattr(model, name), Index)]
+        for table_meta in [meta] + [index.Meta for index in indexes]:
+            if config['DYNAMO_READ_CAPACITY_UNITS'] is not None:
+                table_meta.read_capacity_units = config['DYNAMO_READ_CAPACITY_UNITS']
+            if config['DYNAMO_WRITE_CAPACITY_UNITS'] is not None:
+                table_meta.write_capacity_units = config['DYNAMO_WRITE_CAPACITY_UNITS']
+
+        # Drop anything PynamoDB cached for the previous binding
+        model._indexes = None
+        model._meta_table = None
+        model._connection = TableConnection(
+            meta.table_name, region=meta.region, host=meta.host,
+            session_cls=meta.session_cls,
+            request_timeout_seconds=meta.request_timeout_seconds,
+            max_retry_attempts=meta.max_retry_attempts,
+            base_backoff_ms=meta.base_backoff_ms)
+        # Loading botocore's service models is the slow part of building a
+        # client, and a shared session loads them once
+        model._connection.connection._session = botocore_session
+        if CallMetrics.enabled(app):
+            instrument_connection(model._connection.connection)
@@ -1,50 +1,429 @@
-import boto3
+import atexit
 import json
+import smtplib
+import socket
+import threading
+import time
 
 import os
 
-from flask import render_template
-from flask.ext.mail import Message
+from flask import current_app
+from six.moves.queue import Full, Queue
 
 from app import create_app
 
-from . import mail
+from . import clients, mail
+
+# The email Lambda builds its app and SMTP connection once per container and
+# reuses them for every invocation that container serves.
+_worker_app = None
+_mail_connection = None
+# Set on EmailDispatcher threads, whose app contexts must not flush the batcher
+_dispatching = threading.local()
+
+
+def get_worker_app():
+    """Returns the email worker's app, creating it on the first invocation."""
+    global _worker_app
+    if _worker_app is None:
+        _worker_app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    return _worker_app
+
+
+def get_mail_connection():
+    """Returns the worker's open SMTP connection, connecting on first use."""
+    global _mail_connection
+    if _mail_connection is None:
+        connection = mail.connect()
+        # Entering the connection opens the SMTP session; it is left open
+        # until the server drops it or close_mail_connection is called.
+        connection.__enter__()
+        _mail_connection = connection
+    return _mail_connection
+
+
+def close_mail_connection():
+    global _mail_connection
+    if _mail_connection is not None:
+        try:
+            _mail_connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, socket.error):
+            pass
+        _mail_connection = None
+
+
+def send_message(msg):
+    """Sends msg over the persistent connection, reconnecting once if it was dropped."""
+    try:
+        get_mail_connection().send(msg)
+    except (smtplib.SMTPServerDisconnected, socket.error):
+        close_mail_connection()
+        get_mail_connection().send(msg)
 
 
 def send_email_func(event=None, context=None):
+    """Email Lambda handler.
+
+    Accepts either a single message event or a batch as {'messages': [...]};
+    every message in the batch is sent over the same SMTP connection.
+    """
     if not event:
         event = dict()
 
-    recipient = event.get('recipient')
-    subject = event.get('subject')
-    template = event.get('template')
+    app = get_worker_app()
+    with app.app_context():
+        for msg in build_messages(app, event.get('messages', [event])):
+            send_message(msg)
 
-    kwargs = [{k: v} for k, v in event.items() if k not in ['recipient', 'subject', 'template']]
 
-    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
-    with app.app_context():
-        msg = Message(
-            app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
-            sender=app.config['EMAIL_SENDER'],
-            recipients=[recipient])
-        msg.body = render_template(template + '.txt', context=kwargs)
-        msg.html = render_template(template + '.html', context=kwargs)
-        mail.send(msg)
+def event_context(event):
+    """The template context of a queued email.
 
+    Events queued by send_email carry it under 'context'; older ones had
+    the context keys alongside recipient, subject and template.
+    """
+    if 'context' in event:
+        return event['context']
+    return dict((k, v) for k, v in event.items() if k not in ['recipient', 'subject', 'template'])
 
-def send_email(recipient, subject, template, **kwargs):
 
-    event = {'recipient': recipient,
-             'subject': subject,
-             'template': template}
-    event.update(**kwargs)
-
-    if hasattr(Config, 'DEBUG'):
-        return send_email_func(event=event)
-    else:
-        client = boto3.client('lambda')
-        client.invoke(
-            FunctionName='flask-base.app.email.send_email_func',
+def build_messages(app, events):
+    """Builds a Message per event, rendering the events that share a template together."""
+    by_template = {}
+    for index, event in enumerate(events):
+        by_template.setdefault(event['template'], []).append(index)
+
+    bodies = [None] * len(events)
+    templates = email_templates(app)
+    for template, indexes in by_template.items():
+        rendered = templates.render_many(template, [event_context(events[i]) for i in indexes])
+        for index, body in zip(indexes, rendered):
+            bodies[index] = body
+    return [build_message(app, event, body) for event, body in zip(events, bodies)]
+
+
+def build_message(app, event, body=None):
+    """Builds the Message for event; body is its (text, html), rendered here if not given."""
+    from flask.ext.mail import Message
+
+    if body is None:
+        body = email_templates(app).render(event['template'], event_context(event))
+
+    msg = Message(
+        app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + event['subject'],
+        sender=app.config['EMAIL_SENDER'],
+        recipients=[event['recipient']])
+    msg.body, msg.html = body
+    return msg
+
+
+class EmailTemplates(object):
+    """Renders emails from template pairs that are looked up once per app.
+
+    Every email has a '.txt' and an '.html' template. render_template
+    finds both through the loader and runs Flask's context processors for
+    every message. Here the compiled pair is kept after the first use, so
+    a message only costs the rendering itself. Templates see their context
+    and the environment's globals (config, url_for), but not request
+    context processors such as current_user.
+    """
+
+    def __init__(self, jinja_env):
+        self.jinja_env = jinja_env
+        self._pairs = {}
+        self._lock = threading.Lock()
+
+    def pair(self, template):
+        """The compiled (text, html) templates for template."""
+        pair = self._pairs.get(template)
+        if pair is None or (self.jinja_env.auto_reload and
+                            not all(t.is_up_to_date for t in pair)):
+            pair = (self.jinja_env.get_template(template + '.txt'),
+                    self.jinja_env.get_template(template + '.html'))
+            with self._lock:
+                self._pairs[template] = pair
+        return pair
+
+    def render(self, template, context):
+        """Returns the (text, html) bodies for one recipient."""
+        text, html = self.pair(template)
+        return text.render(context), html.render(context)
+
+    def render_many(self, template, contexts):
+        """Returns (text, html) bodies for each of many recipients' contexts."""
+        text, html = self.pair(template)
+        return [(text.render(context), html.render(context)) for context in contexts]
+
+
+def email_templates(app):
+    """The app's EmailTemplates, created on first use."""
+    templates = app.extensions.get('email_templates')
+    if templates is None:
+        templates = app.extensions.setdefault('email_templates', EmailTemplates(app.jinja_env))
+    return templates
+
+
+class EmailBatcher(object):
+    """Buffers outgoing emails and hands them to the worker in batches.
+
+    A batch is flushed once EMAIL_BATCH_SIZE messages are waiting, and at the
+    end of each app context once the oldest message has waited
+    EMAIL_FLUSH_INTERVAL seconds. The default interval of 0 flushes at the
+    end of every request, so nothing is left behind in a frozen Lambda
+    container.
+
+    EMAIL_QUEUE selects where batches go: 'lambda' invokes the email worker
+    once per batch, 'local' sends them from this process. Debug apps always
+    send locally.
+
+    EMAIL_DISPATCH selects who delivers a flushed batch: 'inline' delivers
+    it in the flushing request, 'thread' hands it to an EmailDispatcher so
+    the request does not wait on AWS or SMTP. Background threads are frozen
+    along with a Lambda container between requests, so 'thread' suits
+    long-running servers rather than Lambda.
+
+    A batch that cannot be delivered goes back on the queue and is retried
+    at the next flush. After EMAIL_DELIVERY_ATTEMPTS failed attempts its
+    messages are dropped and their recipients logged.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        # (event, failed attempts) pairs
+        self._pending = []
+        self._oldest = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EMAIL_BATCH_SIZE', 25)
+        app.config.setdefault('EMAIL_FLUSH_INTERVAL', 0)
+        app.config.setdefault('EMAIL_QUEUE', 'lambda')
+        app.config.setdefault('EMAIL_DELIVERY_ATTEMPTS', 3)
+        app.config.setdefault('EMAIL_DISPATCH', 'inline')
+        app.config.setdefault('EMAIL_DISPATCH_WORKERS', 2)
+        app.config.setdefault('EMAIL_DISPATCH_QUEUE_SIZE', 100)
+        app.config.setdefault('EMAIL_DISPATCH_TIMEOUT', 0.5)
+        app.config.setdefault('EMAIL_WORKER_FUNCTION', 'flask-base.app.email.send_email_func')
+        app.teardown_appcontext(self._flush_if_due)
+
+    def enqueue(self, event):
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.time()
+            self._pending.append((event, 0))
+            full = len(self._pending) >= current_app.config['EMAIL_BATCH_SIZE']
+        if full:
+            self.flush()
+
+    @property
+    def pending(self):
+        """Number of messages waiting to be delivered."""
+        return len(self._pending)
+
+    def flush(self):
+        """Delivers every buffered message, in batches of at most EMAIL_BATCH_SIZE.
+
+        Batches go to the dispatcher when there is one and it has room.
+        If a batch delivered here fails, it and the batches after it are
+        put back on the queue and the error is raised.
+        """
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, [], None
+        dispatcher = self.dispatcher()
+        batch_size = current_app.config['EMAIL_BATCH_SIZE']
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            if dispatcher is not None and dispatcher.submit(batch):
+                continue
+            try:
+                self.deliver_entries(batch)
+            except Exception:
+                self._requeue(pending[start + batch_size:])
+                raise
+
+    def deliver_entries(self, entries):
+        """Delivers (event, attempts) entries as one batch, re-queueing them if that fails."""
+        try:
+            self.deliver([event for event, _ in entries])
+        except Exception:
+            self._requeue([(event, attempts + 1) for event, attempts in entries])
+            raise
+
+    def dispatcher(self, app=None):
+        """The app's EmailDispatcher, started on first use, or None for inline delivery."""
+        app = app or current_app._get_current_object()
+        if app.config['EMAIL_DISPATCH'] != 'thread':
+            return None
+        dispatcher = app.extensions.get('email_dispatcher')
+        if dispatcher is None:
+            with self._lock:
+                dispatcher = app.extensions.get('email_dispatcher')
+                if dispatcher is None:
+                    dispatcher = EmailDispatcher(
+                        app, self.deliver_entries,
+                        workers=app.config['EMAIL_DISPATCH_WORKERS'],
+                        max_queue=app.config['EMAIL_DISPATCH_QUEUE_SIZE'],
+                        timeout=app.config['EMAIL_DISPATCH_TIMEOUT'])
+                    app.extensions['email_dispatcher'] = dispatcher
+                    atexit.register(dispatcher.close)
+        return dispatcher
+
+    def stats(self, app=None):
+        """Queue depths and dispatcher counters, for monitoring."""
+        app = app or current_app._get_current_object()
+        dispatcher = app.extensions.get('email_dispatcher')
+        return {'pending': self.pending,
+                'dispatch': dispatcher.stats() if dispatcher is not None else None}
+
+    def _requeue(self, entries):
+        attempts_allowed = current_app.config['EMAIL_DELIVERY_ATTEMPTS']
+        retry = [(event, attempts) for event, attempts in entries
+                 if attempts < attempts_allowed]
+        dropped = [event['recipient'] for event, attempts in entries
+                   if attempts >= attempts_allowed]
+        if dropped:
+            current_app.logger.error('Gave up delivering emails to %s', ', '.join(dropped))
+        with self._lock:
+            if retry and self._oldest is None:
+                self._oldest = time.time()
+            self._pending[:0] = retry
+
+    def deliver(self, batch):
+        event = {'messages': batch}
+        if current_app.debug or current_app.config['EMAIL_QUEUE'] == 'local':
+            return send_email_func(event=event)
+        clients.get('lambda').invoke(
+            FunctionName=current_app.config['EMAIL_WORKER_FUNCTION'],
             InvocationType='Event',
             Payload=json.dumps(event)
         )
+
+    def _flush_if_due(self, _):
+        if getattr(_dispatching, 'active', False):
+            # Failed batches wait for the next request rather than retrying at once
+            return
+        oldest = self._oldest
+        if oldest is not None and \
+                time.time() - oldest >= current_app.config['EMAIL_FLUSH_INTERVAL']:
+            try:
+                self.flush()
+            except Exception:
+                # The response has already been produced, so don't fail the
+                # request; the undelivered messages are retried at the next flush
+                current_app.logger.exception(
+                    'Failed to deliver queued emails, %s waiting', self.pending)
+
+
+email_batcher = EmailBatcher()
+
+
+class EmailDispatcher(object):
+    """Delivers email batches from a bounded queue on background threads.
+
+    submit() waits up to timeout seconds for room in the queue. If it stays
+    full, submit() returns False and the caller delivers the batch itself,
+    so a backlog slows requests down instead of growing without limit or
+    losing mail. How often that happens, how long callers waited and how
+    deep the queue got are reported by stats().
+    """
+
+    def __init__(self, app, deliver, workers=2, max_queue=100, timeout=0.5):
+        self.app = app
+        self.deliver = deliver
+        self.timeout = timeout
+        self.submitted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.overflowed = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+        self._queue = Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name='email-dispatcher-{0!s}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, batch):
+        """Queues batch for delivery; returns False if the queue stayed full."""
+        start = time.time()
+        try:
+            self._queue.put(batch, timeout=self.timeout)
+        except Full:
+            queued = False
+        else:
+            queued = True
+        with self._lock:
+            self.wait_seconds += time.time() - start
+            if queued:
+                self.submitted += 1
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+            else:
+                self.overflowed += 1
+        return queued
+
+    def _run(self):
+        _dispatching.active = True
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                with self.app.app_context():
+                    try:
+                        self.deliver(batch)
+                    except Exception:
+                        self.app.logger.exception('Failed to deliver queued emails')
+                        delivered = False
+                    else:
+                        delivered = True
+                with self._lock:
+                    if delivered:
+                        self.delivered += 1
+                    else:
+                        self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Waits until every queued batch has been handled."""
+        self._queue.join()
+
+    def close(self, timeout=5):
+        """Lets the workers finish the queued batches, then stops them."""
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(),
+                    'max_queued': self.max_depth,
+                    'capacity': self._queue.maxsize,
+                    'submitted': self.submitted,
+                    'delivered': self.delivered,
+                    'failed': self.failed,
+                    'delivered_by_caller': self.overflowed,
+                    'submit_wait_ms': round(self.wait_seconds * 1000.0, 1)}
+
+
+def send_email(recipient, subject, template, **kwargs):
+    """Queues an email; it is sent with the next batch.
+
+    The template context (kwargs) travels to the worker as JSON, so it must
+    hold plain values; pass user.email_context() rather than a User. A
+    context that can't be serialised raises TypeError here, not later.
+    """
+    event = {'recipient': recipient,
+             'subject': subject,
+             'template': template,
+             'context': kwargs}
+    json.dumps(event)
+    email_batcher.enqueue(event)
@@ -0,0 +1,345 @@
+import base64
+import binascii
+import re
+import threading
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+# The largest page list_users, list_groups and list_users_in_group return
+MAX_PAGE_SIZE = 60
+
+# list_users filters look like: email ^= "ab" or cognito:user_status = "CONFIRMED"
+FILTER_PATTERN = re.compile(r'^\s*([\w:]+)\s*(\^?=)\s*"(.*)"\s*$')
+
+_signing_key = None
+_signing_key_lock = threading.Lock()
+
+
+def signing_key():
+    """The RSA key stand-in pools sign ID tokens with, generated once per process."""
+    global _signing_key
+    if _signing_key is None:
+        with _signing_key_lock:
+            if _signing_key is None:
+                from Crypto.PublicKey import RSA
+                _signing_key = RSA.generate(2048)
+    return _signing_key
+
+
+def _base64_long(value):
+    digits = '%x' % value
+    return base64.urlsafe_b64encode(
+        binascii.unhexlify('0' * (len(digits) % 2) + digits)).decode('ascii').rstrip('=')
+
+
+def _error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def _page(items, params, token_key, operation, key):
+    """Slices a sorted list the way Cognito pages results.
+
+    The token is the key of the last item returned, so users added or
+    removed between pages neither repeat nor shift the next page.
+    """
+    limit = params.get('Limit', MAX_PAGE_SIZE)
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise _error('InvalidParameterException',
+                     'Limit must be between 1 and {0!s}'.format(MAX_PAGE_SIZE), operation)
+    token = params.get(token_key)
+    if token:
+        try:
+            after = base64.urlsafe_b64decode(str(token)).decode('utf-8')
+        except (TypeError, ValueError, binascii.Error):
+            raise _error('InvalidParameterException', 'Invalid pagination token', operation)
+        items = [item for item in items if key(item) > after]
+    page, rest = items[:limit], items[limit:]
+    response = {}
+    if rest:
+        response[token_key] = base64.urlsafe_b64encode(
+            key(page[-1]).encode('utf-8')).decode('ascii')
+    return page, response
+
+
+class InMemoryCognito(object):
+    """An in-process stand-in for a Cognito user pool and its app client.
+
+    It answers the boto3 cognito-idp calls the app makes, with the same
+    request and response shapes and error codes (raised as botocore
+    ClientErrors), so everything built on app.cognito_handler and User runs
+    unchanged without AWS. Selected with IDENTITY_BACKEND = 'memory'.
+
+    Pages are capped at 60 results and continue from an opaque token, as in
+    Cognito. admin_initiate_auth issues RS256-signed ID tokens that
+    app.tokens verifies against jwks(). Users created with a temporary
+    password must answer the NEW_PASSWORD_REQUIRED challenge before they
+    get tokens.
+    """
+
+    def __init__(self, pool_id, client_id, issuer, token_lifetime=3600, clock=time.time):
+        self.pool_id = pool_id
+        self.client_id = client_id
+        self.issuer = issuer
+        self.token_lifetime = token_lifetime
+        self.clock = clock
+        self.kid = uuid4().hex
+        self.users = {}
+        self.groups = {}
+        # Opaque token -> username
+        self.access_tokens = {}
+        self.refresh_tokens = {}
+        self.challenge_sessions = {}
+        self._lock = threading.RLock()
+
+    def jwks(self):
+        """The pool's JSON Web Key Set, as served at its well-known URL."""
+        key = signing_key().publickey()
+        return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': self.kid,
+                          'n': _base64_long(key.n), 'e': _base64_long(key.e)}]}
+
+    # Users
+
+    def _user(self, username, operation):
+        user = self.users.get(username)
+        if user is None:
+            raise _error('UserNotFoundException', 'User does not exist.', operation)
+        return user
+
+    @staticmethod
+    def _record(user, attributes_key='Attributes', attributes_to_get=None):
+        attributes = [{'Name': name, 'Value': value}
+                      for name, value in sorted(user['attributes'].items())
+                      if attributes_to_get is None or name in attributes_to_get]
+        return {'Username': user['username'],
+                attributes_key: attributes,
+                'Enabled': user['enabled'],
+                'UserStatus': user['status'],
+                'UserCreateDate': user['created'],
+                'UserLastModifiedDate': user['modified']}
+
+    def admin_create_user(self, UserPoolId, Username, UserAttributes=(),
+                          TemporaryPassword=None, MessageAction=None, **kwargs):
+        with self._lock:
+            if Username in self.users:
+                raise _error('UsernameExistsException',
+                             'An account with the given email already exists.',
+                             'AdminCreateUser')
+            now = datetime.utcnow()
+            attributes = dict((a['Name'], a['Value']) for a in UserAttributes)
+            attributes['sub'] = str(uuid4())
+            user = {'username': Username,
+                    'attributes': attributes,
+                    'password': TemporaryPassword or uuid4().hex,
+                    'enabled': True,
+                    'status': 'FORCE_CHANGE_PASSWORD',
+                    'created': now,
+                    'modified': now,
+                    'groups': set()}
+            self.users[Username] = user
+            return {'User': self._record(user)}
+
+    def admin_get_user(self, UserPoolId, Username):
+        with self._lock:
+            user = self._user(Username, 'AdminGetUser')
+            return self._record(user, attributes_key='UserAttributes')
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes):
+        with self._lock:
+            user = self._user(Username, 'AdminUpdateUserAttributes')
+            for attribute in UserAttributes:
+                user['attributes'][attribute['Name']] = attribute['Value']
+            user['modified'] = datetime.utcnow()
+            return {}
+
+    def admin_delete_user(self, UserPoolId, Username):
+        with self._lock:
+            self._user(Username, 'AdminDeleteUser')
+            del self.users[Username]
+            for tokens in (self.access_tokens, self.refresh_tokens):
+                for token in [t for t, name in tokens.items() if name == Username]:
+                    del tokens[token]
+            return {}
+
+    def admin_confirm_sign_up(self, UserPoolId, Username):
+        with self._lock:
+            user = self._user(Username, 'AdminConfirmSignUp')
+            if user['status'] == 'UNCONFIRMED':
+                user['status'] = 'CONFIRMED'
+            return {}
+
+    def list_users(self, UserPoolId, AttributesToGet=None, Filter=None, **params):
+        with self._lock:
+            users = sorted(self.users.values(), key=lambda u: u['username'])
+            if Filter:
+                users = [u for u in users if self._matches(u, Filter)]
+            page, response = _page(users, params, 'PaginationToken', 'ListUsers',
+                                   key=lambda u: u['username'])
+            response['Users'] = [self._record(u, attributes_to_get=AttributesToGet)
+                                 for u in page]
+            return response
+
+    @staticmethod
+    def _matches(user, expression):
+        match = FILTER_PATTERN.match(expression)
+        if match is None:
+            raise _error('InvalidParameterException', 'Error while parsing filter.', 'ListUsers')
+        name, operator, value = match.groups()
+        if name == 'cognito:user_status':
+            actual = user['status']
+        elif name == 'username':
+            actual = user['username']
+        else:
+            actual = user['attributes'].get(name)
+        if actual is None:
+            return False
+        return actual.startswith(value) if operator == '^=' else actual == value
+
+    # Groups
+
+    def create_group(self, GroupName, UserPoolId, Description='', Precedence=None, **kwargs):
+        with self._lock:
+            if GroupName in self.groups:
+                raise _error('GroupExistsException', 'A group with the name already exists.',
+                             'CreateGroup')
+            group = {'GroupName': GroupName, 'UserPoolId': UserPoolId,
+                     'Description': Description}
+            if Precedence is not None:
+                group['Precedence'] = Precedence
+            self.groups[GroupName] = group
+            return {'Group': dict(group)}
+
+    def _group(self, group_name, operation):
+        group = self.groups.get(group_name)
+        if group is None:
+            raise _error('ResourceNotFoundException', 'Group not found.', operation)
+        return group
+
+    def list_groups(self, UserPoolId, **params):
+        with self._lock:
+            groups = sorted(self.groups.values(), key=lambda g: g['GroupName'])
+            page, response = _page(groups, params, 'NextToken', 'ListGroups',
+                                   key=lambda g: g['GroupName'])
+            response['Groups'] = [dict(g) for g in page]
+            return response
+
+    def admin_add_user_to_group(self, UserPoolId, Username, GroupName):
+        with self._lock:
+            self._group(GroupName, 'AdminAddUserToGroup')
+            self._user(Username, 'AdminAddUserToGroup')['groups'].add(GroupName)
+            return {}
+
+    def admin_remove_user_from_group(self, UserPoolId, Username, GroupName):
+        with self._lock:
+            self._group(GroupName, 'AdminRemoveUserFromGroup')
+            self._user(Username, 'AdminRemoveUserFromGroup')['groups'].discard(GroupName)
+            return {}
+
+    def admin_list_groups_for_user(self, UserPoolId, Username, **params):
+        with self._lock:
+            user = self._user(Username, 'AdminListGroupsForUser')
+            groups = sorted((self.groups[name] for name in user['groups']),
+                            key=lambda g: g['GroupName'])
+            page, response = _page(groups, params, 'NextToken', 'AdminListGroupsForUser',
+                                   key=lambda g: g['GroupName'])
+            response['Groups'] = [dict(g) for g in page]
+            return response
+
+    def list_users_in_group(self, UserPoolId, GroupName, **params):
+        with self._lock:
+            self._group(GroupName, 'ListUsersInGroup')
+            users = sorted((u for u in self.users.values() if GroupName in u['groups']),
+                           key=lambda u: u['username'])
+            page, response = _page(users, params, 'NextToken', 'ListUsersInGroup',
+                                   key=lambda u: u['username'])
+            response['Users'] = [self._record(u) for u in page]
+            return response
+
+    # Authentication
+
+    def admin_initiate_auth(self, UserPoolId, ClientId, AuthFlow, AuthParameters):
+        with self._lock:
+            if ClientId != self.client_id:
+                raise _error('ResourceNotFoundException', 'User pool client does not exist.',
+                             'AdminInitiateAuth')
+            if AuthFlow == 'REFRESH_TOKEN_AUTH':
+                username = self.refresh_tokens.get(AuthParameters.get('REFRESH_TOKEN'))
+                if username is None or username not in self.users:
+                    raise _error('NotAuthorizedException', 'Invalid Refresh Token',
+                                 'AdminInitiateAuth')
+                return {'AuthenticationResult': self._tokens(self.users[username], refresh=False)}
+            if AuthFlow != 'ADMIN_NO_SRP_AUTH':
+                raise _error('InvalidParameterException', 'Unsupported auth flow',
+                             'AdminInitiateAuth')
+
+            user = self._user(AuthParameters.get('USERNAME'), 'AdminInitiateAuth')
+            if not user['enabled'] or user['password'] != AuthParameters.get('PASSWORD'):
+                raise _error('NotAuthorizedException', 'Incorrect username or password.',
+                             'AdminInitiateAuth')
+            if user['status'] == 'FORCE_CHANGE_PASSWORD':
+                session = uuid4().hex
+                self.challenge_sessions[session] = user['username']
+                return {'ChallengeName': 'NEW_PASSWORD_REQUIRED',
+                        'Session': session,
+                        'ChallengeParameters': {'USER_ID_FOR_SRP': user['username']}}
+            return {'AuthenticationResult': self._tokens(user)}
+
+    def admin_respond_to_auth_challenge(self, UserPoolId, ClientId, ChallengeName,
+                                        ChallengeResponses, Session):
+        with self._lock:
+            username = self.challenge_sessions.pop(Session, None)
+            if ChallengeName != 'NEW_PASSWORD_REQUIRED' or username is None \
+                    or username != ChallengeResponses.get('USERNAME'):
+                raise _error('NotAuthorizedException', 'Invalid session for the user.',
+                             'AdminRespondToAuthChallenge')
+            user = self._user(username, 'AdminRespondToAuthChallenge')
+            user['password'] = ChallengeResponses['NEW_PASSWORD']
+            user['status'] = 'CONFIRMED'
+            return {'AuthenticationResult': self._tokens(user)}
+
+    def change_password(self, PreviousPassword, ProposedPassword, AccessToken):
+        with self._lock:
+            username = self.access_tokens.get(AccessToken)
+            if username is None or username not in self.users:
+                raise _error('NotAuthorizedException', 'Invalid Access Token', 'ChangePassword')
+            user = self.users[username]
+            if user['password'] != PreviousPassword:
+                raise _error('NotAuthorizedException', 'Incorrect username or password.',
+                             'ChangePassword')
+            user['password'] = ProposedPassword
+            return {}
+
+    def _tokens(self, user, refresh=True):
+        """Issues an AuthenticationResult for user."""
+        from jose import jwt
+
+        now = int(self.clock())
+        attributes = user['attributes']
+        claims = {'sub': attributes['sub'],
+                  'aud': self.client_id,
+                  'iss': self.issuer,
+                  'token_use': 'id',
+                  'auth_time': now,
+                  'iat': now,
+                  'exp': now + self.token_lifetime,
+                  'cognito:username': user['username'],
+                  'cognito:groups': sorted(user['groups'])}
+        for name in ('email', 'given_name', 'family_name'):
+            if name in attributes:
+                claims[name] = attributes[name]
+        id_token = jwt.encode(claims, signing_key().exportKey('PEM'), algorithm='RS256',
+                              headers={'kid': self.kid})
+
+        access_token = uuid4().hex
+        self.access_tokens[access_token] = user['username']
+        result = {'IdToken': id_token,
+                  'AccessToken': access_token,
+                  'ExpiresIn': self.token_lifetime,
+                  'TokenType': 'Bearer'}
+        if refresh:
+            refresh_token = uuid4().hex
+            self.refresh_tokens[refresh_token] = user['username']
+            result['RefreshToken'] = refresh_token
+        return result
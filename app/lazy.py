@@ -0,0 +1,71 @@
+import threading
+from importlib import import_module
+
+from flask import current_app, url_for
+
+
+class LazyExtension(object):
+    """Stands in for a Flask extension whose module is imported on first use.
+
+    Importing some extensions is expensive (Flask-S3 pulls in boto3), and on
+    Lambda that cost lands in every cold start, including the ones that never
+    use the extension. init_app only marks the app; the extension is
+    imported, built and initialised against the current app the first time
+    one of its attributes is used.
+
+    import_name is 'module:ClassName', e.g. 'flask_mail:Mail'.
+    """
+
+    def __init__(self, import_name):
+        self.import_name = import_name
+        self._extension = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions.setdefault('lazy_extensions', set())
+
+    @property
+    def loaded(self):
+        return self._extension is not None
+
+    @property
+    def extension(self):
+        """The real extension, initialised for the current app."""
+        if self._extension is None:
+            with self._lock:
+                if self._extension is None:
+                    module_name, class_name = self.import_name.split(':')
+                    self._extension = getattr(import_module(module_name), class_name)()
+
+        app = current_app._get_current_object()
+        initialised = app.extensions.setdefault('lazy_extensions', set())
+        if self.import_name not in initialised:
+            self._extension.init_app(app)
+            initialised.add(self.import_name)
+        return self._extension
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the proxy itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.extension, name)
+
+
+def static_url_for(s3):
+    """Returns a template url_for that imports Flask-S3 for the first static URL.
+
+    Flask-S3 normally replaces url_for in templates when it is initialised.
+    This does the same on demand: URLs for views go straight to Flask, and
+    only static files are handed to Flask-S3.
+    """
+
+    def template_url_for(endpoint, **values):
+        if endpoint == 'static' or endpoint.endswith('.static'):
+            # Initialises Flask-S3 for this app, which settles FLASKS3_ACTIVE
+            s3.extension
+            if current_app.config['FLASKS3_ACTIVE']:
+                from flask_s3 import url_for as s3_url_for
+                return s3_url_for(endpoint, **values)
+        return url_for(endpoint, **values)
+
+    return template_url_for
@@ -1,14 +1,17 @@
 from flask import render_template
 
 from . import main
+from ..decorators import cached_page
 
 
 @main.app_errorhandler(403)
+@cached_page(key='errors/403')
 def forbidden(_):
     return render_template('errors/403.html'), 403
 
 
 @main.app_errorhandler(404)
+@cached_page(key='errors/404')
 def page_not_found(_):
     return render_template('errors/404.html'), 404
 
@@ -1,15 +1,22 @@
 from flask import render_template
+from ..decorators import cached_page
 from ..models import EditableHTML
 
 from . import main
 
 
+def about_last_modified():
+    return EditableHTML.get_editable_html('about').updated
+
+
 @main.route('/')
+@cached_page()
 def index():
     return render_template('main/index.html')
 
 
 @main.route('/about')
+@cached_page(last_modified=about_last_modified)
 def about():
     editable_html_obj = EditableHTML.get_editable_html('about')
     return render_template('main/about.html',
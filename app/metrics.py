@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+
+from flask import _app_ctx_stack, current_app, g, has_request_context, request
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Client methods that build helpers rather than call AWS
+UNTIMED_CLIENT_METHODS = frozenset(['can_paginate', 'get_paginator', 'get_waiter',
+                                    'generate_presigned_url'])
+
+
+class Histogram(object):
+    """Counts call latencies into fixed buckets, thread-safely."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms, error=False):
+        with self._lock:
+            self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            if error:
+                self.errors += 1
+
+    def percentile(self, fraction):
+        """The upper bound of the bucket holding the given fraction of calls."""
+        with self._lock:
+            rank = fraction * self.count
+            seen = 0
+            for bound, count in zip(BUCKETS_MS, self.buckets):
+                seen += count
+                if count and seen >= rank:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def stats(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'mean_ms': self.total_ms / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(0.5),
+                'p90_ms': self.percentile(0.9),
+                'p99_ms': self.percentile(0.99),
+                'max_ms': self.max_ms,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS_MS] + ['inf'],
+                                    self.buckets))}
+
+
+def record_call(operation, seconds, error=False):
+    """Adds a call to the app's histograms and, during a request, to its timings.
+
+    Calls made outside an app context, or before CallMetrics is set up, are
+    not recorded.
+    """
+    if _app_ctx_stack.top is None:
+        return
+    app = current_app._get_current_object()
+    metrics = app.extensions.get('call_metrics')
+    if metrics is None:
+        return
+    ms = seconds * 1000.0
+    histogram = metrics['histograms'].get(operation)
+    if histogram is None:
+        with metrics['lock']:
+            histogram = metrics['histograms'].setdefault(operation, Histogram())
+    histogram.observe(ms, error=error)
+
+    if has_request_context():
+        timings = getattr(g, 'call_timings', None)
+        if timings is not None:
+            timings.append((operation, ms))
+
+
+def timed_call(operation, func, *args, **kwargs):
+    """Calls func, recording how long it took under operation."""
+    start = time.time()
+    error = False
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_call(operation, time.time() - start, error=error)
+
+
+class InstrumentedClient(object):
+    """Wraps a boto3 client (or a stand-in) so every API call is timed.
+
+    Calls are recorded as '<service>.<method>', e.g.
+    'cognito-idp.admin_get_user'. Other attributes pass straight through.
+    """
+
+    def __init__(self, wrapped, service_name):
+        self.wrapped = wrapped
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        attribute = getattr(self.wrapped, name)
+        if name.startswith('_') or name in UNTIMED_CLIENT_METHODS or not callable(attribute):
+            return attribute
+        operation = '{0!s}.{1!s}'.format(self.service_name, name)
+
+        def timed(*args, **kwargs):
+            return timed_call(operation, attribute, *args, **kwargs)
+        return timed
+
+
+def instrument_connection(connection, service_name='dynamodb'):
+    """Times every request a PynamoDB Connection dispatches, e.g. 'dynamodb.GetItem'.
+
+    PynamoDB sends requests itself rather than through a boto3 client, so
+    its single dispatch method is wrapped instead. Retries are included in
+    the time of the call they belong to.
+    """
+    dispatch = connection.dispatch
+
+    def timed_dispatch(operation_name, operation_kwargs):
+        return timed_call('{0!s}.{1!s}'.format(service_name, operation_name),
+                          dispatch, operation_name, operation_kwargs)
+    connection.dispatch = timed_dispatch
+    return connection
+
+
+def server_timing(timings):
+    """Formats (operation, ms) pairs as a Server-Timing header, one entry per operation."""
+    totals = {}
+    for operation, ms in timings:
+        count, total = totals.get(operation, (0, 0.0))
+        totals[operation] = (count + 1, total + ms)
+    return ', '.join('{0!s};dur={1:.1f};desc="{2!s} call{3!s}"'.format(
+        operation, total, count, '' if count == 1 else 's')
+        for operation, (count, total) in sorted(totals.items()))
+
+
+class CallMetrics(object):
+    """Times the app's Cognito and DynamoDB calls.
+
+    Clients from the client pool and the DynamoDB models record each call
+    (see InstrumentedClient and instrument_connection). Every response
+    that made calls gets a Server-Timing header and an info log line
+    listing them. Process-wide latency histograms per operation are
+    returned by stats().
+
+    Relevant config values:
+
+    - ``CALL_METRICS_ENABLED``: instrument clients and models at all.
+    - ``CALL_METRICS_SERVER_TIMING``: add the Server-Timing header.
+    - ``CALL_METRICS_LOG``: log a JSON line of the request's calls.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CALL_METRICS_ENABLED', True)
+        app.config.setdefault('CALL_METRICS_SERVER_TIMING', True)
+        app.config.setdefault('CALL_METRICS_LOG', True)
+        if not app.config['CALL_METRICS_ENABLED']:
+            return
+        app.extensions['call_metrics'] = {'histograms': {}, 'lock': threading.Lock()}
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    @staticmethod
+    def enabled(app=None):
+        app = app or current_app._get_current_object()
+        return 'call_metrics' in app.extensions
+
+    def stats(self, app=None):
+        """Returns latency statistics for every operation called so far."""
+        app = app or current_app._get_current_object()
+        histograms = app.extensions.get('call_metrics', {}).get('histograms', {})
+        return dict((operation, histogram.stats())
+                    for operation, histogram in histograms.items())
+
+    @staticmethod
+    def _start_request():
+        g.call_timings = []
+
+    @staticmethod
+    def _finish_request(response):
+        timings = getattr(g, 'call_timings', None)
+        if not timings:
+            return response
+        if current_app.config['CALL_METRICS_SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(timings)
+        if current_app.config['CALL_METRICS_LOG']:
+            current_app.logger.info('call timings %s', json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'calls': len(timings),
+                'call_ms': round(sum(ms for _, ms in timings), 1),
+                'operations': [[operation, round(ms, 1)] for operation, ms in timings],
+            }))
+        return response
@@ -5,4 +5,5 @@ module (as opposed to just their python files)
 
 from user import *  # noqa
 from miscellaneous import *  # noqa
-from session import *
+from session import *  # noqa
+from directory import *  # noqa
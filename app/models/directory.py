@@ -0,0 +1,166 @@
+import zlib
+from operator import attrgetter
+
+from pynamodb.models import Model
+from pynamodb.attributes import BooleanAttribute, UnicodeAttribute, UTCDateTimeAttribute
+from pynamodb.indexes import AllProjection, GlobalSecondaryIndex
+from flask import current_app
+
+# Upper bound used to turn a prefix into a range for BETWEEN conditions
+PREFIX_END = u'\uffff'
+
+
+class AllUsersIndex(GlobalSecondaryIndex):
+    """Every user, ordered by name, under USER_DIRECTORY_SHARDS partitions."""
+    class Meta:
+        index_name = 'directory-sort_name-index'
+        read_capacity_units = 1
+        write_capacity_units = 1
+        projection = AllProjection()
+
+    directory = UnicodeAttribute(hash_key=True)
+    sort_name = UnicodeAttribute(range_key=True)
+
+
+class GroupIndex(GlobalSecondaryIndex):
+    """Users of one group, ordered by name."""
+    class Meta:
+        index_name = 'group-sort_name-index'
+        read_capacity_units = 1
+        write_capacity_units = 1
+        projection = AllProjection()
+
+    group = UnicodeAttribute(hash_key=True)
+    sort_name = UnicodeAttribute(range_key=True)
+
+
+class NamePrefixIndex(GlobalSecondaryIndex):
+    """Users partitioned by the first letter of their last name, ordered by name."""
+    class Meta:
+        index_name = 'name_prefix-sort_name-index'
+        read_capacity_units = 1
+        write_capacity_units = 1
+        projection = AllProjection()
+
+    name_prefix = UnicodeAttribute(hash_key=True)
+    sort_name = UnicodeAttribute(range_key=True)
+
+
+class UserDirectoryEntry(Model):
+    """A denormalised copy of a Cognito user, for searching and sorting the admin user list.
+
+    Cognito stays the source of truth; the administrator views keep this
+    table in sync and `manage.py rebuild_user_directory` recreates it.
+    """
+    class Meta:
+        table_name = 'user_directory'
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    email = UnicodeAttribute(hash_key=True)
+    given_name = UnicodeAttribute(null=True)
+    family_name = UnicodeAttribute(null=True)
+    group = UnicodeAttribute(default='main')
+    enabled = BooleanAttribute(default=True)
+    created = UTCDateTimeAttribute(null=True)
+
+    # Derived sort and partition keys for the indexes
+    sort_name = UnicodeAttribute()
+    name_prefix = UnicodeAttribute()
+    directory = UnicodeAttribute(default='users')
+
+    all_users_index = AllUsersIndex()
+    group_index = GroupIndex()
+    name_prefix_index = NamePrefixIndex()
+
+    @staticmethod
+    def enabled_for_app():
+        return current_app.config['USER_DIRECTORY_ENABLED']
+
+    @staticmethod
+    def directory_partitions():
+        """The all_users_index partition keys, one per USER_DIRECTORY_SHARDS."""
+        shards = current_app.config['USER_DIRECTORY_SHARDS']
+        if shards <= 1:
+            return [u'users']
+        return [u'users-{0}'.format(shard) for shard in range(shards)]
+
+    @classmethod
+    def directory_partition(cls, email):
+        """The all_users_index partition an email belongs to."""
+        partitions = cls.directory_partitions()
+        # crc32 rather than hash(), which differs between processes
+        return partitions[(zlib.crc32(email.encode('utf-8')) & 0xffffffff) % len(partitions)]
+
+    @classmethod
+    def from_user(cls, user):
+        """Builds a directory entry from a User"""
+        family_name = user.family_name or u''
+        sort_name = u' '.join([family_name, user.given_name or u'', user.email]).lower()
+        return cls(
+            email=user.email,
+            given_name=user.given_name,
+            family_name=user.family_name,
+            group=user.group['GroupName'],
+            enabled=getattr(user, 'enabled', True),
+            created=getattr(user, 'created', None),
+            sort_name=sort_name,
+            name_prefix=sort_name[:1] or u' ',
+            directory=cls.directory_partition(user.email))
+
+    @classmethod
+    def sync_user(cls, user):
+        """Writes the user's current details to the directory, if it is enabled"""
+        if cls.enabled_for_app():
+            cls.from_user(user).save()
+
+    @classmethod
+    def remove_user(cls, email):
+        """Drops a deleted user from the directory, if it is enabled"""
+        if cls.enabled_for_app():
+            cls(email=email).delete()
+
+    @classmethod
+    def has_user(cls, email):
+        try:
+            cls.get(email)
+        except cls.DoesNotExist:
+            return False
+        return True
+
+    @classmethod
+    def page(cls, group=None, name_prefix=None, after=None, limit=30):
+        """Returns a (entries, next_cursor) page of users ordered by name.
+
+        Optionally narrowed to one group and/or a last name prefix.
+        next_cursor is the sort_name to pass as after to fetch the following
+        page, or None on the last page. The unfiltered list queries each
+        directory partition and merges them.
+        """
+        name_prefix = (name_prefix or u'').lower()
+        if group:
+            index, hash_keys = cls.group_index, [group]
+        elif name_prefix:
+            index, hash_keys = cls.name_prefix_index, [name_prefix[:1]]
+        else:
+            index, hash_keys = cls.all_users_index, cls.directory_partitions()
+
+        # sort_name starts with the last name, so a prefix is a range on it
+        conditions = {}
+        if name_prefix:
+            conditions['sort_name__between'] = [after or name_prefix, name_prefix + PREFIX_END]
+        elif after:
+            conditions['sort_name__gt'] = after
+
+        # BETWEEN includes the cursor itself, and one extra entry tells us
+        # whether another page follows
+        results = []
+        for hash_key in hash_keys:
+            results.extend(index.query(hash_key, limit=limit + 2, **conditions))
+        if len(hash_keys) > 1:
+            results.sort(key=attrgetter('sort_name'))
+        entries = [entry for entry in results if not (after and entry.sort_name <= after)]
+
+        if len(entries) > limit:
+            return entries[:limit], entries[limit - 1].sort_name
+        return entries, None
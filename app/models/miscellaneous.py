@@ -1,23 +1,102 @@
+from datetime import datetime
+
 from pynamodb.models import Model
-from pynamodb.attributes import UnicodeAttribute
+from pynamodb.attributes import NumberAttribute, UnicodeAttribute, UTCDateTimeAttribute
 from flask import current_app
-import os
+
+from .. import caches
 
 
 class EditableHTML(Model):
     class Meta:
         table_name = 'editors'
-        host = os.environ.get('DYNAMO_URL')  # This should not be fished out of the env but from the app
         read_capacity_units = 1
         write_capacity_units = 1
 
     editor_name = UnicodeAttribute(hash_key=True)
     value = UnicodeAttribute(default=' ')
+    # Bumped on every update so cached copies and rendered fragments can be told apart
+    version = NumberAttribute(default=0)
+    updated = UTCDateTimeAttribute(null=True)
 
     @staticmethod
     def get_editable_html(editor_name):
-        editable_html_obj = EditableHTML.get(editor_name)
+        """Returns the named editor's contents through the in-process cache.
+
+        Contents are cached for EDITABLE_HTML_CACHE_TTL seconds, so other
+        processes pick up an update within that time.
+        """
+        return caches.get('editable_html').get_or_set(
+            editor_name, lambda: EditableHTML.load(editor_name))
+
+    @staticmethod
+    def get_many(editor_names):
+        """Returns a dict of the named editors, reading cache misses in one BatchGetItem.
+
+        Editors that don't exist yet are returned empty, as with
+        get_editable_html.
+        """
+        editor_names = list(editor_names)
+        cache = caches.get('editable_html')
+        editors = {}
+        for editor_name in editor_names:
+            editable_html_obj = cache.get(editor_name)
+            if editable_html_obj is not None:
+                editors[editor_name] = editable_html_obj
+
+        missing = set(editor_names) - set(editors)
+        if missing:
+            for editable_html_obj in EditableHTML.load_many(missing).values():
+                cache.set(editable_html_obj.editor_name, editable_html_obj)
+                editors[editable_html_obj.editor_name] = editable_html_obj
+        return editors
+
+    @staticmethod
+    def load_many(editor_names):
+        """Reads the named editors from DynamoDB, filling in empty ones for those not found."""
+        editors = dict((editable_html_obj.editor_name, editable_html_obj)
+                       for editable_html_obj in EditableHTML.batch_get(set(editor_names)))
+        for editor_name in editor_names:
+            if editor_name not in editors:
+                editors[editor_name] = EditableHTML(editor_name=editor_name, value=' ')
+        return editors
+
+    @staticmethod
+    def save_many(values):
+        """Saves new contents for several editors, given as {editor_name: value}, in batch writes.
+
+        Versions are bumped from the stored copies, as update_contents does.
+        """
+        editors = EditableHTML.load_many(values.keys())
+        updated = datetime.utcnow()
+        with EditableHTML.batch_write() as batch:
+            for editor_name, value in values.items():
+                editable_html_obj = editors[editor_name]
+                editable_html_obj.value = value
+                editable_html_obj.version += 1
+                editable_html_obj.updated = updated
+                batch.save(editable_html_obj)
 
-        if editable_html_obj is None:
-            editable_html_obj = EditableHTML(editor_name=editor_name, value=' ')
+        cache = caches.get('editable_html')
+        for editor_name, editable_html_obj in editors.items():
+            cache.set(editor_name, editable_html_obj)
+        return editors
+
+    @staticmethod
+    def load(editor_name):
+        """Reads the named editor from DynamoDB, or returns an empty one."""
+        try:
+            return EditableHTML.get(editor_name)
+        except EditableHTML.DoesNotExist:
+            return EditableHTML(editor_name=editor_name, value=' ')
+
+    @staticmethod
+    def update_contents(editor_name, value):
+        """Saves new contents for the named editor and refreshes the cache."""
+        editable_html_obj = EditableHTML.load(editor_name)
+        editable_html_obj.value = value
+        editable_html_obj.version += 1
+        editable_html_obj.updated = datetime.utcnow()
+        editable_html_obj.save()
+        caches.get('editable_html').set(editor_name, editable_html_obj)
         return editable_html_obj
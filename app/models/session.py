@@ -1,15 +1,16 @@
 from pynamodb.models import Model
-from pynamodb.attributes import UnicodeAttribute
+from pynamodb.attributes import NumberAttribute, UnicodeAttribute
 from flask import current_app
-import os
 
 
 class Session(Model):
+    """Server-side session data, see app/sessions.py"""
     class Meta:
         table_name = 'session'
-        host = os.environ.get('DYNAMO_URL')  # This should not be fished out of the env but from the app
         read_capacity_units = 1
         write_capacity_units = 1
 
     session_id = UnicodeAttribute(hash_key=True)
     value = UnicodeAttribute(default=' ')
+    # Epoch seconds; the table's TTL attribute, so DynamoDB deletes expired sessions
+    expires = NumberAttribute(null=True)
@@ -1,21 +1,42 @@
-import boto3
 from flask import current_app
 from flask.ext.login import AnonymousUserMixin, UserMixin
 from itsdangerous import BadSignature, SignatureExpired
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
+from .. import caches, clients
+
+# Users who belong to no Cognito group are treated as members of this one
+DEFAULT_GROUP = {'GroupName': 'main', 'Precedence': 0}
+
 
 class User(UserMixin, object):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
 
-        self.client = boto3.client('cognito-idp')
         self.email = None
         self.given_name = None,
         self.family_name = None,
         self.session = None
-        self.group = 'main'
+        self._groups = None
+
+    @classmethod
+    def from_claims(cls, claims):
+        """Builds a user from verified Cognito ID token claims."""
+        user = cls()
+        # Cognito will not issue or refresh tokens for disabled users
+        user.enabled = True
+        user.email = claims.get('email')
+        user.given_name = claims.get('given_name')
+        user.family_name = claims.get('family_name')
+        user.set_groups([{'GroupName': name}
+                         for name in claims.get('cognito:groups', [])])
+        return user
+
+    @property
+    def client(self):
+        """The process-wide Cognito client, shared with app.cognito_handler."""
+        return clients.get('cognito-idp')
 
     def get_id(self):
         """Overriding because Cognito has username instead of an id field. We are using email/username interchangably"""
@@ -24,6 +45,10 @@ class User(UserMixin, object):
     def full_name(self):
         return '%s %s' % (self.given_name, self.family_name)
 
+    def email_context(self):
+        """The user as email templates see it; plain strings, so it can be queued as JSON."""
+        return {'email': self.email, 'full_name': self.full_name()}
+
     def is_admin(self):
         return self.member_of_group('administrator')
 
@@ -52,7 +77,7 @@ class User(UserMixin, object):
         if data.get('confirm') != self.email:
             return False
 
-        self.client.admin_configm_signup(
+        self.client.admin_confirm_sign_up(
             UserPoolId=current_app.config['COGNITO_POOL_ID'],
             Username=self.email
         )
@@ -68,12 +93,17 @@ class User(UserMixin, object):
         if data.get('reset') != self.email:
             return False
 
+        self.change_password(previous_password, new_password, access_token)
+        return True
+
+    def change_password(self, previous_password, new_password, access_token):
+        """Changes the password of the user the access token belongs to."""
         self.client.change_password(
             PreviousPassword=previous_password,
             ProposedPassword=new_password,
             AccessToken=access_token
         )
-        return True
+        self.invalidate_cache()
 
     def add_to_group(self, group_name):
         """Adds user to a Cognito Group"""
@@ -82,51 +112,147 @@ class User(UserMixin, object):
             Username=self.email,
             GroupName=group_name
         )
+        if self._groups is not None and group_name not in self.groups:
+            self.set_groups(self._groups + [{'GroupName': group_name}])
+        self.invalidate_cache()
+
+    def remove_from_group(self, group_name):
+        """Removes user from a Cognito Group"""
+        self.client.admin_remove_user_from_group(
+            UserPoolId=current_app.config['COGNITO_POOL_ID'],
+            Username=self.email,
+            GroupName=group_name
+        )
+        if self._groups is not None:
+            self.set_groups([group for group in self._groups if group['GroupName'] != group_name])
+        self.invalidate_cache()
+
+    def change_group(self, group_name):
+        """Makes group_name the user's only group, leaving every other group first"""
+        if self._groups is None:
+            self.load_groups()
+        for group in [group['GroupName'] for group in self._groups]:
+            if group != group_name:
+                self.remove_from_group(group)
+        self.add_to_group(group_name)
+
+    def delete(self):
+        """Deletes the user from the Cognito pool"""
+        self.client.admin_delete_user(
+            UserPoolId=current_app.config['COGNITO_POOL_ID'],
+            Username=self.email
+        )
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drops this user from the user_loader cache so the next request reloads it."""
+        caches.get('user').invalidate(self.email)
 
     def member_of_group(self, group_name):
         """Returns True if user is a member of the named group"""
-        return group_name == self.get_group().get('GroupName')
+        return group_name in self.groups
 
-    def get_group(self):
-        """Gets the user's group. It is possible to be in more than one group, but we assume just one group for this demo"""
+    @property
+    def groups(self):
+        """Names of every group the user belongs to.
+
+        Memberships are fetched from Cognito once per user object, so
+        group_required, is_admin and templates share a single lookup.
+        """
+        if self._groups is None:
+            self.load_groups()
+        return self._group_names
+
+    @property
+    def group(self):
+        """The user's highest precedence group, used to label the account"""
+        return self.get_group()
+
+    def load_groups(self):
+        """Fetches the user's group memberships from Cognito"""
         response = self.client.admin_list_groups_for_user(
             UserPoolId=current_app.config['COGNITO_POOL_ID'],
             Username=self.email,
         )
-        group = response.get('Groups')
-        if not group or group == []:
-            group = [{'GroupName': 'main', 'Precedence': 0}]
-        return group.pop()
+        self.set_groups(response.get('Groups', []))
+
+    def set_groups(self, groups):
+        """Records the user's group memberships, as returned by Cognito"""
+        self._groups = sorted(groups, key=lambda group: group.get('Precedence', 0))
+        self._group_names = frozenset(group['GroupName'] for group in self._groups) \
+            or frozenset([DEFAULT_GROUP['GroupName']])
+
+    def get_group(self):
+        """Gets the user's highest precedence group. Lower precedence values take priority in Cognito."""
+        if self._groups is None:
+            self.load_groups()
+        if not self._groups:
+            return dict(DEFAULT_GROUP)
+        return self._groups[0]
 
 
     @staticmethod
-    def generate_fake(count=100, **kwargs):
-        """Generate a number of fake users for testing."""
+    def generate_fake(count=100, groups=None, workers=8, rate=20, progress=None):
+        """Creates count fake users in Cognito, concurrently, for load testing.
 
-        # TODO have placebo mock up responses with these 100 users rather than generate them each time
-        from random import seed, choice
+        Users are spread randomly over groups and added to the user
+        directory when it is enabled. By default they only join the least
+        privileged groups (those with the highest Precedence), so load test
+        users never get administrator rights. Each user's password is made
+        permanent, so they can log in without a password change.
+        Requests are limited to rate per second across workers threads, and
+        throttled ones are retried with backoff. Returns a BulkResult
+        holding the created users; progress is passed to run_bulk.
+        """
+        import re
+        from random import choice
         from faker import Faker
+        from ..bulk import run_bulk
+        from ..cognito_handler import create_user, group_catalogue, set_permanent_password
+        from .directory import UserDirectoryEntry
 
-        fake = Faker()
+        if not groups:
+            catalogue = [g for g in group_catalogue() if g.precedence is not None]
+            lowest = max([g.precedence for g in catalogue] or [None])
+            groups = [g.name for g in catalogue
+                      if g.precedence == lowest] or [DEFAULT_GROUP['GroupName']]
 
-        seed()
+        # Faker is not thread-safe, so the details are made up front. The
+        # index keeps emails unique however many users are generated.
+        fake = Faker()
+        prefix = fake.uuid4()[:8]
+        details = []
         for i in range(count):
-            u = User(
-                first_name=fake.first_name(),
-                last_name=fake.last_name(),
-                email=fake.email(),
-                password=fake.password(),
-                confirmed=True,
-                role=choice(roles),
-                **kwargs)
+            given_name, family_name = fake.first_name(), fake.last_name()
+            details.append({
+                'email': u'{0}.{1}.{2}.{3}@example.com'.format(
+                    re.sub(r'[^a-z]', '', given_name.lower()),
+                    re.sub(r'[^a-z]', '', family_name.lower()), prefix, i),
+                'given_name': given_name,
+                'family_name': family_name,
+                'group': choice(groups),
+                'password': fake.password(length=12) + 'Aa1!',
+            })
+
+        def create(user_details, call):
+            user = call(lambda: create_user(
+                user_details['email'], user_details['given_name'],
+                user_details['family_name'], password=user_details['password']))
+            call(lambda: set_permanent_password(user_details['email'], user_details['password']))
+            call(lambda: user.add_to_group(user_details['group']))
+            call(lambda: UserDirectoryEntry.sync_user(user))
+            return user
 
-            u.save()
+        return run_bulk(current_app._get_current_object(), create, details,
+                        workers=workers, rate=rate, progress=progress)
 
     def __repr__(self):
         return '<User \'%s\'>' % self.full_name()
 
 
 class AnonymousUser(AnonymousUserMixin):
+    groups = frozenset()
+
     @staticmethod
     def member_of_group(_):
         return False
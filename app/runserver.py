@@ -1,3 +1,8 @@
 from . import create_app
 
 app = create_app('production')
+
+if app.config['WARM_UP_ON_START']:
+    # Prime caches while Lambda initialises the container, not on the first request
+    from .warmup import warm_up
+    warm_up(app)
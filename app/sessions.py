@@ -0,0 +1,281 @@
+import sqlite3
+import threading
+import time
+from collections import MutableMapping
+from uuid import uuid4
+
+from flask import session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer, want_bytes
+
+from . import caches
+from .cache import TTLCache
+from .models import Session
+
+
+class DynamoDBSessionStore(object):
+    """Stores sessions in the Session table.
+
+    Reads go through the 'session' cache for SESSION_CACHE_TTL seconds.
+    Writes update the cache of the process that made them, so another
+    process may serve a copy up to that old.
+    """
+
+    def __init__(self, model=Session):
+        self.model = model
+
+    def load(self, sid):
+        """Returns the stored (value, expires) for sid, or None."""
+        cache = caches.get('session')
+        stored = cache.get(sid)
+        if stored is None:
+            try:
+                item = self.model.get(sid)
+            except self.model.DoesNotExist:
+                return None
+            stored = (item.value, item.expires)
+            cache.set(sid, stored)
+        return stored
+
+    def save(self, sid, value, expires):
+        self.model(session_id=sid, value=value, expires=expires).save()
+        caches.get('session').set(sid, (value, expires))
+
+    def delete(self, sid):
+        self.model(session_id=sid).delete()
+        caches.get('session').invalidate(sid)
+
+
+class MemorySessionStore(object):
+    """Keeps sessions in this process only, least recently used dropped first.
+
+    For development and benchmarks; sessions are lost on restart and are not
+    shared between processes.
+    """
+
+    def __init__(self, max_entries=10000):
+        # Entries expire through the expires stored with them
+        self.sessions = TTLCache(ttl=float('inf'), max_entries=max_entries)
+
+    def load(self, sid):
+        return self.sessions.get(sid)
+
+    def save(self, sid, value, expires):
+        self.sessions.set(sid, (value, expires))
+
+    def delete(self, sid):
+        self.sessions.invalidate(sid)
+
+
+class SQLiteSessionStore(object):
+    """Stores sessions in a local SQLite file, shared by processes on one machine.
+
+    Each thread keeps its own connection, as SQLite connections cannot be
+    shared between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS session '
+            '(session_id TEXT PRIMARY KEY, value TEXT, expires INTEGER)')
+        self.connection.commit()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def load(self, sid):
+        row = self.connection.execute(
+            'SELECT value, expires FROM session WHERE session_id = ?', (sid,)).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid, value, expires):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO session (session_id, value, expires) VALUES (?, ?, ?)',
+                (sid, value, expires))
+
+    def delete(self, sid):
+        with self.connection:
+            self.connection.execute('DELETE FROM session WHERE session_id = ?', (sid,))
+
+
+def session_store(app):
+    """Builds the store named by SESSION_BACKEND, or None for cookie sessions."""
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'dynamodb':
+        return DynamoDBSessionStore()
+    if backend == 'memory':
+        return MemorySessionStore(max_entries=app.config['SESSION_MEMORY_MAX_ENTRIES'])
+    if backend == 'sqlite':
+        return SQLiteSessionStore(app.config['SESSION_SQLITE_PATH'])
+    if backend == 'cookie':
+        return None
+    raise ValueError('Unknown SESSION_BACKEND {0!r}'.format(backend))
+
+
+def regenerate_session():
+    """Gives the current session a fresh id, to prevent session fixation.
+
+    Call on login and logout. Cookie sessions have no id to fix, so they
+    are left alone.
+    """
+    if isinstance(session._get_current_object(), ServerSession):
+        session.regenerate()
+
+
+def init_sessions(app):
+    """Installs server-side sessions for the configured backend (called from __init__.py)."""
+    store = session_store(app)
+    if store is not None:
+        app.session_interface = ServerSessionInterface(store)
+
+
+class ServerSession(MutableMapping, SessionMixin):
+    """A session whose contents are read from the store the first time they are used.
+
+    Requests that never touch the session never read it. Any assignment
+    marks the session modified, as a value equal to the stored one may be a
+    mutable object changed in place since it was loaded.
+    """
+
+    def __init__(self, sid, loader=None, new=False):
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # The id this session was stored under before regenerate()
+        self.previous_sid = None
+        # Epoch seconds after which the stored copy is no longer valid
+        self.expires = None
+        self._loader = loader
+        self._data = None if loader else {}
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data, self.expires = self._loader(self.sid)
+            self._loader = None
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def regenerate(self):
+        """Moves the session to a new id, so an id known before login is useless after it.
+
+        The copy stored under the old id is deleted when the session is saved.
+        """
+        self.data
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = self.sid
+        self.sid = uuid4().hex
+        self.modified = True
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps sessions in a session store; the cookie only holds a signed session id.
+
+    A store provides load(sid), returning (value, expires) or None,
+    save(sid, value, expires) and delete(sid). A session is written back
+    only when it was changed, or when less than half of
+    PERMANENT_SESSION_LIFETIME is left on the stored copy, which pushes its
+    expiry back. Stored sessions carry an `expires` timestamp (DynamoDB's
+    TTL attribute) and are ignored once it has passed.
+    """
+
+    serializer = session_json_serializer
+    salt = 'dynamodb-session'
+    # Flask-Login stamps every session with an _id when current_user is first
+    # used; a session holding nothing else is not worth storing
+    transient_keys = frozenset(['_id'])
+
+    def __init__(self, store):
+        self.store = store
+
+    def signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = self.signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                pass
+            else:
+                return ServerSession(sid, loader=self.load)
+        return ServerSession(uuid4().hex, new=True)
+
+    def load(self, sid):
+        """Returns the stored (data, expires) for sid, or an empty session."""
+        stored = self.store.load(sid)
+        if stored is None:
+            return {}, None
+        value, expires = stored
+        if expires is not None and expires < time.time():
+            return {}, None
+        return self.serializer.loads(value), expires
+
+    def save_session(self, app, session, response):
+        if not session.loaded:
+            # Never read, so it cannot have changed
+            return
+
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.expires is None and self.transient_keys.issuperset(session):
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if not session.modified and session.expires is not None \
+                and session.expires - now > lifetime / 2:
+            return
+
+        expires = int(now + lifetime)
+        value = self.serializer.dumps(dict(session))
+        self.store.save(session.sid, value, expires)
+        session.expires = expires
+
+        response.set_cookie(
+            app.session_cookie_name,
+            self.signer(app).sign(want_bytes(session.sid)),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app))
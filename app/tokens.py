@@ -0,0 +1,68 @@
+import json
+
+from flask import current_app
+from jose import jwt
+from jose.exceptions import JWTError
+from six.moves.urllib.request import urlopen
+
+from . import caches, clients
+
+
+def cognito_issuer(pool_id=None):
+    """The issuer URL of tokens minted by the user pool (by default the configured one)."""
+    pool_id = pool_id or current_app.config['COGNITO_POOL_ID']
+    region = pool_id.split('_')[0]
+    return 'https://cognito-idp.{0!s}.amazonaws.com/{1!s}'.format(region, pool_id)
+
+
+def load_jwks():
+    """Loads the user pool's JSON Web Key Set.
+
+    COGNITO_JWKS_FILE points at a local copy of the document, for offline
+    testing, and the in-memory identity backend serves its own; otherwise it
+    is fetched from the pool's well-known URL.
+    """
+    path = current_app.config.get('COGNITO_JWKS_FILE')
+    if path:
+        with open(path) as jwks_file:
+            return json.load(jwks_file)
+    if current_app.config.get('IDENTITY_BACKEND') == 'memory':
+        return clients.get('cognito-idp').jwks()
+    response = urlopen(cognito_issuer() + '/.well-known/jwks.json', timeout=5)
+    try:
+        return json.loads(response.read().decode('utf-8'))
+    finally:
+        response.close()
+
+
+def get_signing_key(kid):
+    """Returns the JWK with the given key id, refetching the set once on a miss
+    in case the pool's keys were rotated."""
+    cache = caches.get('jwks')
+    for refresh in (False, True):
+        if refresh:
+            cache.invalidate('jwks')
+        jwks = cache.get_or_set('jwks', load_jwks)
+        for key in jwks.get('keys', []):
+            if key.get('kid') == kid:
+                return key
+    raise JWTError('No signing key found for kid {0!s}'.format(kid))
+
+
+def verify_id_token(id_token):
+    """Verifies an ID token's signature, expiry, audience and issuer.
+
+    Returns the token's claims. Raises jose.exceptions.ExpiredSignatureError
+    once the token has expired and jose.exceptions.JWTError if it is invalid.
+    """
+    header = jwt.get_unverified_header(id_token)
+    claims = jwt.decode(
+        id_token,
+        get_signing_key(header.get('kid')),
+        algorithms=current_app.config['COGNITO_TOKEN_ALGORITHMS'],
+        audience=current_app.config['COGNITO_APP_CLIENT_ID'],
+        issuer=cognito_issuer(),
+        options={'verify_at_hash': False})
+    if claims.get('token_use') != 'id':
+        raise JWTError('Token is not an ID token')
+    return claims
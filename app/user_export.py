@@ -0,0 +1,101 @@
+import csv
+import json
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+
+from .bulk import call_with_backoff
+from .cognito_handler import MAX_USERS_PAGE_SIZE, iter_users
+
+# Cognito attributes an export can include; email is always included
+EXPORT_ATTRIBUTES = ('email', 'given_name', 'family_name')
+# Fields every exported user has, whatever attributes were asked for
+RECORD_FIELDS = ('status', 'enabled', 'created')
+
+
+def export_columns(attributes, include_groups):
+    return list(attributes) + list(RECORD_FIELDS) + (['groups'] if include_groups else [])
+
+
+def iter_export_rows(attributes=EXPORT_ATTRIBUTES, include_groups=True,
+                     filter_expression=None, workers=8):
+    """Yields a dict per user in the pool, one list_users page at a time.
+
+    Only the given attributes are requested from Cognito (AttributesToGet),
+    which shrinks each page. With include_groups, the group memberships of
+    each page's users are fetched concurrently on a pool of workers threads
+    before the page is yielded, retrying throttled lookups, so memory use
+    stays at one page whatever the size of the pool.
+    """
+    attributes = ['email'] + [a for a in attributes if a != 'email']
+    app = current_app._get_current_object()
+    pool = ThreadPool(workers) if include_groups else None
+
+    def load_groups(user):
+        with app.app_context():
+            call_with_backoff(user.load_groups)
+            return sorted(user.groups)
+
+    try:
+        page = []
+        for user in iter_users(filter_expression=filter_expression, attributes=attributes,
+                               page_size=MAX_USERS_PAGE_SIZE):
+            page.append(user)
+            if len(page) == MAX_USERS_PAGE_SIZE:
+                for row in _rows(page, attributes, pool, load_groups):
+                    yield row
+                page = []
+        for row in _rows(page, attributes, pool, load_groups):
+            yield row
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _rows(users, attributes, pool, load_groups):
+    groups = pool.map(load_groups, users) if pool is not None and users else None
+    for index, user in enumerate(users):
+        row = dict((attribute, getattr(user, attribute, None)) for attribute in attributes)
+        row['status'] = user.status
+        row['enabled'] = user.enabled
+        row['created'] = user.created.isoformat() if user.created else None
+        if groups is not None:
+            row['groups'] = groups[index]
+        yield row
+
+
+def csv_lines(rows, columns):
+    """Yields a header line and then a CSV line per row, encoded as UTF-8.
+
+    Groups are joined with semicolons.
+    """
+    buffer = BytesIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_csv_value(value) for value in values])
+        return buffer.getvalue()
+
+    yield line(columns)
+    for row in rows:
+        yield line(row.get(column) for column in columns)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        value = u';'.join(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def ndjson_lines(rows):
+    """Yields each row as a line of JSON (newline-delimited JSON)."""
+    for row in rows:
+        yield json.dumps(row, sort_keys=True) + '\n'
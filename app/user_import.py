@@ -0,0 +1,171 @@
+import csv
+import re
+
+from botocore.exceptions import ClientError
+from flask import current_app, url_for
+
+from .bulk import run_bulk
+from .cognito_handler import create_user, group_catalogue
+from .email import email_batcher, send_email
+from .models import UserDirectoryEntry
+
+# Columns an import file must have; a 'group' column is optional
+REQUIRED_COLUMNS = ('email', 'first_name', 'last_name')
+# Matches the Length(1, 64) validators of the single user forms
+MAX_FIELD_LENGTH = 64
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class ImportReport(object):
+    """What a bulk import did: users created and per-row errors."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = []
+        # (line number, email, message) triples
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """Users created per second"""
+        return len(self.created) / self.elapsed if self.elapsed else 0.0
+
+
+def read_rows(lines):
+    """Returns an iterator of (line number, row) over a CSV file with a header line.
+
+    lines is any iterable of lines, e.g. an open file or an upload's
+    stream, and rows are read as they are used, so only one is held in
+    memory at a time. Raises ValueError straight away if the header lacks
+    a required column.
+    """
+    reader = csv.DictReader(lines)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError('The file has no {0!s} column'.format(', '.join(missing)))
+    return ((reader.line_num, row) for row in reader)
+
+
+def _row_email(row):
+    return (row.get('email') or '').decode('utf-8', 'replace').strip()
+
+
+def validate_row(row, groups, default_group, seen):
+    """Returns (details, None) for a valid row or (None, error message).
+
+    seen holds the emails of earlier rows, so a file can't create the same
+    user twice. Values are decoded from UTF-8 and stripped.
+    """
+    try:
+        row = dict((key, (value or '').decode('utf-8').strip())
+                   for key, value in row.items() if key is not None)
+    except UnicodeDecodeError:
+        return None, 'Not valid UTF-8 text'
+    email = row.get('email', '').lower()
+    if not EMAIL_PATTERN.match(email):
+        return None, 'Invalid email address'
+    if email in seen:
+        return None, 'Duplicate of an earlier row'
+    for column in REQUIRED_COLUMNS:
+        if not row.get(column):
+            return None, 'Missing {0!s}'.format(column)
+        if len(row[column]) > MAX_FIELD_LENGTH:
+            return None, '{0!s} is longer than {1!s} characters'.format(column, MAX_FIELD_LENGTH)
+    group = row.get('group') or default_group
+    if group not in groups:
+        return None, 'Unknown account type {0!s}'.format(group)
+    seen.add(email)
+    return {'email': email,
+            'given_name': row['first_name'],
+            'family_name': row['last_name'],
+            'group': group}, None
+
+
+def import_users(rows, default_group, invite=True, workers=8, rate=20,
+                 max_rows=None, progress=None):
+    """Creates a Cognito user for every valid row from read_rows.
+
+    Invalid rows are reported without calling Cognito. Valid rows are
+    created concurrently through run_bulk, rate limited and retried when
+    throttled; an email that is already registered is reported as that
+    row's error. New users are then written to the user directory in batch
+    writes and, with invite set, sent invitations through the email
+    batcher, which groups them into EMAIL_BATCH_SIZE deliveries. Invite
+    links need a request context (or SERVER_NAME) for url_for.
+
+    Stops reading after max_rows rows, reporting an error for the rest.
+    Returns an ImportReport.
+    """
+    report = ImportReport()
+    groups = set(group.name for group in group_catalogue())
+    seen = set()
+
+    def valid_rows():
+        # Runs on run_bulk's task thread, where an exception would stall the
+        # pool, so an unreadable file ends the import with an error instead
+        rows_iter = iter(rows)
+        while True:
+            try:
+                line, row = next(rows_iter)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                report.errors.append((report.rows + 2, '', 'Could not read the file: {0!s}'.format(e)))
+                return
+            report.rows += 1
+            if max_rows is not None and report.rows > max_rows:
+                report.errors.append((line, _row_email(row),
+                                      'Not imported, only {0!s} rows are allowed'.format(max_rows)))
+                continue
+            details, error = validate_row(row, groups, default_group, seen)
+            if error:
+                report.errors.append((line, _row_email(row), error))
+            else:
+                details['line'] = line
+                yield details
+
+    def create(details, call):
+        try:
+            user = call(lambda: create_user(details['email'], details['given_name'],
+                                            details['family_name']))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'UsernameExistsException':
+                raise ValueError('Email already registered')
+            raise
+        call(lambda: user.add_to_group(details['group']))
+        return user
+
+    result = run_bulk(current_app._get_current_object(), create, valid_rows(),
+                      workers=workers, rate=rate, progress=progress)
+    report.created = result.results
+    report.elapsed = result.elapsed
+    report.errors.extend((details['line'], details['email'], str(error))
+                         for details, error in result.failures)
+    report.errors.sort()
+
+    if UserDirectoryEntry.enabled_for_app():
+        with UserDirectoryEntry.batch_write() as batch:
+            for user in report.created:
+                batch.save(UserDirectoryEntry.from_user(user))
+
+    if invite:
+        for user in report.created:
+            send_invite(user)
+        email_batcher.flush()
+    return report
+
+
+def send_invite(user):
+    """Queues the invitation email invite_user sends, for a new user."""
+    invite_link = url_for(
+        'account.join_from_invite',
+        user_id=user.email,
+        token=user.generate_confirmation_token(),
+        _external=True)
+    send_email(
+        recipient=user.email,
+        subject='You Are Invited To Join',
+        template='account/email/invite',
+        user=user.email_context(),
+        invite_link=invite_link)
@@ -1,4 +1,6 @@
-from flask import url_for
+from flask import current_app, url_for
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
 
 
 def register_template_utils(app):
@@ -13,8 +15,123 @@ def register_template_utils(app):
         from wtforms.fields import HiddenField
         return isinstance(field, HiddenField)
 
+    # Replaces Flask-WTF's csrf_token, which it sets as both a global and a
+    # context processor, so cached pages can hold a placeholder
+    from .decorators import page_csrf_token
+    app.add_template_global(page_csrf_token, 'csrf_token')
+    app.context_processor(lambda: {'csrf_token': page_csrf_token})
+
     app.add_template_global(index_for_group)
+    app.add_template_global(editable_regions)
+    app.jinja_env.add_extension(FragmentCacheExtension)
 
 
 def index_for_group(group):
     return url_for(group.arn)
+
+
+def editable_regions(*editor_names):
+    """Fetches every editable region a page shows in one go.
+
+    Usage::
+
+        {% set editors = editable_regions('about', 'contact') %}
+        {{ editors['about'].value | safe }}
+    """
+    from .models import EditableHTML
+    return EditableHTML.get_many(editor_names)
+
+
+class FragmentCacheExtension(Extension):
+    """Caches the rendered output of a template region in the 'fragment' cache.
+
+    Usage, where every expression after the tag is part of the cache key::
+
+        {% cache 'editor', editable_html_obj.editor_name, editable_html_obj.version %}
+            ...
+        {% endcache %}
+
+    Disabled when FRAGMENT_CACHE_ENABLED is False.
+    """
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]),
+            [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def _render_cached(key_parts, caller):
+        if not current_app.config['FRAGMENT_CACHE_ENABLED']:
+            return caller()
+        from . import caches
+        key = u':'.join(u'{0!s}'.format(part) for part in key_parts)
+        return caches.get('fragment').get_or_set(key, caller)
+
+
+class RelocatableBytecodeCache(FileSystemBytecodeCache):
+    """A bytecode cache keyed by template name alone.
+
+    Jinja also keys on the template's absolute filename, which differs
+    between the machine that runs compile_templates and Lambda. Stale
+    bytecode is still ignored, as Jinja checks a checksum of the source.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return FileSystemBytecodeCache.get_cache_key(self, name)
+
+
+class ReadOnlyBytecodeCache(RelocatableBytecodeCache):
+    """A bytecode cache that tolerates a read-only directory, as on Lambda.
+
+    Templates missing from the shipped cache are compiled in memory as usual.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            RelocatableBytecodeCache.dump_bytecode(self, bucket)
+        except (IOError, OSError):
+            pass
+
+
+def configure_template_cache(app):
+    """Loads templates from the precompiled bytecode cache (called from __init__.py).
+
+    With JINJA_PRECOMPILED_TEMPLATES set, templates are read from the
+    bytecode built by `manage.py compile_templates` as they are first used,
+    so no request pays for compilation; warm_up loads them ahead of the
+    first request. Bytecode is specific to the Python version that produced
+    it; Jinja recompiles anything built by another version.
+    """
+    if not app.config['JINJA_PRECOMPILED_TEMPLATES']:
+        return
+    app.jinja_env.bytecode_cache = ReadOnlyBytecodeCache(
+        app.config['JINJA_BYTECODE_CACHE_DIR'])
+    # Templates ship with the package and never change under a running app
+    app.jinja_env.auto_reload = False
+
+
+def template_names(app):
+    return [name for name in app.jinja_env.list_templates()
+            if name.endswith(('.html', '.txt'))]
+
+
+def compile_templates(app):
+    """Writes bytecode for every template into JINJA_BYTECODE_CACHE_DIR."""
+    import os
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    app.jinja_env.bytecode_cache = RelocatableBytecodeCache(directory)
+    # Compile from source even if the templates were already loaded
+    app.jinja_env.cache.clear()
+    app.jinja_env.bytecode_cache.clear()
+    names = template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
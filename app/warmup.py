@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+def prime_clients():
+    from . import clients
+    for service_name in current_app.config['WARM_UP_CLIENTS']:
+        clients.get(service_name)
+
+
+def prime_groups():
+    from .cognito_handler import group_catalogue
+    group_catalogue()
+
+
+def prime_signing_keys():
+    if not current_app.config['COGNITO_TOKEN_LOADER']:
+        return
+    from . import caches
+    from .tokens import load_jwks
+    caches.get('jwks').get_or_set('jwks', load_jwks)
+
+
+def prime_templates():
+    from .utils import template_names
+    for name in template_names(current_app):
+        current_app.jinja_env.get_template(name)
+
+
+def prime_editable_html():
+    from .models import EditableHTML
+    EditableHTML.get_many(current_app.config['WARM_UP_EDITABLE_HTML'])
+
+
+# Run in this order; each step's time is reported separately
+WARM_UP_STEPS = OrderedDict([
+    ('clients', prime_clients),
+    ('groups', prime_groups),
+    ('signing_keys', prime_signing_keys),
+    ('templates', prime_templates),
+    ('editable_html', prime_editable_html),
+])
+
+
+def warm_up(app):
+    """Does the work the first request on a new container would otherwise pay for.
+
+    Builds the pooled AWS clients and fills the group catalogue, JWKS,
+    template and EditableHTML caches. A step that fails is reported and the
+    rest still run, so a warm-up never takes the app down. Returns an
+    OrderedDict of step name to milliseconds taken, or to the error.
+    """
+    report = OrderedDict()
+    with app.app_context():
+        for name, step in WARM_UP_STEPS.items():
+            start = time.time()
+            try:
+                step()
+            except Exception as e:
+                report[name] = 'failed: {0!s}'.format(e)
+                app.logger.warning('Warm-up step %s failed: %s', name, e)
+            else:
+                report[name] = round((time.time() - start) * 1000.0, 1)
+    app.logger.info('Warm-up took %s', dict(report))
+    return report
+
+
+def keep_warm(event, context):
+    """Scheduled Lambda entry point (see "events" in zappa_settings.json).
+
+    Importing app.runserver creates the app on a cold container, and the
+    ping then makes sure its caches are primed. Caches that are still fresh
+    are not reloaded, so pings to a warm container are cheap.
+    """
+    from .runserver import app
+    return warm_up(app)
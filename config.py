@@ -14,13 +14,79 @@ class Config:
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'password'
     ADMIN_EMAIL = os.environ.get(
         'ADMIN_EMAIL') or 'flask-base-administrator@example.com'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     EMAIL_SUBJECT_PREFIX = '[{}]'.format(APP_NAME)
     EMAIL_SENDER = '{app_name} Admin <{email}>'.format(
         app_name=APP_NAME, email=MAIL_USERNAME)
 
-    DYNAMO_URL = os.environ.get('DYNAMO_CONN', 'http://127.0.0.1:8000/')
+    EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 25))
+    EMAIL_FLUSH_INTERVAL = int(os.environ.get('EMAIL_FLUSH_INTERVAL', 0))
+    EMAIL_QUEUE = os.environ.get('EMAIL_QUEUE', 'lambda')
+    # 'inline', or 'thread' to deliver batches in the background (not on Lambda)
+    EMAIL_DISPATCH = os.environ.get('EMAIL_DISPATCH', 'inline')
+    EMAIL_DISPATCH_WORKERS = int(os.environ.get('EMAIL_DISPATCH_WORKERS', 2))
+    EMAIL_DISPATCH_QUEUE_SIZE = int(os.environ.get('EMAIL_DISPATCH_QUEUE_SIZE', 100))
+
+    # DynamoDB endpoint; None uses AWS in DYNAMO_REGION
+    DYNAMO_URL = os.environ.get('DYNAMO_CONN') or os.environ.get('DYNAMO_URL')
+    DYNAMO_REGION = os.environ.get('DYNAMO_REGION', 'us-east-1')
+    # Prepended to every table name, to keep tenants or test runs apart
+    DYNAMO_TABLE_PREFIX = os.environ.get('DYNAMO_TABLE_PREFIX', '')
+    # Override the tables' provisioned capacity; None keeps each model's own
+    DYNAMO_READ_CAPACITY_UNITS = None
+    DYNAMO_WRITE_CAPACITY_UNITS = None
+    DYNAMO_MAX_POOL_CONNECTIONS = 10
+    DYNAMO_KEEPALIVE_IDLE = 60
     COGNITO_POOL_ID = os.environ.get('COGNITO_POOL_ID')
     COGNITO_APP_CLIENT_ID = os.environ.get('COGNITO_APP_CLIENT_ID')
+    COGNITO_TOKEN_LOADER = (os.environ.get('COGNITO_TOKEN_LOADER') or 'True') == 'True'
+    COGNITO_JWKS_FILE = os.environ.get('COGNITO_JWKS_FILE')
+    COGNITO_TOKEN_ALGORITHMS = ['RS256']
+    JWKS_CACHE_TTL = 24 * 60 * 60
+    # 'cognito', or 'memory' for an in-process stand-in pool (tests and benchmarks)
+    IDENTITY_BACKEND = os.environ.get('IDENTITY_BACKEND', 'cognito')
+    AWS_REGION = os.environ.get('AWS_REGION')
+    AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 10))
+    AWS_ENDPOINT_URLS = {
+        'cognito-idp': os.environ.get('COGNITO_ENDPOINT_URL'),
+    }
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 1024))
+    # 'dynamodb', 'memory', 'sqlite' or 'cookie' (Flask's signed cookie sessions)
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'dynamodb')
+    SESSION_MEMORY_MAX_ENTRIES = 10000
+    SESSION_SQLITE_PATH = os.path.join(basedir, 'sessions.sqlite')
+    SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL', 5))
+    GROUP_CACHE_TTL = int(os.environ.get('GROUP_CACHE_TTL', 3600))
+    EDITABLE_HTML_CACHE_TTL = int(os.environ.get('EDITABLE_HTML_CACHE_TTL', 300))
+    FRAGMENT_CACHE_ENABLED = True
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 300))
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+    PAGE_CACHE_VARY_HEADERS = []
+    JINJA_PRECOMPILED_TEMPLATES = (os.environ.get('JINJA_PRECOMPILED_TEMPLATES') or 'False') == 'True'
+    JINJA_BYTECODE_CACHE_DIR = os.path.join(basedir, 'app', 'template_cache')
+    ADMIN_USERS_PAGE_SIZE = 30
+    # Page cursors kept in the session; earlier pages are reached from the first one
+    ADMIN_USERS_CURSOR_HISTORY = 20
+    # Bulk user imports: concurrent Cognito writers, requests per second, and
+    # the most rows one upload may hold (manage.py import_users has no limit)
+    IMPORT_USERS_WORKERS = 8
+    IMPORT_USERS_RATE = 20
+    IMPORT_USERS_MAX_ROWS = int(os.environ.get('IMPORT_USERS_MAX_ROWS', 200))
+    # Concurrent group membership lookups per page of a user export
+    EXPORT_USERS_WORKERS = 8
+    # Prime clients and caches when the app is created by app.runserver
+    WARM_UP_ON_START = (os.environ.get('WARM_UP_ON_START') or 'False') == 'True'
+    WARM_UP_CLIENTS = ['cognito-idp', 'lambda']
+    WARM_UP_EDITABLE_HTML = ['about']
+    # Time Cognito and DynamoDB calls; see app/metrics.py
+    CALL_METRICS_ENABLED = (os.environ.get('CALL_METRICS_ENABLED') or 'True') == 'True'
+    CALL_METRICS_SERVER_TIMING = (os.environ.get('CALL_METRICS_SERVER_TIMING') or 'True') == 'True'
+    CALL_METRICS_LOG = (os.environ.get('CALL_METRICS_LOG') or 'True') == 'True'
+    USER_DIRECTORY_ENABLED = (os.environ.get('USER_DIRECTORY_ENABLED') or 'False') == 'True'
+    # Partitions the unfiltered user list is spread over; rebuild the directory after changing
+    USER_DIRECTORY_SHARDS = int(os.environ.get('USER_DIRECTORY_SHARDS', 1))
     FLASKS3_BUCKET_NAME = 'serverless-flask-base'
 
     @staticmethod
@@ -30,6 +96,8 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    EMAIL_DISPATCH = os.environ.get('EMAIL_DISPATCH', 'thread')
+    DYNAMO_URL = Config.DYNAMO_URL or 'http://127.0.0.1:8000/'
     ASSETS_DEBUG = True
     FLASK_ASSETS_USE_S3 = True
     FLASK_S3_DEBUG = True
@@ -39,6 +107,12 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    SESSION_BACKEND = 'cookie'
+    IDENTITY_BACKEND = os.environ.get('IDENTITY_BACKEND', 'memory')
+    COGNITO_POOL_ID = Config.COGNITO_POOL_ID or 'us-east-1_testing'
+    COGNITO_APP_CLIENT_ID = Config.COGNITO_APP_CLIENT_ID or 'testing'
+    DYNAMO_URL = Config.DYNAMO_URL or 'http://127.0.0.1:8000/'
+    DYNAMO_TABLE_PREFIX = 'test_'
 
 
 class ProductionConfig(Config):
@@ -6,7 +6,7 @@ import boto3
 from flask.ext.script import Manager, Shell
 
 from app import create_app
-from app.models import User, EditableHTML, Session as appSession
+from app.models import User, EditableHTML, UserDirectoryEntry, Session as appSession
 
 if os.path.exists('.env'):
     print('Importing environment from .env file')
@@ -64,11 +64,103 @@ def recreate_db():
     type=int,
     help='Number of each model type to create',
     dest='number_users')
-def add_fake_data(number_users):
+@manager.option(
+    '-w',
+    '--workers',
+    default=8,
+    type=int,
+    help='Number of concurrent worker threads',
+    dest='workers')
+@manager.option(
+    '-r',
+    '--rate',
+    default=20,
+    type=float,
+    help='Maximum Cognito/DynamoDB requests per second (0 for no limit)',
+    dest='rate')
+@manager.option(
+    '-g',
+    '--groups',
+    default=None,
+    help='Comma separated groups to spread users over (default: the least privileged groups)',
+    dest='groups')
+def add_fake_data(number_users, workers, rate, groups):
+    """
+    Creates fake users in Cognito (and the user directory, when enabled)
+    for load testing, reporting progress and throughput.
+    """
+    def progress(result):
+        done = result.succeeded + len(result.failures)
+        if done % 100 == 0 or done == number_users:
+            print('{0!s}/{1!s} users, {2!s} failed, {3:.1f} users/s'.format(
+                done, number_users, len(result.failures), result.throughput))
+
+    with app.app_context():
+        result = User.generate_fake(
+            count=number_users, workers=workers, rate=rate,
+            groups=groups.split(',') if groups else None, progress=progress)
+
+    print('Created {0!s} users in {1:.1f} s ({2:.1f} users/s), {3!s} throttled requests retried'.format(
+        result.succeeded, result.elapsed, result.throughput, result.retries))
+    for details, error in result.failures[:10]:
+        print('Failed to create {0!s}: {1!s}'.format(details['email'], error))
+    if len(result.failures) > 10:
+        print('... and {0!s} more failures'.format(len(result.failures) - 10))
+
+
+@manager.option('path', help='CSV file with email, first_name, last_name and optional group columns')
+@manager.option(
+    '-g',
+    '--group',
+    required=True,
+    help='Account type for rows without a group',
+    dest='group')
+@manager.option(
+    '-w',
+    '--workers',
+    default=8,
+    type=int,
+    help='Number of concurrent worker threads',
+    dest='workers')
+@manager.option(
+    '-r',
+    '--rate',
+    default=20,
+    type=float,
+    help='Maximum Cognito requests per second (0 for no limit)',
+    dest='rate')
+@manager.option(
+    '-u',
+    '--base-url',
+    default='http://localhost:5000',
+    help='Site URL that invitation links point at',
+    dest='base_url')
+@manager.option(
+    '--no-invite',
+    action='store_true',
+    help="Create the users without emailing them",
+    dest='no_invite')
+def import_users(path, group, workers, rate, base_url, no_invite):
     """
-    Adds fake data to the database.
+    Creates (and invites) the users listed in a CSV file, reporting progress
+    and the rows that could not be imported.
     """
-    User.generate_fake(count=number_users)
+    from app.user_import import import_users as run_import, read_rows
+
+    def progress(result):
+        done = result.succeeded + len(result.failures)
+        if done % 100 == 0:
+            print('{0!s} users processed, {1!s} failed, {2:.1f} users/s'.format(
+                done, len(result.failures), result.throughput))
+
+    with open(path, 'rb') as csv_file, app.test_request_context(base_url=base_url):
+        report = run_import(read_rows(csv_file), group, invite=not no_invite,
+                            workers=workers, rate=rate, progress=progress)
+
+    print('Created {0!s} of {1!s} users in {2:.1f} s ({3:.1f} users/s)'.format(
+        len(report.created), report.rows, report.elapsed, report.throughput))
+    for line, email, error in report.errors:
+        print('Line {0!s} {1!s}: {2!s}'.format(line, email.encode('utf-8'), error))
 
 
 @manager.command
@@ -191,12 +283,451 @@ def setup_general(session=None):
 
     # create the dynamo table
     if not EditableHTML.exists():
-        EditableHTML.create(read_capacity_units=1, write_capacity_units=1, wait=True)
+        EditableHTML.create_table(wait=True)
         print("DynamoDB table for editors created")
 
     if not appSession.exists():
-        appSession.create(read_capacity_units=1, write_capacity_units=1, wait=True)
-        print("DynamoDB table for sessions created")
+        appSession.create_table(wait=True)
+        dynamodb = session.client('dynamodb', endpoint_url=appSession.Meta.host)
+        dynamodb.update_time_to_live(
+            TableName=appSession.Meta.table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires'})
+        print("DynamoDB table for sessions created, expiring on 'expires'")
+
+    if not UserDirectoryEntry.exists():
+        UserDirectoryEntry.create_table(wait=True)
+        print("DynamoDB table for the user directory created")
+
+
+@manager.command
+def rebuild_user_directory():
+    """
+    Rebuilds the DynamoDB user directory from Cognito. Safe to re-run;
+    entries are overwritten in place, but entries for users no longer in
+    Cognito are kept, so recreate the table for a clean rebuild.
+    """
+    from app.cognito_handler import iter_users, iter_users_in_group, list_groups
+
+    if not UserDirectoryEntry.exists():
+        UserDirectoryEntry.create_table(wait=True)
+
+    # Resolve each user's highest precedence group with one listing per
+    # group instead of one lookup per user. Lower precedence values win,
+    # so they are applied last.
+    groups = sorted(list_groups(), key=lambda g: g.get('Precedence', 0), reverse=True)
+    memberships = {}
+    for group in groups:
+        for member in iter_users_in_group(group['GroupName']):
+            memberships[member.email] = group
+
+    count = 0
+    with UserDirectoryEntry.batch_write() as batch:
+        for user in iter_users():
+            group = memberships.get(user.email)
+            user.set_groups([group] if group else [])
+            batch.save(UserDirectoryEntry.from_user(user))
+            count += 1
+            if count % 1000 == 0:
+                print('{0!s} users written'.format(count))
+    print('The user directory now holds {0!s} users'.format(count))
+
+
+@manager.option(
+    '-n',
+    '--requests',
+    default=50,
+    type=int,
+    help='Number of simulated requests',
+    dest='requests')
+@manager.option(
+    '-c',
+    '--calls-per-request',
+    default=3,
+    type=int,
+    help='Cognito call sites hit per simulated request',
+    dest='calls_per_request')
+def bench_cognito_clients(requests, calls_per_request):
+    """
+    Compares per-request Cognito client overhead: a new boto3.Session and
+    client per call versus the shared app client pool. No API calls are made.
+    """
+    import timeit
+    from app import clients
+
+    def per_call_session():
+        for _ in range(calls_per_request):
+            boto3.Session().client('cognito-idp', region_name='us-east-1')
+
+    def shared_pool():
+        for _ in range(calls_per_request):
+            clients.get('cognito-idp')
+
+    clients.clear()
+    for name, func in (('new session per call', per_call_session),
+                       ('shared client pool', shared_pool)):
+        elapsed = timeit.timeit(func, number=requests)
+        print('{0:<22} {1:8.2f} ms/request'.format(
+            name, elapsed * 1000.0 / requests))
+
+
+@manager.option(
+    '-n',
+    '--invocations',
+    default=20,
+    type=int,
+    help='Number of simulated Lambda invocations',
+    dest='invocations')
+def bench_email_worker(invocations):
+    """
+    Times the email Lambda handler cold (app and SMTP connection built on
+    the first invocation) against warm invocations that reuse them, and
+    against building a fresh app and connection per invocation as the
+    worker used to. Mail is really sent, to an SMTP server on a free local
+    port that discards it.
+    """
+    import timeit
+    from app import email
+
+    server, port = _local_smtp_sink()
+
+    def worker_app():
+        app = create_app('testing')
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False,
+                          MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False)
+        return app
+
+    user = User()
+    user.email = 'bench@example.com'
+    user.given_name, user.family_name = 'Bench', 'Mark'
+    event = {'recipient': user.email,
+             'subject': 'Confirm Your Account',
+             'template': 'account/email/confirm',
+             'context': {'user': user.email_context(),
+                         'confirm_link': 'http://localhost/confirm'}}
+
+    def invoke():
+        email.send_email_func(event=dict(event))
+
+    def invoke_with_new_app():
+        email.close_mail_connection()
+        email._worker_app = worker_app()
+        invoke()
+
+    def invoke_cold():
+        email.close_mail_connection()
+        email._worker_app = worker_app()
+        invoke()
+
+    cold = timeit.timeit(invoke_cold, number=1)
+    warm = timeit.timeit(invoke, number=invocations)
+    rebuilt = timeit.timeit(invoke_with_new_app, number=invocations)
+    email.close_mail_connection()
+    email._worker_app = None
+    server.stop()
+    print('{0:<26} {1:8.2f} ms'.format('cold invocation', cold * 1000.0))
+    print('{0:<26} {1:8.2f} ms'.format('warm invocation', warm * 1000.0 / invocations))
+    print('{0:<26} {1:8.2f} ms'.format('new app per invocation', rebuilt * 1000.0 / invocations))
+    print('{0:<26} {1:8d}'.format('messages received', server.received))
+
+
+def _local_smtp_sink():
+    """Starts an SMTP server on a free local port that counts and discards mail.
+
+    Returns (server, port); the server runs on a thread until server.stop().
+    """
+    import asyncore
+    import smtpd
+    import threading
+
+    class Sink(smtpd.SMTPServer):
+        received = 0
+
+        def process_message(self, peer, mailfrom, rcpttos, data):
+            self.received += 1
+
+    stopped = threading.Event()
+
+    def serve():
+        while not stopped.is_set():
+            asyncore.loop(timeout=0.05, count=1)
+        asyncore.close_all()
+
+    def stop():
+        stopped.set()
+        thread.join()
+
+    server = Sink(('127.0.0.1', 0), None)
+    server.stop = stop
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return server, server.socket.getsockname()[1]
+
+
+@manager.option(
+    '-n',
+    '--messages',
+    default=1000,
+    type=int,
+    help='Number of recipients to render for',
+    dest='messages')
+def bench_email_render(messages):
+    """
+    Compares messages rendered per second for a bulk invite: render_template
+    for both bodies of every message, as the worker used to, against the
+    worker's template pairs rendered in a batch.
+    """
+    import time
+    from flask import render_template
+    from app.email import email_templates
+
+    template = 'account/email/invite'
+    contexts = [{'user': {'full_name': 'User {0!s}'.format(i),
+                          'email': 'user{0!s}@example.com'.format(i)},
+                 'invite_link': 'http://localhost/join/{0!s}'.format(i)}
+                for i in range(messages)]
+
+    def per_message():
+        for context in contexts:
+            render_template(template + '.txt', **context)
+            render_template(template + '.html', **context)
+
+    def batched():
+        email_templates(app).render_many(template, contexts)
+
+    with app.test_request_context():
+        for name, func in (('render_template per message', per_message),
+                           ('template pairs, batched', batched)):
+            func()  # compile and cache outside the timing
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            print('{0:<28} {1:10.0f} messages/s'.format(name, messages / elapsed))
+
+
+@manager.option(
+    '-b',
+    '--backends',
+    default='memory,sqlite,dynamodb',
+    help='Comma separated SESSION_BACKEND values to compare',
+    dest='backends')
+@manager.option(
+    '-c',
+    '--concurrency',
+    default=4,
+    type=int,
+    help='Number of simulated users browsing at once',
+    dest='concurrency')
+@manager.option(
+    '-n',
+    '--views',
+    default=100,
+    type=int,
+    help='Authenticated page views per user',
+    dest='views')
+def bench_sessions(backends, concurrency, views):
+    """
+    Load-tests the session backends: each simulated user logs in, storing
+    Cognito-sized tokens in the session, then views the home page. Reports
+    p50/p99 latency of the page views per backend. Users are served from
+    the user cache, so Cognito is not called; the dynamodb backend needs
+    DYNAMO_URL or AWS credentials.
+    """
+    import threading
+    import time
+    from flask import session
+    from flask.ext.login import login_user
+    from app import caches
+    from app.sessions import init_sessions
+
+    def percentile(timings, fraction):
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000.0
+
+    for backend in backends.split(','):
+        bench_app = create_app('testing')
+        bench_app.config.update(SESSION_BACKEND=backend,
+                                COGNITO_TOKEN_LOADER=False,
+                                USER_CACHE_TTL=24 * 60 * 60)
+
+        @bench_app.route('/bench-login/<email>')
+        def bench_login(email):
+            login_user(caches.get('user').get(email))
+            # Roughly the size of the tokens Cognito issues
+            session['id_token'] = 'i' * 1000
+            session['access_token'] = 'a' * 900
+            session['refresh_token'] = 'r' * 1700
+            return 'OK'
+
+        timings = []
+        errors = []
+
+        def browse(email):
+            client = bench_app.test_client()
+            try:
+                client.get('/bench-login/' + email)
+                for _ in range(views):
+                    start = time.time()
+                    client.get('/')
+                    timings.append(time.time() - start)
+            except Exception as e:
+                errors.append(e)
+
+        with bench_app.app_context():
+            init_sessions(bench_app)
+            emails = ['bench{0}@example.com'.format(i) for i in range(concurrency)]
+            for email in emails:
+                caches.get('user').set(email, User.from_claims({'email': email}))
+
+            threads = [threading.Thread(target=browse, args=(email,)) for email in emails]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            print('{0:<10} failed: {1!s}'.format(backend, errors[0]))
+            continue
+        timings.sort()
+        print('{0:<10} {1:6} views  p50 {2:8.2f} ms  p99 {3:8.2f} ms'.format(
+            backend, len(timings), percentile(timings, 0.5), percentile(timings, 0.99)))
+
+
+@manager.command
+def compile_templates():
+    """
+    Precompiles every template into the Jinja bytecode cache that ships with
+    the Zappa package. Run it with the same Python version as Lambda.
+    """
+    from app.utils import compile_templates as compile_all
+    names = compile_all(app)
+    print('Compiled {0!s} templates into {1!s}'.format(
+        len(names), app.config['JINJA_BYTECODE_CACHE_DIR']))
+
+
+@manager.option(
+    '-n',
+    '--runs',
+    default=5,
+    type=int,
+    help='Number of cold starts per mode',
+    dest='runs')
+def bench_cold_start(runs):
+    """
+    Measures create_app time and first-request latency in fresh processes,
+    with and without the precompiled template cache. Run compile_templates
+    first.
+    """
+    import json
+    import sys
+
+    script = (
+        'import json, time\n'
+        't0 = time.time()\n'
+        'from app import create_app\n'
+        'app = create_app("testing")\n'
+        't1 = time.time()\n'
+        'app.test_client().get("/")\n'
+        't2 = time.time()\n'
+        'print(json.dumps([t1 - t0, t2 - t1]))\n')
+    for precompiled in ('False', 'True'):
+        env = dict(os.environ, JINJA_PRECOMPILED_TEMPLATES=precompiled)
+        startup, first_request = [], []
+        for _ in range(runs):
+            output = subprocess.check_output([sys.executable, '-c', script], env=env)
+            timings = json.loads(output.strip().splitlines()[-1])
+            startup.append(timings[0])
+            first_request.append(timings[1])
+        print('precompiled={0:<6} startup {1:8.2f} ms  first request {2:8.2f} ms'.format(
+            precompiled,
+            sum(startup) * 1000.0 / runs,
+            sum(first_request) * 1000.0 / runs))
+
+
+# Run in a fresh interpreter by profile_startup. Wraps __import__ so each
+# module's load time is recorded, both including and excluding the modules
+# it imports in turn.
+PROFILE_IMPORTS_SCRIPT = '''
+import json, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+original_import = builtins.__import__
+DEFAULT_LEVEL = -1 if sys.version_info[0] < 3 else 0
+timings = {}
+stack = []
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=DEFAULT_LEVEL):
+    if name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        key = name or ((globals or {}).get('__package__') or '') + ' (from . import)'
+        total, own = timings.get(key, (0.0, 0.0))
+        timings[key] = (total + elapsed, own + elapsed - children)
+
+builtins.__import__ = timed_import
+start = time.time()
+from app import create_app
+create_app(sys.argv[1])
+total = time.time() - start
+builtins.__import__ = original_import
+print(json.dumps({'total': total, 'modules': timings}))
+'''
+
+
+@manager.option(
+    '-n',
+    '--top',
+    default=25,
+    type=int,
+    help='Number of modules to list',
+    dest='top')
+@manager.option(
+    '-c',
+    '--config',
+    default='development',
+    help='Config to create the app with (production needs SECRET_KEY set)',
+    dest='config_name')
+def profile_startup(top, config_name):
+    """
+    Reports where create_app spends its time on import, per module, measured
+    in a fresh interpreter. "own" excludes time spent importing other
+    modules; "total" includes it.
+    """
+    import json
+    import sys
+
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROFILE_IMPORTS_SCRIPT, config_name])
+    profile = json.loads(output.strip().splitlines()[-1])
+    modules = sorted(profile['modules'].items(), key=lambda m: m[1][1], reverse=True)
+    print('create_app({0!s}) took {1:.1f} ms'.format(config_name, profile['total'] * 1000.0))
+    print('{0:>10} {1:>10}  module'.format('own ms', 'total ms'))
+    for name, (total, own) in modules[:top]:
+        print('{0:10.1f} {1:10.1f}  {2!s}'.format(own * 1000.0, total * 1000.0, name))
+
+
+@manager.command
+def warm_up():
+    """
+    Primes clients and caches the way the scheduled keep-warm ping does,
+    and reports how long each step took.
+    """
+    from app.warmup import warm_up as warm
+    for step, result in warm(app).items():
+        if isinstance(result, float):
+            print('{0:<14} {1:8.1f} ms'.format(step, result))
+        else:
+            print('{0:<14} {1!s}'.format(step, result))
 
 
 @manager.command
@@ -0,0 +1,83 @@
+import unittest
+
+from botocore.exceptions import ClientError
+
+from app import create_app
+from app.bulk import RateLimiter, call_with_backoff, run_bulk
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'AdminCreateUser')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_calls_are_spaced_out(self):
+        clock = FakeClock()
+        limiter = RateLimiter(10, clock=clock, sleep=clock.sleep)
+        for _ in range(11):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_no_rate_means_no_limit(self):
+        clock = FakeClock()
+        limiter = RateLimiter(None, clock=clock, sleep=clock.sleep)
+        for _ in range(100):
+            limiter.acquire()
+        self.assertEqual(clock.now, 0.0)
+
+
+class BackoffTestCase(unittest.TestCase):
+    def test_throttling_is_retried(self):
+        calls = []
+
+        def throttled_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise client_error('TooManyRequestsException')
+            return 'done'
+
+        self.assertEqual(call_with_backoff(throttled_twice, sleep=lambda _: None), 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_raised(self):
+        calls = []
+
+        def exists():
+            calls.append(1)
+            raise client_error('UsernameExistsException')
+
+        with self.assertRaises(ClientError):
+            call_with_backoff(exists, sleep=lambda _: None)
+        self.assertEqual(len(calls), 1)
+
+    def test_gives_up_after_retries(self):
+        def always_throttled():
+            raise client_error('ThrottlingException')
+
+        with self.assertRaises(ClientError):
+            call_with_backoff(always_throttled, retries=2, sleep=lambda _: None)
+
+
+class RunBulkTestCase(unittest.TestCase):
+    def test_results_and_failures_are_collected(self):
+        app = create_app('testing')
+
+        def square(n, call):
+            if n == 3:
+                raise ValueError('bad item')
+            return call(lambda: n * n)
+
+        result = run_bulk(app, square, range(6), workers=3)
+        self.assertEqual(sorted(result.results), [0, 1, 4, 16, 25])
+        self.assertEqual([item for item, _ in result.failures], [3])
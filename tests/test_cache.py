@@ -0,0 +1,55 @@
+import unittest
+
+from app.cache import TTLCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(ttl=10, max_entries=2, clock=self.clock)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_entries_expire(self):
+        self.cache.set('a', 1)
+        self.clock.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.set('a', 1)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_get_or_set_does_not_cache_none(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return None
+
+        self.cache.get_or_set('a', factory)
+        self.cache.get_or_set('a', factory)
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,48 @@
+import threading
+import unittest
+
+from app import clients, create_app
+
+
+class ClientPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['AWS_REGION'] = 'us-east-1'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_client_is_reused(self):
+        self.assertIs(clients.get('cognito-idp'), clients.get('cognito-idp'))
+
+    def test_clients_are_per_service(self):
+        self.assertIsNot(clients.get('cognito-idp'), clients.get('lambda'))
+
+    def test_endpoint_override(self):
+        clients.clear()
+        self.app.config['IDENTITY_BACKEND'] = 'cognito'
+        self.app.config['AWS_ENDPOINT_URLS'] = {
+            'cognito-idp': 'http://localhost:9229'}
+        client = clients.get('cognito-idp')
+        self.assertEqual(client.meta.endpoint_url, 'http://localhost:9229')
+
+    def test_memory_identity_backend(self):
+        from app.identity import InMemoryCognito
+        clients.clear()
+        self.assertIsInstance(clients.get('cognito-idp').wrapped, InMemoryCognito)
+
+    def test_concurrent_creation_yields_one_client(self):
+        clients.clear()
+        seen = []
+
+        def fetch():
+            seen.append(clients.get('cognito-idp', app=self.app))
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(client) for client in seen)), 1)
@@ -0,0 +1,195 @@
+import unittest
+
+from app import create_app
+from app import clients
+from app.cognito_handler import (authenticate_user, create_user, get_user,
+                                 group_catalogue, iter_users, list_groups,
+                                 list_users_page, set_permanent_password,
+                                 users_filter)
+
+
+class FakePagedClient(object):
+    """Serves list_users pages the way Cognito does, via PaginationToken."""
+
+    def __init__(self, emails, page_size):
+        self.pages = [emails[i:i + page_size]
+                      for i in range(0, len(emails), page_size)]
+        self.calls = []
+
+    def client(self, service_name):
+        return self
+
+    def list_users(self, **params):
+        self.calls.append(params)
+        index = int(params.get('PaginationToken', 0))
+        response = {'Users': [
+            {'Enabled': True, 'UserStatus': 'CONFIRMED',
+             'Attributes': [{'Name': 'email', 'Value': email}]}
+            for email in self.pages[index]]}
+        if index + 1 < len(self.pages):
+            response['PaginationToken'] = str(index + 1)
+        return response
+
+
+class FakeGroupsClient(object):
+    """Serves list_groups pages the way Cognito does, via NextToken."""
+
+    def __init__(self, groups, page_size):
+        self.pages = [groups[i:i + page_size]
+                      for i in range(0, len(groups), page_size)]
+        self.calls = 0
+
+    def client(self, service_name):
+        return self
+
+    def list_groups(self, **params):
+        self.calls += 1
+        index = int(params.get('NextToken', 0))
+        response = {'Groups': self.pages[index]}
+        if index + 1 < len(self.pages):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+class FakeAuthClient(object):
+    """Answers admin_initiate_auth for users created with a temporary password."""
+
+    def __init__(self, challenge='NEW_PASSWORD_REQUIRED'):
+        self.challenge = challenge
+        self.calls = []
+
+    def client(self, service_name):
+        return self
+
+    def admin_initiate_auth(self, **params):
+        self.calls.append(('admin_initiate_auth', params))
+        if self.challenge:
+            return {'ChallengeName': self.challenge, 'Session': 'challenge-session'}
+        return {'AuthenticationResult': {}}
+
+    def admin_respond_to_auth_challenge(self, **params):
+        self.calls.append(('admin_respond_to_auth_challenge', params))
+        return {'AuthenticationResult': {}}
+
+
+class ListUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['COGNITO_POOL_ID'] = 'us-east-1_test'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.emails = ['user{0}@example.com'.format(i) for i in range(5)]
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_iter_users_follows_pagination_tokens(self):
+        fake = FakePagedClient(self.emails, page_size=2)
+        users = list(iter_users(page_size=2, boto3_session=fake))
+        self.assertEqual([u.email for u in users], self.emails)
+        self.assertEqual(len(fake.calls), 3)
+
+    def test_list_users_page_returns_next_token(self):
+        fake = FakePagedClient(self.emails, page_size=2)
+        users, next_token = list_users_page(limit=2, boto3_session=fake)
+        self.assertEqual(len(users), 2)
+        self.assertEqual(next_token, '1')
+
+    def test_page_size_is_capped(self):
+        fake = FakePagedClient(self.emails, page_size=5)
+        list_users_page(limit=1000, boto3_session=fake)
+        self.assertEqual(fake.calls[0]['Limit'], 60)
+
+    def test_users_filter(self):
+        self.assertEqual(users_filter(email_prefix='ab'), 'email ^= "ab"')
+        self.assertEqual(users_filter(status='CONFIRMED'),
+                         'cognito:user_status = "CONFIRMED"')
+        self.assertIsNone(users_filter())
+
+
+class GroupCatalogueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['COGNITO_POOL_ID'] = 'us-east-1_test'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.fake = FakeGroupsClient([
+            {'GroupName': 'main', 'Precedence': 10},
+            {'GroupName': 'administrator', 'Precedence': 0,
+             'Description': 'Site administrators'},
+            {'GroupName': 'editors', 'Precedence': 5},
+        ], page_size=2)
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_list_groups_follows_next_token(self):
+        groups = list_groups(boto3_session=self.fake)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(self.fake.calls, 2)
+
+    def test_catalogue_is_ordered_and_cached(self):
+        groups = group_catalogue(boto3_session=self.fake)
+        self.assertEqual([g.name for g in groups], ['administrator', 'editors', 'main'])
+        self.assertEqual(groups[0].description, 'Site administrators')
+        group_catalogue(boto3_session=self.fake)
+        self.assertEqual(self.fake.calls, 2)
+
+    def test_refresh_reloads_the_catalogue(self):
+        group_catalogue(boto3_session=self.fake)
+        group_catalogue(refresh=True, boto3_session=self.fake)
+        self.assertEqual(self.fake.calls, 4)
+
+
+class PermanentPasswordTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['COGNITO_POOL_ID'] = 'us-east-1_test'
+        self.app.config['COGNITO_APP_CLIENT_ID'] = 'client'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_answers_new_password_challenge(self):
+        fake = FakeAuthClient()
+        set_permanent_password('a@example.com', 'Secret1!', boto3_session=fake)
+        name, params = fake.calls[-1]
+        self.assertEqual(name, 'admin_respond_to_auth_challenge')
+        self.assertEqual(params['Session'], 'challenge-session')
+        self.assertEqual(params['ChallengeResponses'],
+                         {'USERNAME': 'a@example.com', 'NEW_PASSWORD': 'Secret1!'})
+
+    def test_confirmed_user_is_left_alone(self):
+        fake = FakeAuthClient(challenge=None)
+        set_permanent_password('a@example.com', 'Secret1!', boto3_session=fake)
+        self.assertEqual([name for name, _ in fake.calls], ['admin_initiate_auth'])
+
+
+class CreateUserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        clients.get('cognito-idp').create_group(GroupName='general', UserPoolId='pool')
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_user_is_created_in_the_group(self):
+        user = create_user('ada@example.com', 'Ada', 'Lovelace', group='general')
+        self.assertEqual(user.status, 'FORCE_CHANGE_PASSWORD')
+        self.assertTrue(get_user('ada@example.com').member_of_group('general'))
+
+    def test_permanent_password_can_log_in(self):
+        user = create_user('ada@example.com', 'Ada', 'Lovelace', password='Secret1!',
+                           permanent=True)
+        self.assertEqual(user.status, 'CONFIRMED')
+        self.assertEqual(authenticate_user('ada@example.com', 'Secret1!').email,
+                         'ada@example.com')
+
+    def test_temporary_password_cannot_log_in(self):
+        create_user('ada@example.com', 'Ada', 'Lovelace', password='Secret1!')
+        self.assertIsNone(authenticate_user('ada@example.com', 'Secret1!'))
@@ -0,0 +1,145 @@
+import socket
+import unittest
+from collections import namedtuple
+
+from app import create_app
+from app.dynamodb import KeepAliveAdapter, LockedBotocoreSession, table_models
+from app.models import EditableHTML, UserDirectoryEntry
+
+
+class ConfigureModelsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+
+    def tearDown(self):
+        # Leave the models bound to a plain testing app for other tests
+        create_app('testing')
+
+    def test_models_are_bound_to_the_app_config(self):
+        self.assertEqual(EditableHTML.Meta.table_name, 'test_editors')
+        self.assertEqual(EditableHTML.Meta.host, self.app.config['DYNAMO_URL'])
+        self.assertEqual(EditableHTML._get_connection().table_name, 'test_editors')
+
+    def test_prefix_is_not_applied_twice(self):
+        create_app('testing')
+        self.assertEqual(EditableHTML.Meta.table_name, 'test_editors')
+
+    def test_models_share_one_http_session(self):
+        sessions = set(id(model._get_connection().connection.requests_session)
+                       for model in table_models())
+        self.assertEqual(len(sessions), 1)
+
+    def test_same_config_keeps_the_binding(self):
+        connection = EditableHTML._get_connection()
+        app = create_app('testing')
+        self.assertIs(EditableHTML._get_connection(), connection)
+        self.assertIs(app.extensions['dynamodb'], self.app.extensions['dynamodb'])
+
+    def test_changed_config_rebinds(self):
+        from app.dynamodb import configure_models
+        connection = EditableHTML._get_connection()
+        self.app.config['DYNAMO_TABLE_PREFIX'] = 'other_'
+        configure_models(self.app)
+        self.assertIsNot(EditableHTML._get_connection(), connection)
+        self.assertEqual(EditableHTML.Meta.table_name, 'other_editors')
+
+    def test_clients_are_created_under_a_lock(self):
+        session = EditableHTML._get_connection().connection.session
+        self.assertIsInstance(session, LockedBotocoreSession)
+        self.assertEqual(session.get_config_variable('region'),
+                         session.session.get_config_variable('region'))
+
+    def test_capacity_overrides_reach_indexes(self):
+        from app.dynamodb import configure_models
+        metas = [UserDirectoryEntry.Meta, UserDirectoryEntry.group_index.Meta]
+        self.app.config['DYNAMO_READ_CAPACITY_UNITS'] = 5
+        configure_models(self.app, models=[UserDirectoryEntry])
+        try:
+            self.assertEqual([meta.read_capacity_units for meta in metas], [5, 5])
+        finally:
+            for meta in metas:
+                meta.read_capacity_units = 1
+
+    def test_keep_alive_socket_option(self):
+        adapter = KeepAliveAdapter(keepalive_idle=30)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), adapter.socket_options)
+
+
+FakeUser = namedtuple('FakeUser', ['email', 'given_name', 'family_name', 'group'])
+
+
+class FakeIndex(object):
+    """Answers UserDirectoryEntry.page queries from a list, as DynamoDB would."""
+
+    def __init__(self, hash_attribute, entries):
+        self.hash_attribute = hash_attribute
+        self.entries = entries
+        self.queried = []
+
+    def query(self, hash_key, limit=None, sort_name__between=None, sort_name__gt=None):
+        self.queried.append(hash_key)
+        matches = sorted((entry for entry in self.entries
+                          if getattr(entry, self.hash_attribute) == hash_key),
+                         key=lambda entry: entry.sort_name)
+        if sort_name__between:
+            low, high = sort_name__between
+            matches = [entry for entry in matches if low <= entry.sort_name <= high]
+        if sort_name__gt:
+            matches = [entry for entry in matches if entry.sort_name > sort_name__gt]
+        return iter(matches[:limit])
+
+
+class UserDirectoryPageTestCase(unittest.TestCase):
+    indexes = {'all_users_index': 'directory', 'group_index': 'group',
+               'name_prefix_index': 'name_prefix'}
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.originals = dict((name, getattr(UserDirectoryEntry, name)) for name in self.indexes)
+
+    def tearDown(self):
+        for name, index in self.originals.items():
+            setattr(UserDirectoryEntry, name, index)
+        self.app_context.pop()
+
+    def fill(self, names, group='general'):
+        entries = [UserDirectoryEntry.from_user(FakeUser(
+            email=u'{0}@example.com'.format(name.lower()), given_name=u'A',
+            family_name=name, group={'GroupName': group})) for name in names]
+        for name, attribute in self.indexes.items():
+            setattr(UserDirectoryEntry, name, FakeIndex(attribute, entries))
+
+    def all_pages(self, **kwargs):
+        names, after = [], None
+        while True:
+            entries, after = UserDirectoryEntry.page(after=after, limit=2, **kwargs)
+            names.append([entry.family_name for entry in entries])
+            if after is None:
+                return names
+
+    def test_cursor_walks_every_entry_once(self):
+        self.fill([u'Evans', u'Adams', u'Clark', u'Baker', u'Davis'])
+        self.assertEqual(self.all_pages(), [[u'Adams', u'Baker'], [u'Clark', u'Davis'],
+                                            [u'Evans']])
+
+    def test_name_prefix_pages_stay_in_range(self):
+        self.fill([u'Bell', u'Baker', u'Brown', u'Burns', u'Adams', u'Carr'])
+        self.assertEqual(self.all_pages(name_prefix=u'B'),
+                         [[u'Baker', u'Bell'], [u'Brown', u'Burns']])
+        self.assertEqual(self.all_pages(name_prefix=u'br'), [[u'Brown']])
+        self.assertEqual(UserDirectoryEntry.name_prefix_index.queried, ['b'] * 3)
+
+    def test_group_pages_use_the_group_index(self):
+        self.fill([u'Adams', u'Baker'], group='administrator')
+        self.assertEqual(self.all_pages(group='administrator'), [[u'Adams', u'Baker']])
+        self.assertEqual(self.all_pages(group='general'), [[]])
+
+    def test_sharded_directory_pages_are_merged(self):
+        self.app.config['USER_DIRECTORY_SHARDS'] = 3
+        self.fill([u'Evans', u'Adams', u'Clark', u'Baker', u'Davis'])
+        entries = UserDirectoryEntry.all_users_index.entries
+        self.assertGreater(len(set(entry.directory for entry in entries)), 1)
+        self.assertEqual(self.all_pages(), [[u'Adams', u'Baker'], [u'Clark', u'Davis'],
+                                            [u'Evans']])
@@ -0,0 +1,119 @@
+import unittest
+
+from flask import render_template_string
+
+from app import create_app
+from app.models import EditableHTML
+
+
+class FakeBatchWrite(object):
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def save(self, item):
+        self.table[item.editor_name] = item
+
+
+class EditableHTMLBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.table = {'about': EditableHTML(editor_name='about', value='About us', version=2)}
+        self.batch_gets = []
+
+        def batch_get(cls, names):
+            names = list(names)
+            self.batch_gets.append(names)
+            return [self.table[name] for name in names if name in self.table]
+
+        EditableHTML.batch_get = classmethod(batch_get)
+        EditableHTML.batch_write = classmethod(lambda cls: FakeBatchWrite(self.table))
+
+    def tearDown(self):
+        # Fall back to the inherited Model methods
+        del EditableHTML.batch_get
+        del EditableHTML.batch_write
+        self.app_context.pop()
+
+    def test_get_many_reads_misses_in_one_batch(self):
+        editors = EditableHTML.get_many(['about', 'contact'])
+        self.assertEqual(editors['about'].value, 'About us')
+        self.assertEqual(editors['contact'].value, ' ')
+        self.assertEqual(len(self.batch_gets), 1)
+
+        EditableHTML.get_many(['about', 'contact'])
+        self.assertEqual(len(self.batch_gets), 1)
+
+    def test_save_many_bumps_versions_and_refreshes_the_cache(self):
+        EditableHTML.get_many(['about'])
+        EditableHTML.save_many({'about': 'New', 'contact': 'Mail us'})
+        self.assertEqual(self.table['about'].version, 3)
+        self.assertEqual(self.table['contact'].version, 1)
+        self.assertEqual(EditableHTML.get_many(['about'])['about'].value, 'New')
+
+    def test_editable_regions_template_global(self):
+        page = render_template_string(
+            "{% set editors = editable_regions('about', 'contact') %}"
+            "{{ editors['about'].value }}|{{ editors['contact'].value }}")
+        self.assertEqual(page, 'About us| ')
+        self.assertEqual(len(self.batch_gets), 1)
+
+
+class EditableHTMLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FRAGMENT_CACHE_ENABLED'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.table = {'about': EditableHTML(editor_name='about', value='About us', version=2)}
+        self.gets = []
+
+        def get(cls, editor_name):
+            self.gets.append(editor_name)
+            if editor_name not in self.table:
+                raise cls.DoesNotExist()
+            return self.table[editor_name]
+
+        def save(editable_html_obj):
+            self.table[editable_html_obj.editor_name] = editable_html_obj
+
+        EditableHTML.get = classmethod(get)
+        EditableHTML.save = save
+
+    def tearDown(self):
+        # Fall back to the inherited Model methods
+        del EditableHTML.get
+        del EditableHTML.save
+        self.app_context.pop()
+
+    def test_cached_read_skips_dynamodb(self):
+        self.assertEqual(EditableHTML.get_editable_html('about').value, 'About us')
+        self.assertEqual(EditableHTML.get_editable_html('about').value, 'About us')
+        self.assertEqual(self.gets, ['about'])
+
+    def test_update_bumps_version_and_replaces_cached_copy(self):
+        EditableHTML.get_editable_html('about')
+        EditableHTML.update_contents('about', 'New')
+        self.assertEqual(self.table['about'].version, 3)
+        cached = EditableHTML.get_editable_html('about')
+        self.assertEqual((cached.value, cached.version), ('New', 3))
+        # One read to load the stored copy for the update, none afterwards
+        self.assertEqual(self.gets, ['about', 'about'])
+
+    def test_fragment_is_rerendered_when_the_version_changes(self):
+        template = ("{% cache 'editor', editor.editor_name, editor.version %}"
+                    "{{ editor.value }}{% endcache %}")
+        editor = EditableHTML(editor_name='about', value='First', version=1)
+        self.assertEqual(render_template_string(template, editor=editor), 'First')
+        # Same version: the cached fragment is served
+        editor.value = 'Changed'
+        self.assertEqual(render_template_string(template, editor=editor), 'First')
+        editor.version = 2
+        self.assertEqual(render_template_string(template, editor=editor), 'Changed')
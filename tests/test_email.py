@@ -0,0 +1,263 @@
+import json
+import os
+import smtplib
+import threading
+import unittest
+
+from flask_mail import Message
+
+from app import create_app, email, mail
+from app.email import EmailDispatcher, email_batcher, send_email
+
+
+class EmailBatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['EMAIL_QUEUE'] = 'local'
+        self.app.config['EMAIL_BATCH_SIZE'] = 2
+        self.app.config['EMAIL_FLUSH_INTERVAL'] = 60
+        email._worker_app = self.app
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        email_batcher.flush()
+        self.app_context.pop()
+        email._worker_app = None
+        email.close_mail_connection()
+
+    def queue(self, count):
+        for i in range(count):
+            send_email(recipient='user{0}@example.com'.format(i),
+                       subject='Reset Your Password',
+                       template='account/email/reset_password',
+                       user={'full_name': 'A User', 'email': 'user{0}@example.com'.format(i)},
+                       reset_link='http://localhost/reset')
+
+    def test_messages_wait_for_a_full_batch(self):
+        with mail.record_messages() as outbox:
+            self.queue(1)
+            self.assertEqual(len(outbox), 0)
+            self.queue(1)
+            self.assertEqual(len(outbox), 2)
+
+    def test_flush_sends_partial_batch(self):
+        with mail.record_messages() as outbox:
+            self.queue(1)
+            email_batcher.flush()
+            self.assertEqual(len(outbox), 1)
+            self.assertEqual(outbox[0].recipients, ['user0@example.com'])
+
+    def test_batches_share_one_connection(self):
+        self.queue(2)
+        connection = email.get_mail_connection()
+        self.queue(2)
+        self.assertIs(email.get_mail_connection(), connection)
+
+    def test_context_must_be_plain(self):
+        with self.assertRaises(TypeError):
+            send_email(recipient='a@example.com', subject='Hi',
+                       template='account/email/confirm', user=object())
+
+    def test_lambda_batches_are_json(self):
+        self.app.config['EMAIL_QUEUE'] = 'lambda'
+        fake = FakeLambdaClient()
+        self.app.extensions['client_pool']['lambda'] = fake
+        self.queue(2)
+        payload = json.loads(fake.invocations[0]['Payload'])
+        self.assertEqual([m['context']['user']['full_name'] for m in payload['messages']],
+                         ['A User', 'A User'])
+        with mail.record_messages() as outbox:
+            email.send_email_func(payload)
+            self.assertEqual(outbox[0].body.splitlines()[0], 'Dear A User,')
+
+    def test_failed_batch_is_retried(self):
+        self.app.config['EMAIL_QUEUE'] = 'lambda'
+        fake = FakeLambdaClient(failures=1)
+        self.app.extensions['client_pool']['lambda'] = fake
+        with self.assertRaises(IOError):
+            self.queue(2)
+        self.assertEqual(email_batcher.pending, 2)
+        email_batcher.flush()
+        self.assertEqual(email_batcher.pending, 0)
+        self.assertEqual(len(fake.invocations), 1)
+
+    def test_undeliverable_batch_is_dropped_eventually(self):
+        self.app.config['EMAIL_QUEUE'] = 'lambda'
+        self.app.config['EMAIL_DELIVERY_ATTEMPTS'] = 2
+        self.app.extensions['client_pool']['lambda'] = FakeLambdaClient(failures=2)
+        self.queue(1)
+        for _ in range(2):
+            with self.assertRaises(IOError):
+                email_batcher.flush()
+        self.assertEqual(email_batcher.pending, 0)
+
+
+class EmailTemplatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def context(self, name):
+        return {'user': {'full_name': name, 'email': 'a@example.com'},
+                'confirm_link': 'http://localhost/confirm/' + name}
+
+    def test_pair_is_looked_up_once(self):
+        templates = email.email_templates(self.app)
+        self.assertIs(templates.pair('account/email/confirm'),
+                      templates.pair('account/email/confirm'))
+
+    def test_render_many_matches_render_template(self):
+        from flask import render_template
+        bodies = email.email_templates(self.app).render_many(
+            'account/email/confirm', [self.context('Ada'), self.context('Bob')])
+        self.assertEqual(bodies[1][0], render_template('account/email/confirm.txt',
+                                                       **self.context('Bob')))
+        self.assertIn('Dear Ada,', bodies[0][1])
+
+    def test_messages_keep_event_order(self):
+        events = [{'recipient': 'a@example.com', 'subject': 'Hi',
+                   'template': 'account/email/confirm', 'context': self.context('Ada')},
+                  {'recipient': 'b@example.com', 'subject': 'Hi',
+                   'template': 'account/email/reset_password',
+                   'context': {'user': {'full_name': 'Bob'}, 'reset_link': 'x'}},
+                  {'recipient': 'c@example.com', 'subject': 'Hi',
+                   'template': 'account/email/confirm', 'context': self.context('Cy')}]
+        messages = email.build_messages(self.app, events)
+        self.assertEqual([m.recipients[0][0] for m in messages], ['a', 'b', 'c'])
+        self.assertTrue(messages[2].body.startswith('Dear Cy,'))
+
+    def test_flat_events_still_render(self):
+        event = dict(self.context('Ada'), recipient='a@example.com', subject='Hi',
+                     template='account/email/confirm')
+        self.assertTrue(email.build_message(self.app, event).body.startswith('Dear Ada,'))
+
+
+class EmailDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['EMAIL_QUEUE'] = 'lambda'
+        self.app.config['EMAIL_DISPATCH'] = 'thread'
+        self.app.config['EMAIL_BATCH_SIZE'] = 2
+        self.app.config['EMAIL_FLUSH_INTERVAL'] = 60
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        dispatcher = self.app.extensions.get('email_dispatcher')
+        if dispatcher is not None:
+            dispatcher.close()
+        self.app_context.pop()
+
+    def queue(self, count):
+        for i in range(count):
+            send_email(recipient='user{0}@example.com'.format(i), subject='Hi',
+                       template='account/email/confirm',
+                       user={'full_name': 'A User', 'email': 'user@example.com'},
+                       confirm_link='http://localhost/confirm')
+
+    def test_full_batch_is_delivered_in_the_background(self):
+        fake = FakeLambdaClient()
+        self.app.extensions['client_pool']['lambda'] = fake
+        self.queue(2)
+        dispatcher = email_batcher.dispatcher()
+        dispatcher.join()
+        self.assertEqual(len(fake.invocations), 1)
+        stats = email_batcher.stats()['dispatch']
+        self.assertEqual((stats['submitted'], stats['delivered']), (1, 1))
+
+    def test_background_failure_is_requeued(self):
+        self.app.extensions['client_pool']['lambda'] = FakeLambdaClient(failures=1)
+        self.queue(2)
+        email_batcher.dispatcher().join()
+        self.assertEqual(email_batcher.stats()['dispatch']['failed'], 1)
+        self.assertEqual(email_batcher.pending, 2)
+        email_batcher.flush()
+        email_batcher.dispatcher().join()
+        self.assertEqual(email_batcher.pending, 0)
+
+    def test_full_queue_pushes_back_on_the_caller(self):
+        started, release = threading.Event(), threading.Event()
+
+        def hold(batch):
+            started.set()
+            release.wait(5)
+
+        dispatcher = EmailDispatcher(self.app, hold, workers=1, max_queue=1, timeout=0.01)
+        try:
+            self.assertTrue(dispatcher.submit(['first']))
+            started.wait(5)
+            # The worker is busy and the queue holds one more
+            self.assertTrue(dispatcher.submit(['second']))
+            self.assertFalse(dispatcher.submit(['third']))
+            self.assertEqual(dispatcher.stats()['delivered_by_caller'], 1)
+        finally:
+            release.set()
+            dispatcher.close()
+
+
+class DroppedConnection(object):
+    """An SMTP connection the server has since closed."""
+
+    closed = False
+
+    def send(self, msg):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+class EmailWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.flask_config = os.environ.get('FLASK_CONFIG')
+        os.environ['FLASK_CONFIG'] = 'testing'
+        email._worker_app = None
+
+    def tearDown(self):
+        if self.flask_config is None:
+            os.environ.pop('FLASK_CONFIG')
+        else:
+            os.environ['FLASK_CONFIG'] = self.flask_config
+        email._worker_app = None
+        email.close_mail_connection()
+
+    def test_worker_app_is_built_once(self):
+        app = email.get_worker_app()
+        self.assertIs(email.get_worker_app(), app)
+        event = {'recipient': 'a@example.com', 'subject': 'Hi',
+                 'template': 'account/email/confirm',
+                 'context': {'user': {'full_name': 'A User', 'email': 'a@example.com'},
+                             'confirm_link': 'http://localhost/confirm'}}
+        with app.app_context(), mail.record_messages() as outbox:
+            email.send_email_func(event=dict(event))
+            email.send_email_func(event=dict(event))
+            self.assertEqual(len(outbox), 2)
+        self.assertIs(email._worker_app, app)
+
+    def test_dropped_connection_is_reopened(self):
+        app = email.get_worker_app()
+        dropped = DroppedConnection()
+        email._mail_connection = dropped
+        with app.app_context(), mail.record_messages() as outbox:
+            email.send_message(Message('Hi', recipients=['a@example.com'], body='Hi',
+                                       sender='admin@example.com'))
+            self.assertEqual(len(outbox), 1)
+        self.assertTrue(dropped.closed)
+        self.assertIsNot(email._mail_connection, dropped)
+
+
+class FakeLambdaClient(object):
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.invocations = []
+
+    def invoke(self, **params):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Lambda unavailable')
+        self.invocations.append(params)
@@ -0,0 +1,99 @@
+import unittest
+
+from flask.ext.login import login_user
+
+from app import caches, clients, create_app
+from app.cognito_handler import create_user, get_user, set_permanent_password
+from app.decorators import group_required
+from app.models.user import DEFAULT_GROUP
+
+
+class UserGroupsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.cognito = clients.get('cognito-idp')
+        for name, precedence in (('administrator', 1), ('general', 2), ('beta', 3)):
+            self.cognito.create_group(GroupName=name, Precedence=precedence, UserPoolId='pool')
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def count_group_lookups(self):
+        """Counts admin_list_groups_for_user calls from here on."""
+        cognito = self.cognito.wrapped
+        list_groups_for_user = cognito.admin_list_groups_for_user
+        calls = []
+
+        def counting(**kwargs):
+            calls.append(kwargs['Username'])
+            return list_groups_for_user(**kwargs)
+        cognito.admin_list_groups_for_user = counting
+        self.addCleanup(delattr, cognito, 'admin_list_groups_for_user')
+        return calls
+
+    def test_groups_are_looked_up_once_per_user(self):
+        create_user('ada@example.com', 'Ada', 'Lovelace', group='administrator')
+        user = get_user('ada@example.com')
+        calls = self.count_group_lookups()
+
+        @group_required('administrator')
+        def admin_only():
+            return 'OK'
+
+        with self.app.test_request_context():
+            login_user(user)
+            self.assertEqual(admin_only(), 'OK')
+        self.assertTrue(user.is_admin())
+        self.assertTrue(user.member_of_group('administrator'))
+        self.assertEqual(user.group['GroupName'], 'administrator')
+        self.assertEqual(calls, ['ada@example.com'])
+
+    def test_user_in_several_groups_is_a_member_of_each(self):
+        create_user('ada@example.com', 'Ada', 'Lovelace', group='beta')
+        user = get_user('ada@example.com')
+        user.add_to_group('administrator')
+        user = get_user('ada@example.com')
+        self.assertEqual(user.groups, frozenset(['administrator', 'beta']))
+        self.assertTrue(user.member_of_group('beta'))
+        # The group with the lowest Precedence labels the account
+        self.assertEqual(user.group['GroupName'], 'administrator')
+
+    def test_user_without_groups_falls_back_to_the_default(self):
+        create_user('ada@example.com', 'Ada', 'Lovelace')
+        user = get_user('ada@example.com')
+        self.assertEqual(user.group, DEFAULT_GROUP)
+        self.assertTrue(user.member_of_group(DEFAULT_GROUP['GroupName']))
+        self.assertFalse(user.is_admin())
+
+    def test_add_to_group_updates_loaded_groups(self):
+        create_user('ada@example.com', 'Ada', 'Lovelace', group='general')
+        user = get_user('ada@example.com')
+        self.assertFalse(user.is_admin())
+        calls = self.count_group_lookups()
+        user.add_to_group('administrator')
+        self.assertTrue(user.is_admin())
+        self.assertEqual(user.groups, frozenset(['administrator', 'general']))
+        self.assertEqual(calls, [])
+
+    def test_change_group_leaves_every_other_group(self):
+        user = create_user('ada@example.com', 'Ada', 'Lovelace', group='administrator')
+        user.add_to_group('beta')
+        caches.get('user').set('ada@example.com', user)
+        user = get_user('ada@example.com')
+        user.change_group('general')
+        self.assertEqual(user.groups, frozenset(['general']))
+        self.assertEqual(get_user('ada@example.com').groups, frozenset(['general']))
+        self.assertIsNone(caches.get('user').get('ada@example.com'))
+
+    def test_account_types_can_be_reloaded_without_the_directory(self):
+        self.app.config['USER_DIRECTORY_ENABLED'] = False
+        create_user('admin@example.com', 'Ad', 'Min', group='administrator', password='Secret1!')
+        set_permanent_password('admin@example.com', 'Secret1!')
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'admin@example.com', 'password': 'Secret1!'})
+        response = client.get('/administrator/users')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Reload account types', response.data)
@@ -0,0 +1,90 @@
+import unittest
+
+from botocore.exceptions import ClientError
+from flask import session
+
+from app import clients, create_app
+from app.cognito_handler import (authenticate_user, create_user, get_user,
+                                 iter_users, list_users_page, load_group_catalogue,
+                                 refresh_session_tokens, set_permanent_password,
+                                 user_from_session_tokens, users_filter)
+
+
+class InMemoryCognitoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.cognito = clients.get('cognito-idp')
+        pool_id = self.app.config['COGNITO_POOL_ID']
+        self.cognito.create_group(GroupName='admin', UserPoolId=pool_id, Precedence=1)
+        self.cognito.create_group(GroupName='general', UserPoolId=pool_id, Precedence=255)
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def create(self, email, group='general', password='Secret1!'):
+        user = create_user(email, 'Ada', 'Lovelace', group=group, password=password)
+        set_permanent_password(email, password)
+        return user
+
+    def test_create_and_get_user(self):
+        self.create('ada@example.com')
+        user = get_user('ada@example.com')
+        self.assertEqual(user.given_name, 'Ada')
+        self.assertEqual(user.status, 'CONFIRMED')
+        self.assertEqual(user.groups, frozenset(['general']))
+
+    def test_duplicate_user_is_rejected(self):
+        self.create('ada@example.com')
+        with self.assertRaises(ClientError) as raised:
+            self.create('ada@example.com')
+        self.assertEqual(raised.exception.response['Error']['Code'], 'UsernameExistsException')
+
+    def test_pages_follow_pagination_tokens(self):
+        emails = ['user{0:02d}@example.com'.format(i) for i in range(7)]
+        for email in reversed(emails):
+            self.create(email)
+        users, token = list_users_page(limit=3)
+        self.assertEqual(len(users), 3)
+        self.assertIsNotNone(token)
+        self.assertEqual([u.email for u in iter_users(page_size=3)], emails)
+
+    def test_filter_and_projection(self):
+        self.create('ada@example.com')
+        self.create('bob@example.com')
+        users, _ = list_users_page(filter_expression=users_filter(email_prefix='bo'),
+                                   attributes=['email'])
+        self.assertEqual([u.email for u in users], ['bob@example.com'])
+        self.assertNotEqual(users[0].given_name, 'Ada')
+
+    def test_group_catalogue(self):
+        self.assertEqual([g.name for g in load_group_catalogue()], ['admin', 'general'])
+
+    def test_login_issues_verifiable_tokens(self):
+        self.create('ada@example.com', group='admin')
+        with self.app.test_request_context():
+            self.assertIsNotNone(authenticate_user('ada@example.com', 'Secret1!'))
+            user = user_from_session_tokens('ada@example.com')
+            self.assertEqual(user.family_name, 'Lovelace')
+            self.assertTrue(user.member_of_group('admin'))
+
+            access_token = session['access_token']
+            self.assertTrue(refresh_session_tokens())
+            self.assertNotEqual(session['access_token'], access_token)
+            self.assertIsNotNone(user_from_session_tokens('ada@example.com'))
+
+    def test_wrong_password_does_not_log_in(self):
+        self.create('ada@example.com')
+        with self.app.test_request_context():
+            self.assertIsNone(authenticate_user('ada@example.com', 'wrong'))
+            self.assertNotIn('id_token', session)
+
+    def test_change_password(self):
+        self.create('ada@example.com')
+        with self.app.test_request_context():
+            user = authenticate_user('ada@example.com', 'Secret1!')
+            user.change_password('Secret1!', 'Changed2@', session['access_token'])
+            self.assertIsNone(authenticate_user('ada@example.com', 'Secret1!'))
+            self.assertIsNotNone(authenticate_user('ada@example.com', 'Changed2@'))
@@ -0,0 +1,35 @@
+import unittest
+
+from flask import Flask, render_template_string
+
+from app.lazy import LazyExtension, static_url_for
+
+
+class LazyExtensionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['FLASKS3_BUCKET_NAME'] = 'bucket'
+
+    def test_import_is_deferred_until_first_use(self):
+        mail = LazyExtension('flask_mail:Mail')
+        mail.init_app(self.app)
+        self.assertFalse(mail.loaded)
+        with self.app.app_context():
+            with mail.record_messages() as outbox:
+                pass
+        self.assertTrue(mail.loaded)
+        self.assertIn('mail', self.app.extensions)
+        self.assertEqual(outbox, [])
+
+    def test_static_urls_go_through_flask_s3(self):
+        s3 = LazyExtension('flask_s3:FlaskS3')
+        s3.init_app(self.app)
+        self.app.jinja_env.globals['url_for'] = static_url_for(s3)
+        self.app.add_url_rule('/page', 'page', lambda: '')
+        with self.app.test_request_context():
+            page = render_template_string("{{ url_for('page') }}")
+            self.assertEqual(page, '/page')
+            self.assertFalse(s3.loaded)
+            static = render_template_string("{{ url_for('static', filename='a.css') }}")
+        self.assertTrue(s3.loaded)
+        self.assertIn('bucket', static)
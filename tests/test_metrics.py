@@ -0,0 +1,82 @@
+import unittest
+
+from app import call_metrics, clients, create_app
+from app.cognito_handler import get_user
+from app.metrics import Histogram, instrument_connection, server_timing
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.dispatched = []
+
+    def dispatch(self, operation_name, operation_kwargs):
+        self.dispatched.append(operation_name)
+        if operation_name == 'PutItem':
+            raise ValueError('throttled')
+        return {}
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentiles_use_bucket_bounds(self):
+        histogram = Histogram()
+        for ms in [0.5] * 90 + [30] * 9 + [700]:
+            histogram.observe(ms)
+        stats = histogram.stats()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50_ms'], 1)
+        self.assertEqual(stats['p99_ms'], 50)
+        self.assertEqual(stats['max_ms'], 700)
+
+    def test_server_timing_sums_each_operation(self):
+        header = server_timing([('dynamodb.GetItem', 2.0), ('dynamodb.GetItem', 3.0),
+                                ('cognito-idp.admin_get_user', 10.0)])
+        self.assertEqual(header, 'cognito-idp.admin_get_user;dur=10.0;desc="1 call", '
+                                 'dynamodb.GetItem;dur=5.0;desc="2 calls"')
+
+
+class CallMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+
+        @self.app.route('/whoami')
+        def whoami():
+            user = get_user('ada@example.com')
+            return user.email if user else 'nobody'
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_client_calls_are_timed(self):
+        clients.get('cognito-idp').admin_create_user(
+            UserPoolId='pool', Username='ada@example.com',
+            UserAttributes=[{'Name': 'email', 'Value': 'ada@example.com'}])
+        get_user('nobody@example.com')
+        stats = call_metrics.stats()
+        self.assertEqual(stats['cognito-idp.admin_create_user']['count'], 1)
+        self.assertEqual(stats['cognito-idp.admin_get_user']['errors'], 1)
+
+    def test_responses_carry_server_timing(self):
+        response = self.app.test_client().get('/whoami')
+        self.assertEqual(response.data, 'nobody')
+        self.assertIn('cognito-idp.admin_get_user;dur=', response.headers['Server-Timing'])
+
+    def test_requests_without_calls_have_no_header(self):
+        @self.app.route('/plain')
+        def plain():
+            return 'plain'
+        response = self.app.test_client().get('/plain')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_dynamodb_dispatch_is_timed(self):
+        connection = instrument_connection(FakeConnection())
+        connection.dispatch('GetItem', {})
+        with self.assertRaises(ValueError):
+            connection.dispatch('PutItem', {})
+        stats = call_metrics.stats()
+        self.assertEqual(stats['dynamodb.GetItem']['count'], 1)
+        self.assertEqual(stats['dynamodb.PutItem']['errors'], 1)
+        self.assertEqual(connection.dispatched, ['GetItem', 'PutItem'])
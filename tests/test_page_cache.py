@@ -0,0 +1,51 @@
+import re
+import unittest
+
+from app import caches, create_app
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_anonymous_page_is_cached_with_etag(self):
+        first = self.client.get('/')
+        second = self.client.get('/')
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.headers.get('ETag'))
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(caches.get('page').stats()['hits'], 1)
+
+    def test_cached_pages_carry_each_visitors_csrf_token(self):
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        first = self.app.test_client().get('/').data
+        second = self.app.test_client().get('/').data
+        self.assertEqual(caches.get('page').stats()['hits'], 1)
+        self.assertNotIn(b'__page_cache_csrf_token__', first)
+        tokens = [re.search(b'name="csrf_token" value="([^"]+)"', body).group(1)
+                  for body in (first, second)]
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.client.get('/').headers['ETag']
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_error_page_is_cached(self):
+        self.client.get('/no-such-page')
+        response = self.client.get('/another-missing-page')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(caches.get('page').stats()['hits'], 1)
+
+    def test_cache_can_be_disabled(self):
+        self.app.config['PAGE_CACHE_ENABLED'] = False
+        response = self.client.get('/')
+        self.assertIsNone(response.headers.get('ETag'))
@@ -0,0 +1,51 @@
+import unittest
+
+from flask import session
+
+from app import clients, create_app
+from app.cognito_handler import create_user
+
+
+class RegisteredUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config.update(IDENTITY_BACKEND='memory', USER_DIRECTORY_ENABLED=False,
+                               ADMIN_USERS_PAGE_SIZE=2, ADMIN_USERS_CURSOR_HISTORY=3)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        clients.get('cognito-idp').create_group(GroupName='administrator', UserPoolId='pool')
+        create_user('admin@example.com', 'Ad', 'Min', group='administrator',
+                    password='Secret1!', permanent=True)
+        for i in range(9):
+            create_user('user{0}@example.com'.format(i), 'User', str(i))
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={'email': 'admin@example.com',
+                                                  'password': 'Secret1!'})
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def visit(self, page):
+        with self.client as client:
+            response = client.get('/administrator/users?page={0}'.format(page))
+            self.assertEqual(response.status_code, 200)
+            return response.data, session['registered_users_cursors']
+
+    def test_cursor_history_is_capped(self):
+        data, _ = self.visit(0)
+        self.assertIn(b'user0@example.com', data)
+        for page in range(1, 5):
+            data, cursors = self.visit(page)
+            self.assertLessEqual(len(cursors['tokens']), 3)
+        # Five pages of two users; the cursors of pages 2 to 4 are kept
+        self.assertEqual(cursors['first'], 2)
+        self.assertIn(b'user8@example.com', data)
+
+        data, cursors = self.visit(3)
+        self.assertIn(b'user6@example.com', data)
+        self.assertEqual(cursors['first'], 2)
+        # Before the kept cursors: back to the first page
+        data, cursors = self.visit(1)
+        self.assertIn(b'user0@example.com', data)
+        self.assertEqual(cursors, {'filter': cursors['filter'], 'first': 0,
+                                   'tokens': [None, cursors['tokens'][1]]})
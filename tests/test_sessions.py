@@ -0,0 +1,255 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from flask import session
+
+from app import create_app
+from app.sessions import (DynamoDBSessionStore, MemorySessionStore,
+                          ServerSessionInterface, SQLiteSessionStore,
+                          regenerate_session)
+
+
+class FakeSessionModel(object):
+    """Stands in for the Session table, counting reads and writes."""
+
+    items = {}
+    reads = 0
+    writes = 0
+
+    class DoesNotExist(Exception):
+        pass
+
+    def __init__(self, session_id, value=None, expires=None):
+        self.session_id = session_id
+        self.value = value
+        self.expires = expires
+
+    @classmethod
+    def get(cls, session_id):
+        cls.reads += 1
+        if session_id not in cls.items:
+            raise cls.DoesNotExist()
+        return cls.items[session_id]
+
+    def save(self):
+        FakeSessionModel.writes += 1
+        FakeSessionModel.items[self.session_id] = self
+
+    def delete(self):
+        FakeSessionModel.items.pop(self.session_id, None)
+
+
+class CountingStore(object):
+    """Wraps a session store, counting loads and saves."""
+
+    def __init__(self, store):
+        self.store = store
+        self.loads = 0
+        self.saves = 0
+
+    def load(self, sid):
+        self.loads += 1
+        return self.store.load(sid)
+
+    def save(self, sid, value, expires):
+        self.saves += 1
+        self.store.save(sid, value, expires)
+
+    def delete(self, sid):
+        self.store.delete(sid)
+
+
+class DynamoDBSessionTestCase(unittest.TestCase):
+    def make_store(self):
+        return DynamoDBSessionStore(model=FakeSessionModel)
+
+    def setUp(self):
+        FakeSessionModel.items = {}
+        FakeSessionModel.reads = FakeSessionModel.writes = 0
+        self.app = create_app('testing')
+        self.store = self.make_store()
+        self.counter = CountingStore(self.store)
+        self.app.session_interface = ServerSessionInterface(self.counter)
+
+        @self.app.route('/set/<value>')
+        def set_value(value):
+            session['value'] = value
+            return 'OK'
+
+        @self.app.route('/get')
+        def get_value():
+            return session.get('value', '')
+
+        @self.app.route('/append/<value>')
+        def append_value(value):
+            values = session.get('values', [])
+            values.append(value)
+            session['values'] = values
+            return ','.join(values)
+
+        @self.app.route('/regenerate')
+        def regenerate():
+            regenerate_session()
+            return 'OK'
+
+        @self.app.route('/clear')
+        def clear():
+            session.clear()
+            return 'OK'
+
+        @self.app.route('/untouched')
+        def untouched():
+            return 'OK'
+
+        self.client = self.app.test_client()
+
+    def test_cookie_holds_only_the_session_id(self):
+        response = self.client.get('/set/' + 'x' * 500)
+        cookie = response.headers['Set-Cookie']
+        self.assertLess(len(cookie), 200)
+        self.assertEqual(self.client.get('/get').data, b'x' * 500)
+
+    def test_unmodified_session_is_not_written(self):
+        self.client.get('/set/a')
+        self.client.get('/get')
+        self.client.get('/get')
+        self.assertEqual(self.counter.saves, 1)
+
+    def test_reassigned_nested_values_are_written(self):
+        self.client.get('/append/a')
+        self.client.get('/append/b')
+        self.assertEqual(self.client.get('/append/c').data, b'a,b,c')
+        self.assertEqual(self.counter.saves, 3)
+
+    def test_regenerating_moves_the_session_to_a_new_id(self):
+        first = self.client.get('/set/a').headers['Set-Cookie']
+        second = self.client.get('/regenerate').headers['Set-Cookie']
+        self.assertNotEqual(first.split(';')[0], second.split(';')[0])
+        self.assertEqual(self.client.get('/get').data, b'a')
+        self.assertEqual(len(self.stored_sids()), 1)
+
+    def stored_sids(self):
+        return list(FakeSessionModel.items)
+
+    def test_visitors_without_a_session_cost_nothing(self):
+        response = self.client.get('/untouched')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.counter.loads, 0)
+        self.assertEqual(self.counter.saves, 0)
+
+    def test_reads_are_cached(self):
+        self.client.get('/set/a')
+        self.client.get('/get')
+        self.client.get('/get')
+        self.assertEqual(FakeSessionModel.reads, 0)
+
+    def test_expired_sessions_are_ignored(self):
+        self.client.get('/set/a')
+        item = list(FakeSessionModel.items.values())[0]
+        item.expires = time.time() - 1
+        self.app.config['SESSION_CACHE_TTL'] = 0
+        self.app.extensions['caches'] = {}
+        self.assertEqual(self.client.get('/get').data, b'')
+
+    def test_clearing_deletes_the_item(self):
+        self.client.get('/set/a')
+        self.client.get('/clear')
+        self.assertEqual(FakeSessionModel.items, {})
+
+
+class MemorySessionTestCase(DynamoDBSessionTestCase):
+    test_reads_are_cached = None
+
+    def make_store(self):
+        return MemorySessionStore()
+
+    def stored_sids(self):
+        return [sid for sid in self.store.sessions._entries]
+
+    def test_expired_sessions_are_ignored(self):
+        self.client.get('/set/a')
+        sid = self.stored_sids()[0]
+        self.store.save(sid, self.store.load(sid)[0], time.time() - 1)
+        self.assertEqual(self.client.get('/get').data, b'')
+
+    def test_clearing_deletes_the_item(self):
+        self.client.get('/set/a')
+        self.client.get('/clear')
+        self.assertEqual(self.stored_sids(), [])
+
+
+class SQLiteSessionTestCase(DynamoDBSessionTestCase):
+    test_reads_are_cached = None
+
+    def make_store(self):
+        self.directory = tempfile.mkdtemp()
+        return SQLiteSessionStore(os.path.join(self.directory, 'sessions.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_session_survives_a_new_store(self):
+        self.client.get('/set/a')
+        self.app.session_interface = ServerSessionInterface(
+            SQLiteSessionStore(self.store.path))
+        self.assertEqual(self.client.get('/get').data, b'a')
+
+    def test_expired_sessions_are_ignored(self):
+        self.client.get('/set/a')
+        self.store.connection.execute('UPDATE session SET expires = 0')
+        self.store.connection.commit()
+        self.assertEqual(self.client.get('/get').data, b'')
+
+    def test_clearing_deletes_the_item(self):
+        self.client.get('/set/a')
+        self.client.get('/clear')
+        self.assertEqual(self.stored_sids(), [])
+
+    def stored_sids(self):
+        return [row[0] for row in self.store.connection.execute('SELECT session_id FROM session')]
+
+
+class LoginSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        from app.cognito_handler import create_user, set_permanent_password
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.store = MemorySessionStore()
+        self.app.session_interface = ServerSessionInterface(self.store)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        create_user('ada@example.com', 'Ada', 'Lovelace', password='Secret1!')
+        set_permanent_password('ada@example.com', 'Secret1!')
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def stored_sessions(self):
+        interface = self.app.session_interface
+        return dict((sid, interface.load(sid)[0]) for sid in self.store.sessions._entries)
+
+    def test_login_and_logout_issue_fresh_session_ids(self):
+        # A session id planted before login, as in a fixation attack
+        interface = self.app.session_interface
+        self.store.save('planted', interface.serializer.dumps({'next': '/'}), time.time() + 60)
+        self.client.set_cookie('localhost', self.app.session_cookie_name,
+                               interface.signer(self.app).sign(b'planted'))
+
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'Secret1!'})
+        sessions = self.stored_sessions()
+        self.assertNotIn('planted', sessions)
+        (sid, data), = sessions.items()
+        self.assertIn('id_token', data)
+        self.assertEqual(data['next'], '/')
+
+        self.client.get('/account/logout')
+        sessions = self.stored_sessions()
+        self.assertNotIn(sid, sessions)
+        for data in sessions.values():
+            self.assertNotIn('id_token', data)
+            self.assertNotIn('user_id', data)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import Environment, FileSystemLoader
+
+from app import create_app
+from app.utils import (ReadOnlyBytecodeCache, RelocatableBytecodeCache,
+                       compile_templates, configure_template_cache)
+
+
+class CountingEnvironment(Environment):
+    """Counts templates compiled from source."""
+
+    compiled = 0
+
+    def compile(self, *args, **kwargs):
+        CountingEnvironment.compiled += 1
+        return Environment.compile(self, *args, **kwargs)
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.directory = tempfile.mkdtemp()
+        self.app.config['JINJA_BYTECODE_CACHE_DIR'] = self.directory
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compile_templates_writes_bytecode(self):
+        names = compile_templates(self.app)
+        self.assertIn('main/index.html', names)
+        self.assertEqual(len(os.listdir(self.directory)), len(names))
+
+    def test_precompiled_templates_are_used(self):
+        compile_templates(self.app)
+        app = create_app('testing')
+        app.config['JINJA_BYTECODE_CACHE_DIR'] = self.directory
+        app.config['JINJA_PRECOMPILED_TEMPLATES'] = True
+        configure_template_cache(app)
+        self.assertIsInstance(app.jinja_env.bytecode_cache, ReadOnlyBytecodeCache)
+        self.assertFalse(app.jinja_env.auto_reload)
+        # Nothing is loaded until it is used or the app is warmed up
+        self.assertEqual(len(app.jinja_env.cache), 0)
+
+    def test_bytecode_survives_moving_the_templates(self):
+        source = os.path.join(self.directory, 'build', 'templates')
+        os.makedirs(source)
+        with open(os.path.join(source, 'page.html'), 'w') as f:
+            f.write('Hello {{ name }}')
+        cache_dir = os.path.join(self.directory, 'bytecode')
+        os.makedirs(cache_dir)
+        CountingEnvironment(loader=FileSystemLoader(source),
+                            bytecode_cache=RelocatableBytecodeCache(cache_dir)).get_template('page.html')
+
+        moved = os.path.join(self.directory, 'deployed', 'templates')
+        shutil.copytree(source, moved)
+        CountingEnvironment.compiled = 0
+        env = CountingEnvironment(loader=FileSystemLoader(moved),
+                                  bytecode_cache=ReadOnlyBytecodeCache(cache_dir))
+        self.assertEqual(env.get_template('page.html').render(name='Ada'), 'Hello Ada')
+        self.assertEqual(CountingEnvironment.compiled, 0)
+
+    def test_read_only_directory_is_tolerated(self):
+        app = create_app('testing')
+        app.config['JINJA_BYTECODE_CACHE_DIR'] = os.path.join(self.directory, 'missing')
+        app.config['JINJA_PRECOMPILED_TEMPLATES'] = True
+        configure_template_cache(app)
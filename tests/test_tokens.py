@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from flask import session
+
+from app import create_app
+from app.cognito_handler import create_user, user_loader
+from app.tokens import cognito_issuer, verify_id_token
+
+SIGNING_KEY = {'kty': 'oct', 'kid': 'test-key', 'alg': 'HS256',
+               'k': 'c2VjcmV0LXNpZ25pbmcta2V5LWZvci10ZXN0cw'}
+
+
+class IdTokenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        jwks_path = os.path.join(self.tmpdir, 'jwks.json')
+        with open(jwks_path, 'w') as jwks_file:
+            json.dump({'keys': [SIGNING_KEY]}, jwks_file)
+
+        self.app = create_app('testing')
+        self.app.config.update(
+            COGNITO_POOL_ID='us-east-1_test',
+            COGNITO_APP_CLIENT_ID='test-client',
+            COGNITO_JWKS_FILE=jwks_path,
+            COGNITO_TOKEN_ALGORITHMS=['HS256'])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def make_token(self, **overrides):
+        claims = {
+            'iss': cognito_issuer(),
+            'aud': 'test-client',
+            'token_use': 'id',
+            'exp': int(time.time()) + 60,
+            'email': 'user@example.com',
+            'given_name': 'Given',
+            'family_name': 'Family',
+            'cognito:groups': ['administrator'],
+        }
+        claims.update(overrides)
+        return jwt.encode(claims, SIGNING_KEY, algorithm='HS256',
+                          headers={'kid': 'test-key'})
+
+    def test_valid_token(self):
+        claims = verify_id_token(self.make_token())
+        self.assertEqual(claims['email'], 'user@example.com')
+        self.assertEqual(claims['cognito:groups'], ['administrator'])
+
+    def test_expired_token(self):
+        with self.assertRaises(ExpiredSignatureError):
+            verify_id_token(self.make_token(exp=int(time.time()) - 60))
+
+    def test_wrong_audience(self):
+        with self.assertRaises(JWTError):
+            verify_id_token(self.make_token(aud='other-client'))
+
+    def test_access_token_is_rejected(self):
+        with self.assertRaises(JWTError):
+            verify_id_token(self.make_token(token_use='access'))
+
+    def test_unknown_key(self):
+        token = jwt.encode({'email': 'user@example.com'}, 'other-secret',
+                           algorithm='HS256', headers={'kid': 'unknown'})
+        with self.assertRaises(JWTError):
+            verify_id_token(token)
+
+    def test_user_loader_logs_out_when_refresh_fails(self):
+        create_user('user@example.com', 'Given', 'Family')
+        self.app.config['COGNITO_TOKEN_LOADER'] = True
+        with self.app.test_request_context():
+            session['id_token'] = self.make_token(exp=int(time.time()) - 60)
+            session['refresh_token'] = 'revoked'
+            self.assertIsNone(user_loader('user@example.com'))
+            self.assertNotIn('id_token', session)
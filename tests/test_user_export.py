@@ -0,0 +1,84 @@
+import csv
+import json
+import unittest
+from io import BytesIO
+
+from app import clients, create_app
+from app.cognito_handler import create_user, set_permanent_password
+from app.user_export import csv_lines, export_columns, iter_export_rows, ndjson_lines
+
+
+class UserExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        cognito = clients.get('cognito-idp')
+        for name in ('administrator', 'general'):
+            cognito.create_group(GroupName=name, UserPoolId='pool')
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def create_users(self, count):
+        for i in range(count):
+            create_user('user{0:03d}@example.com'.format(i), 'First', 'Last{0:03d}'.format(i),
+                        group='general')
+
+    def test_every_page_is_exported(self):
+        # More than one list_users page
+        self.create_users(75)
+        list_users = clients.get('cognito-idp').wrapped.list_users
+        pages = []
+
+        def counting_list_users(**kwargs):
+            pages.append(kwargs)
+            return list_users(**kwargs)
+        clients.get('cognito-idp').wrapped.list_users = counting_list_users
+
+        rows = list(iter_export_rows(workers=4))
+        self.assertEqual(len(rows), 75)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(rows[0]['groups'], ['general'])
+        self.assertEqual(set(rows[0]), set(export_columns(
+            ['email', 'given_name', 'family_name'], True)))
+
+    def test_attributes_are_projected(self):
+        self.create_users(1)
+        rows = list(iter_export_rows(attributes=['family_name'], include_groups=False))
+        self.assertEqual(rows, [{'email': 'user000@example.com', 'family_name': 'Last000',
+                                 'status': 'FORCE_CHANGE_PASSWORD', 'enabled': True,
+                                 'created': rows[0]['created']}])
+
+    def test_csv_and_ndjson_lines(self):
+        rows = [{'email': u'zo\xe9@example.com', 'status': 'CONFIRMED', 'enabled': True,
+                 'created': None, 'groups': ['administrator', 'general']}]
+        columns = ['email', 'status', 'enabled', 'created', 'groups']
+        lines = list(csv_lines(rows, columns))
+        self.assertEqual(lines, [b'email,status,enabled,created,groups\r\n',
+                                 b'zo\xc3\xa9@example.com,CONFIRMED,True,,administrator;general\r\n'])
+        self.assertEqual(json.loads(list(ndjson_lines(rows))[0]), rows[0])
+
+    def admin_client(self):
+        create_user('admin@example.com', 'Ad', 'Min', group='administrator', password='Secret1!')
+        set_permanent_password('admin@example.com', 'Secret1!')
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'admin@example.com', 'password': 'Secret1!'})
+        return client
+
+    def test_export_view_streams_csv(self):
+        client = self.admin_client()
+        self.create_users(3)
+        response = client.get('/administrator/users/export?attributes=family_name,bogus')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('filename=users.csv', response.headers['Content-Disposition'])
+        rows = list(csv.DictReader(BytesIO(response.data)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(set(rows[0]), set(['email', 'family_name', 'status', 'enabled',
+                                            'created', 'groups']))
+
+    def test_export_view_rejects_unknown_formats(self):
+        response = self.admin_client().get('/administrator/users/export?format=xml')
+        self.assertEqual(response.status_code, 400)
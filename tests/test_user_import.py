@@ -0,0 +1,89 @@
+import unittest
+from io import BytesIO
+
+from app import clients, create_app, email, mail
+from app.cognito_handler import get_user
+from app.user_import import import_users, read_rows
+
+
+def csv_lines(*rows):
+    return BytesIO(b'\n'.join([b'email,first_name,last_name,group'] + list(rows)) + b'\n')
+
+
+class UserImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app.config['EMAIL_QUEUE'] = 'local'
+        email._worker_app = self.app
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        cognito = clients.get('cognito-idp')
+        for name in ('administrator', 'general'):
+            cognito.create_group(GroupName=name, UserPoolId='pool')
+
+    def tearDown(self):
+        self.app_context.pop()
+        email._worker_app = None
+        email.close_mail_connection()
+
+    def test_valid_rows_are_created_and_invited(self):
+        rows = read_rows(csv_lines(b'ada@example.com,Ada,Lovelace,administrator',
+                                   b'bob@example.com,Bob,Smith,'))
+        with mail.record_messages() as outbox:
+            report = import_users(rows, 'general', workers=2, rate=None)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(len(report.created), 2)
+        self.assertEqual(sorted(m.recipients[0] for m in outbox),
+                         ['ada@example.com', 'bob@example.com'])
+        self.assertTrue(get_user('ada@example.com').member_of_group('administrator'))
+        self.assertTrue(get_user('bob@example.com').member_of_group('general'))
+
+    def test_invalid_rows_are_reported_by_line(self):
+        rows = read_rows(csv_lines(b'not-an-email,Ada,Lovelace,',
+                                   b'ada@example.com,,Lovelace,',
+                                   b'bob@example.com,Bob,Smith,nosuchgroup',
+                                   b'cy@example.com,Cy,Young,',
+                                   b'CY@example.com,Cy,Young,',
+                                   b'di@example.com,D\xff,Prince,'))
+        report = import_users(rows, 'general', invite=False, rate=None)
+        self.assertEqual([u.email for u in report.created], ['cy@example.com'])
+        self.assertEqual([(line, error) for line, _, error in report.errors], [
+            (2, 'Invalid email address'),
+            (3, 'Missing first_name'),
+            (4, 'Unknown account type nosuchgroup'),
+            (6, 'Duplicate of an earlier row'),
+            (7, 'Not valid UTF-8 text')])
+
+    def test_existing_users_are_reported(self):
+        import_users(read_rows(csv_lines(b'ada@example.com,Ada,Lovelace,')),
+                     'general', invite=False, rate=None)
+        report = import_users(read_rows(csv_lines(b'ada@example.com,Ada,Lovelace,')),
+                              'general', invite=False, rate=None)
+        self.assertEqual(report.errors, [(2, 'ada@example.com', 'Email already registered')])
+
+    def test_rows_beyond_the_limit_are_skipped(self):
+        rows = read_rows(csv_lines(b'ada@example.com,Ada,Lovelace,',
+                                   b'bob@example.com,Bob,Smith,'))
+        report = import_users(rows, 'general', invite=False, rate=None, max_rows=1)
+        self.assertEqual(len(report.created), 1)
+        self.assertEqual(report.errors[0][0], 3)
+
+    def test_missing_columns_are_rejected_up_front(self):
+        with self.assertRaises(ValueError):
+            read_rows(BytesIO(b'email,name\nada@example.com,Ada\n'))
+
+    def test_upload_page(self):
+        from app.cognito_handler import create_user, set_permanent_password
+        create_user('admin@example.com', 'Ad', 'Min', group='administrator', password='Secret1!')
+        set_permanent_password('admin@example.com', 'Secret1!')
+        response = self.app.test_client().post('/administrator/import-users', data={
+            # request_loader logs the admin in from these fields
+            'email': 'admin@example.com', 'password': 'Secret1!',
+            'role': 'general',
+            'file': (csv_lines(b'ada@example.com,Ada,Lovelace,',
+                               b'bad,Bob,Smith,'), 'users.csv'),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Created 1 of 2 users.', response.data)
+        self.assertIn(b'Invalid email address', response.data)
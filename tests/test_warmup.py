@@ -0,0 +1,37 @@
+import unittest
+
+from app import caches, create_app
+from app.models import EditableHTML
+from app.warmup import warm_up
+
+
+class WarmUpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['IDENTITY_BACKEND'] = 'memory'
+        self.app.config['WARM_UP_CLIENTS'] = ['cognito-idp']
+        self.get_many = EditableHTML.__dict__['get_many']
+
+    def tearDown(self):
+        EditableHTML.get_many = self.get_many
+
+    def test_primes_caches_and_reports_each_step(self):
+        EditableHTML.get_many = staticmethod(lambda names: dict((n, None) for n in names))
+        report = warm_up(self.app)
+        self.assertEqual(list(report), ['clients', 'groups', 'signing_keys',
+                                        'templates', 'editable_html'])
+        for step, result in report.items():
+            self.assertIsInstance(result, float, step)
+        with self.app.app_context():
+            self.assertIsNotNone(caches.get('group').get('all'))
+            self.assertIsNotNone(caches.get('jwks').get('jwks'))
+        loaded = [name for _, name in self.app.jinja_env.cache.keys()]
+        self.assertIn('account/login.html', loaded)
+
+    def test_failed_step_does_not_stop_the_rest(self):
+        def unavailable(names):
+            raise IOError('DynamoDB unavailable')
+        EditableHTML.get_many = staticmethod(unavailable)
+        report = warm_up(self.app)
+        self.assertEqual(report['editable_html'], 'failed: DynamoDB unavailable')
+        self.assertIsInstance(report['templates'], float)